@@ -47,3 +47,70 @@ AS $$
     ORDER BY embedding <=> query_embedding
     LIMIT match_count;
 $$;
+
+-- Keyset index used by the FastAPI service's embedding replica to poll for new rows
+CREATE INDEX IF NOT EXISTS policy_embeddings_created_at_idx
+ON policy_embeddings (created_at, id);
+
+-- Tombstones let the replica mirror deletes without re-downloading the table
+CREATE TABLE IF NOT EXISTS policy_embeddings_tombstones (
+    id UUID PRIMARY KEY,
+    deleted_at TIMESTAMP WITH TIME ZONE DEFAULT NOW()
+);
+
+-- Keyset index for polling tombstones in (deleted_at, id) order
+DROP INDEX IF EXISTS policy_embeddings_tombstones_deleted_at_idx;
+CREATE INDEX IF NOT EXISTS policy_embeddings_tombstones_keyset_idx
+ON policy_embeddings_tombstones (deleted_at, id);
+
+CREATE OR REPLACE FUNCTION record_policy_embedding_tombstone()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+    INSERT INTO policy_embeddings_tombstones (id, deleted_at)
+    VALUES (OLD.id, NOW())
+    ON CONFLICT (id) DO UPDATE SET deleted_at = EXCLUDED.deleted_at;
+    RETURN OLD;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS policy_embeddings_tombstone_trigger ON policy_embeddings;
+CREATE TRIGGER policy_embeddings_tombstone_trigger
+AFTER DELETE ON policy_embeddings
+FOR EACH ROW EXECUTE FUNCTION record_policy_embedding_tombstone();
+
+-- Binary vector transport: embeddings travel as base64 blobs instead of ~20 KB of JSON text each.
+-- Reads return pgvector's own send format (uint16 dim, uint16 unused, big-endian floats),
+-- optionally cast to halfvec (pgvector >= 0.7) to halve the bytes again.
+CREATE OR REPLACE FUNCTION fetch_policy_embeddings_binary(
+    after_created_at TIMESTAMP WITH TIME ZONE DEFAULT NULL,
+    after_id UUID DEFAULT NULL,
+    max_rows INT DEFAULT 1000,
+    half_precision BOOLEAN DEFAULT FALSE
+)
+RETURNS TABLE (
+    id UUID,
+    content TEXT,
+    source_file TEXT,
+    metadata JSONB,
+    created_at TIMESTAMP WITH TIME ZONE,
+    embedding_b64 TEXT
+)
+LANGUAGE SQL STABLE
+AS $$
+    SELECT
+        id, content, source_file, metadata, created_at,
+        replace(encode(
+            CASE WHEN half_precision THEN halfvec_send(embedding::halfvec) ELSE vector_send(embedding) END,
+            'base64'
+        ), E'\n', '') AS embedding_b64
+    FROM policy_embeddings
+    WHERE after_created_at IS NULL OR (created_at, id) > (after_created_at, after_id)
+    ORDER BY created_at, id
+    LIMIT max_rows;
+$$;
+
+-- Writes use the plain JSON insert; remove the binary insert RPC installed by earlier versions of this script
+DROP FUNCTION IF EXISTS insert_policy_embeddings_binary(JSONB);
+DROP FUNCTION IF EXISTS vector_from_float32_le(BYTEA);
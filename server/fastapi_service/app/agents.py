@@ -0,0 +1,129 @@
+"""
+Catalog of prebuilt pydantic-ai agents.
+
+Each agent (system prompt, output schema and its validators) is built once per
+process at import time. The Gemini model is passed in per run, so the same
+agent object is shared by every concurrent request - pydantic-ai keeps all
+run state on the run itself, not on the agent.
+"""
+
+import time
+from typing import List
+
+from pydantic_ai import Agent, BinaryContent
+from pydantic_ai.models import Model
+
+from .deadlines import call_with_deadline
+from .metrics import PAYLOAD_BYTES, QUOTA_ERRORS, STAGE_LATENCY
+from .request_stats import record_stat
+from .schemas import AadhaarExtractedData, FieldReading, OTPExtractedData, PageTypeReading, PANExtractedData, SignatureAnalysis
+
+
+# Part of every extraction cache key: bump whenever a system prompt or output schema changes
+PROMPT_VERSION = "1"
+
+
+class APIQuotaExceededException(Exception):
+    """Exception raised when API quota is exceeded."""
+    pass
+
+
+AADHAAR_AGENT = Agent(
+    output_type=List[AadhaarExtractedData],
+    system_prompt=(
+        'Extract information from Indian Aadhaar cards only. '
+        'Aadhaar cards have a 12-digit unique identification number, photo, and demographic details. '
+        'The card has Government of India logo and "Government of India" text. '
+        'Look for: Aadhaar number (12 digits), name, date of birth, gender, address, PIN code, father\'s name. '
+        'Return null for missing fields. Be very accurate with the Aadhaar number format (12 digits).'
+    )
+)
+
+PAN_AGENT = Agent(
+    output_type=List[PANExtractedData],
+    system_prompt=(
+        'Extract information from Indian PAN (Permanent Account Number) cards only. '
+        'PAN cards have a 10-character alphanumeric PAN number in format AAAAA9999A, photo, and personal details. '
+        'The card has "INCOME TAX DEPARTMENT GOVT. OF INDIA" header and Indian flag/emblem. '
+        'Look for: PAN number (10 characters), name, father\'s name, date of birth, signature, photo. '
+        'Return null for missing fields. Be very accurate with the PAN number format (5 letters + 4 digits + 1 letter).'
+    )
+)
+
+OTP_AGENT = Agent(
+    output_type=OTPExtractedData,
+    system_prompt=(
+        'Extract the OTP (One-Time Password) from an image. '
+        'The image contains a person\'s face along with a sheet/paper where an OTP is written. '
+        'Look for numerical digits that appear to be an OTP - typically 4-8 digits. '
+        'Focus on any handwritten or printed numbers on papers, signs, or sheets in the image. '
+        'Ignore any numbers that might be part of documents, IDs, or background elements. '
+        'Return the OTP as a string of digits and provide a confidence score (0-1) based on clarity.'
+    )
+)
+
+FIELD_AGENT = Agent(
+    output_type=FieldReading,
+    system_prompt=(
+        'You are given a cropped region of an Indian identity card and asked for exactly one field. '
+        'Read only that field, exactly as printed, and ignore all other text. '
+        'Return null if the field is not visible or not legible in the crop.'
+    )
+)
+
+PAGE_TYPE_AGENT = Agent(
+    output_type=PageTypeReading,
+    system_prompt=(
+        'You are given one page or photo from an Indian KYC bundle, possibly a black-and-white photocopy. '
+        'Answer "aadhaar" for an Aadhaar card or e-Aadhaar letter (12-digit number in three groups of four, UIDAI), '
+        '"pan" for a PAN card (10-character number like ABCDE1234F, Income Tax Department), and "other" for anything else. '
+        'Do not extract any other information.'
+    )
+)
+
+SIGNATURE_AGENT = Agent(
+    output_type=SignatureAnalysis,
+    system_prompt=(
+        'You are an expert forensic handwriting analyst specializing in signature verification. '
+        'Analyze the two signature images provided and determine if they were written by the same person. '
+        'Consider stroke patterns, pressure points, letter formations, spacing, slant, and overall flow. '
+        'Provide a confidence score from 0.0 (completely different) to 1.0 (identical). '
+        'A score above 0.6 typically indicates a match. '
+        'Be thorough in your analysis and explain your reasoning.'
+    )
+)
+
+
+async def run_agent(agent: Agent, model: Model, stage: str, prompt: list):
+    """
+    Run a catalog agent against `model`, recording latency and payload size for the stage.
+
+    The call is bounded by the request deadline and may be hedged (see `deadlines`).
+
+    Args:
+        agent: One of the prebuilt agents above
+        model: Model to run against (normally the registry's shared Gemini model)
+        stage: Metrics stage label, e.g. "extract_aadhaar"
+        prompt: User prompt parts, text and BinaryContent
+
+    Returns:
+        The validated agent output
+
+    Raises:
+        APIQuotaExceededException: If the provider rejected the call for quota or rate limits
+        DeadlineExceeded: If the request deadline passed first
+    """
+    payload_bytes = sum(len(part.data) for part in prompt if isinstance(part, BinaryContent))
+    PAYLOAD_BYTES.observe(payload_bytes, stage=stage, direction="to_provider")
+    try:
+        start = time.perf_counter()
+        with STAGE_LATENCY.time(stage=stage, provider="gemini"):
+            result = await call_with_deadline(stage, lambda: agent.run(prompt, model=model))
+        record_stat("X-Gemini-Latency-Ms", (time.perf_counter() - start) * 1000)
+        return result.output
+    except Exception as e:
+        if "429" in str(e) or "RATE_LIMIT_EXCEEDED" in str(e):
+            QUOTA_ERRORS.inc(provider="gemini")
+            raise APIQuotaExceededException("API quota exceeded. Please wait a few minutes or upgrade your plan.")
+        else:
+            raise e
@@ -1,27 +1,64 @@
 import numpy as np
 from typing import List
 
-def retrieve_context(query: str, top_k: int, bedrock_embeddings, supabase) -> List[dict]:
-    query_embedding = bedrock_embeddings.embed_query(query)
+from .metrics import STAGE_LATENCY, FALLBACKS
+from .vector_codec import VECTOR_TRANSPORT_DTYPE, decode_pgvector_batch, split_rows
+
+def retrieve_context(query: str, top_k: int, bedrock_embeddings, supabase, replica=None) -> List[dict]:
+    with STAGE_LATENCY.time(stage="embed_query", provider="bedrock"):
+        query_embedding = bedrock_embeddings.embed_query(query)
     try:
-        response = supabase.rpc(
-            "similarity_search",
-            {
-                "query_embedding": query_embedding,
-                "match_threshold": 0.7,
-                "match_count": top_k
-            }
-        ).execute()
+        with STAGE_LATENCY.time(stage="similarity_search", provider="supabase"):
+            response = supabase.rpc(
+                "similarity_search",
+                {
+                    "query_embedding": query_embedding,
+                    "match_threshold": 0.7,
+                    "match_count": top_k
+                }
+            ).execute()
         if response.data:
             return response.data
     except Exception:
         pass
-    all_embeddings = supabase.table("policy_embeddings").select("*").limit(1000).execute()
+    FALLBACKS.inc(stage="similarity_search")
+    if replica is not None and replica.ready:
+        # Rank against the warm local copy instead of downloading the table
+        with STAGE_LATENCY.time(stage="fallback_rank", provider="replica"):
+            return replica.search(query_embedding, top_k)
+    try:
+        with STAGE_LATENCY.time(stage="fallback_fetch", provider="supabase"):
+            rows = supabase.rpc(
+                "fetch_policy_embeddings_binary",
+                {"max_rows": 1000, "half_precision": VECTOR_TRANSPORT_DTYPE == "float16"}
+            ).execute().data
+        if not rows:
+            return []
+        with STAGE_LATENCY.time(stage="fallback_rank", provider="local"):
+            records, blobs = split_rows(rows)
+            return _rank_matrix(query_embedding, records, decode_pgvector_batch(blobs), top_k)
+    except Exception as e:
+        # RPC not installed yet (see setup_supabase.sql), use the JSON text path
+        print(f"Binary embedding fetch failed, falling back to JSON: {e}")
+    with STAGE_LATENCY.time(stage="fallback_fetch_json", provider="supabase"):
+        all_embeddings = supabase.table("policy_embeddings").select("*").limit(1000).execute()
     if not all_embeddings.data:
         return []
+    with STAGE_LATENCY.time(stage="fallback_rank", provider="local"):
+        return _rank_records(query_embedding, all_embeddings.data, top_k)
+
+def _rank_matrix(query_embedding: List[float], records: List[dict], matrix: np.ndarray, top_k: int) -> List[dict]:
+    query_vec = np.asarray(query_embedding, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1) * np.linalg.norm(query_vec)
+    # Zero-norm rows can't be compared, push them to the bottom instead of dividing by zero
+    sims = np.divide(matrix @ query_vec, norms, out=np.full(len(records), -np.inf, dtype=np.float32), where=norms > 0)
+    order = np.argsort(-sims)[:top_k]
+    return [records[i] for i in order if np.isfinite(sims[i])]
+
+def _rank_records(query_embedding: List[float], records: List[dict], top_k: int) -> List[dict]:
     query_vec = np.array(query_embedding, dtype=np.float32)
     scored = []
-    for record in all_embeddings.data:
+    for record in records:
         try:
             # Ensure embedding is properly converted to float array
             emb_data = record["embedding"]
@@ -56,12 +93,13 @@ Please provide a detailed answer that thoroughly addresses the question using th
     return prompt
 
 def generate_answer(prompt: str, ibm_model, max_tokens: int = 128) -> str:
-    response = ibm_model.generate(
-        prompt=prompt,
-        params={
-            "max_new_tokens": max_tokens,
-            "temperature": 0.7,
-            "top_p": 0.9
-        }
-    )
+    with STAGE_LATENCY.time(stage="generate", provider="watsonx"):
+        response = ibm_model.generate(
+            prompt=prompt,
+            params={
+                "max_new_tokens": max_tokens,
+                "temperature": 0.7,
+                "top_p": 0.9
+            }
+        )
     return response['results'][0]['generated_text']
@@ -0,0 +1,242 @@
+"""
+Long-lived, connection-pooled provider clients.
+
+The registry is built once per worker process in FastAPI's lifespan hook and
+handed to the routers through dependencies, so every request reuses the same
+Gemini HTTP pool, Bedrock/Supabase/watsonx sessions and agent wrappers instead
+of opening new connections.
+"""
+
+import asyncio
+import os
+from typing import Optional
+
+import httpx
+from botocore.config import Config
+from fastapi import HTTPException, Request
+from fastapi.concurrency import run_in_threadpool
+from ibm_watsonx_ai.credentials import Credentials
+from ibm_watsonx_ai.foundation_models import ModelInference
+from langchain_aws import BedrockEmbeddings
+from pydantic_ai.models.gemini import GeminiModel
+from pydantic_ai.providers.google_gla import GoogleGLAProvider
+from supabase import Client, create_client
+
+from .embedding_replica import EmbeddingReplica
+from .extraction_cache import EXTRACTION_CACHE_ENABLED, ExtractionCache
+from .jobs import JobQueue
+from .otp_recognizer import OTP_RECOGNIZER_ENABLED, OtpRecognizer
+from .rasterizer import PdfRasterizer
+from .signature_store import SignatureStore
+from .signature_verifier import SignatureVerifier
+from .utils import OcrAgent
+
+GEMINI_MODEL = "gemini-2.0-flash-lite"
+EMBEDDING_MODEL = "amazon.titan-embed-text-v1"
+IBM_MODEL = "meta-llama/llama-2-13b-chat"  # alternatives: ibm/granite-13b-instruct-v2, mistralai/mistral-small-3-1-24b-instruct-2503
+IBM_URL = os.getenv("IBM_URL", "https://us-south.ml.cloud.ibm.com")
+# Point Gemini / Bedrock at another endpoint, e.g. the load-test stand-ins (benchmarks/provider_standins.py)
+GEMINI_BASE_URL = os.getenv("GEMINI_BASE_URL")
+BEDROCK_ENDPOINT_URL = os.getenv("BEDROCK_ENDPOINT_URL")
+
+# Connection pool sizing, shared by all requests handled by this worker
+HTTP_MAX_CONNECTIONS = int(os.getenv("HTTP_MAX_CONNECTIONS", "100"))
+HTTP_MAX_KEEPALIVE = int(os.getenv("HTTP_MAX_KEEPALIVE", "20"))
+HTTP_TIMEOUT_SECONDS = float(os.getenv("HTTP_TIMEOUT_SECONDS", "120"))
+WARMUP_CLIENTS = os.getenv("WARMUP_CLIENTS", "true").lower() == "true"
+# Bedrock has no free call on the runtime endpoint: warming it is one billed embedding per worker start
+WARMUP_BEDROCK = os.getenv("WARMUP_BEDROCK", "false").lower() == "true"
+EMBEDDING_REPLICA_ENABLED = os.getenv("EMBEDDING_REPLICA_ENABLED", "true").lower() == "true"
+
+
+class GeminiProvider(GoogleGLAProvider):
+    """Google GLA provider whose base URL can be overridden with GEMINI_BASE_URL."""
+
+    @property
+    def base_url(self) -> str:
+        return GEMINI_BASE_URL or super().base_url
+
+
+class ClientRegistry:
+    """Owns every provider client for the lifetime of the worker process."""
+
+    def __init__(self):
+        self.gemini_http_client: Optional[httpx.AsyncClient] = None
+        self.gemini_provider: Optional[GeminiProvider] = None
+        self.gemini_model: Optional[GeminiModel] = None
+        self.rasterizer: Optional[PdfRasterizer] = None
+        self.extraction_cache: Optional[ExtractionCache] = None
+        self.otp_recognizer: Optional[OtpRecognizer] = None
+        self.ocr_agent: Optional[OcrAgent] = None
+        self.signature_verifier: Optional[SignatureVerifier] = None
+        self.signature_store: Optional[SignatureStore] = None
+        self.job_queue: Optional[JobQueue] = None
+        self.bedrock_embeddings: Optional[BedrockEmbeddings] = None
+        self.supabase: Optional[Client] = None
+        self.ibm_model: Optional[ModelInference] = None
+        self.embedding_replica: Optional[EmbeddingReplica] = None
+        # Why a provider is unavailable, surfaced to callers instead of a bare 500
+        self.errors = {}
+
+    async def start(self) -> None:
+        """Build all clients from the environment and optionally warm their connections."""
+        self.rasterizer = PdfRasterizer()
+        if EXTRACTION_CACHE_ENABLED:
+            # Decrypts the persisted entries, so keep it off the event loop
+            self.extraction_cache = await run_in_threadpool(ExtractionCache)
+        if OTP_RECOGNIZER_ENABLED:
+            self.otp_recognizer = await run_in_threadpool(OtpRecognizer.load)
+        # Templates are matched locally, so the store is available without Gemini
+        self.signature_store = SignatureStore()
+        await self.signature_store.start()
+        self._build_gemini()
+        await run_in_threadpool(self._build_chat_clients)
+        if WARMUP_CLIENTS:
+            await self.warm_up()
+        if self.ocr_agent is not None:
+            try:
+                self.job_queue = JobQueue(self.ocr_agent)
+            except ValueError as e:
+                self.errors["jobs"] = str(e)
+            else:
+                await self.job_queue.start()
+        if self.supabase is not None and EMBEDDING_REPLICA_ENABLED:
+            self.embedding_replica = EmbeddingReplica(self.supabase)
+            await self.embedding_replica.start()
+
+    def _build_gemini(self) -> None:
+        api_key = os.getenv("GEMINI_API_KEY")
+        if not api_key:
+            self.errors["gemini"] = "GEMINI_API_KEY environment variable is required"
+            return
+
+        self.gemini_http_client = httpx.AsyncClient(
+            timeout=HTTP_TIMEOUT_SECONDS,
+            limits=httpx.Limits(
+                max_connections=HTTP_MAX_CONNECTIONS,
+                max_keepalive_connections=HTTP_MAX_KEEPALIVE,
+            ),
+        )
+        self.gemini_provider = GeminiProvider(api_key=api_key, http_client=self.gemini_http_client)
+        self.gemini_model = GeminiModel(GEMINI_MODEL, provider=self.gemini_provider)
+        self.ocr_agent = OcrAgent(
+            model=self.gemini_model, rasterizer=self.rasterizer, cache=self.extraction_cache,
+            otp_recognizer=self.otp_recognizer,
+        )
+        self.signature_verifier = SignatureVerifier(model=self.gemini_model)
+
+    def _build_chat_clients(self) -> None:
+        try:
+            self.bedrock_embeddings = BedrockEmbeddings(
+                model_id=EMBEDDING_MODEL,
+                region_name=os.getenv("AWS_REGION"),
+                config=Config(max_pool_connections=HTTP_MAX_KEEPALIVE),
+                endpoint_url=BEDROCK_ENDPOINT_URL,
+            )
+        except Exception as e:
+            self.errors["bedrock"] = str(e)
+
+        supabase_url = os.getenv("SUPABASE_URL")
+        supabase_key = os.getenv("SUPABASE_ANON_KEY")
+        if supabase_url and supabase_key:
+            try:
+                self.supabase = create_client(supabase_url, supabase_key)
+            except Exception as e:
+                self.errors["supabase"] = str(e)
+        else:
+            self.errors["supabase"] = "SUPABASE_URL and SUPABASE_ANON_KEY environment variables are required"
+
+        try:
+            self.ibm_model = ModelInference(
+                model_id=IBM_MODEL,
+                credentials=Credentials(url=IBM_URL, api_key=os.getenv("IBM_API_KEY")),
+                project_id=os.getenv("IBM_PROJECT_ID"),
+            )
+        except Exception as e:
+            self.errors["watsonx"] = str(e)
+
+    async def warm_up(self) -> None:
+        """Open a connection to every provider so the first real request skips the TLS handshake."""
+        checks = []
+        if self.gemini_provider is not None:
+            checks.append(("gemini", self._warm_up_gemini()))
+        if self.supabase is not None:
+            checks.append(("supabase", run_in_threadpool(
+                lambda: self.supabase.table("policy_embeddings").select("id").limit(1).execute()
+            )))
+        if self.bedrock_embeddings is not None and WARMUP_BEDROCK:
+            checks.append(("bedrock", run_in_threadpool(self.bedrock_embeddings.embed_query, "warm up")))
+        # ModelInference already talked to watsonx while validating the model id
+
+        if self.rasterizer is not None:
+            checks.append(("rasterizer", self.rasterizer.warm_up()))
+
+        results = await asyncio.gather(*(check for _, check in checks), return_exceptions=True)
+        for (name, _), result in zip(checks, results):
+            if isinstance(result, Exception):
+                print(f"Warm-up of {name} client failed: {result}")
+
+    async def _warm_up_gemini(self) -> None:
+        # Listing models is free and authenticates against the same host as generateContent
+        response = await self.gemini_http_client.get(
+            self.gemini_provider.base_url,
+            params={"key": os.getenv("GEMINI_API_KEY"), "pageSize": 1},
+        )
+        response.raise_for_status()
+
+    async def close(self) -> None:
+        """Release pooled connections on shutdown."""
+        if self.job_queue is not None:
+            # Documents in flight keep their lease and are picked up again after restart
+            await self.job_queue.stop()
+        if self.embedding_replica is not None:
+            await self.embedding_replica.stop()
+        if self.rasterizer is not None:
+            self.rasterizer.close()
+        if self.gemini_http_client is not None:
+            await self.gemini_http_client.aclose()
+        if self.ibm_model is not None and hasattr(self.ibm_model, "close_persistent_connection"):
+            self.ibm_model.close_persistent_connection()
+        if self.supabase is not None:
+            session = getattr(self.supabase.postgrest, "session", None)
+            if session is not None:
+                session.close()
+
+
+def get_clients(request: Request) -> ClientRegistry:
+    return request.app.state.clients
+
+
+def _require(registry: ClientRegistry, name: str, client):
+    if client is None:
+        raise HTTPException(status_code=503, detail=f"{name} client is not available: {registry.errors.get(name, 'not configured')}")
+    return client
+
+
+def get_ocr_agent(request: Request) -> OcrAgent:
+    registry = get_clients(request)
+    return _require(registry, "gemini", registry.ocr_agent)
+
+
+def get_signature_verifier(request: Request) -> SignatureVerifier:
+    registry = get_clients(request)
+    return _require(registry, "gemini", registry.signature_verifier)
+
+
+def get_signature_store(request: Request) -> SignatureStore:
+    registry = get_clients(request)
+    return _require(registry, "signature_store", registry.signature_store)
+
+
+def get_job_queue(request: Request) -> JobQueue:
+    registry = get_clients(request)
+    return _require(registry, "jobs" if "jobs" in registry.errors else "gemini", registry.job_queue)
+
+
+def get_chat_clients(request: Request) -> ClientRegistry:
+    """Registry with the Bedrock, Supabase and watsonx clients the RAG chat needs."""
+    registry = get_clients(request)
+    _require(registry, "bedrock", registry.bedrock_embeddings)
+    _require(registry, "supabase", registry.supabase)
+    _require(registry, "watsonx", registry.ibm_model)
+    return registry
@@ -0,0 +1,278 @@
+"""
+Request deadlines, hedged provider calls and cancellation on client disconnect.
+
+Every request gets a deadline: the client's `X-Request-Timeout-Ms` header
+(a positive number, capped at REQUEST_MAX_DEADLINE_SECONDS), else the
+route's default (see `route_deadline`), else REQUEST_DEADLINE_SECONDS. It
+lives in a contextvar, so it reaches every provider call below the handler,
+including `asyncio.gather` fan-outs, without being passed around.
+
+`call_with_deadline` wraps one provider call:
+- bounds it by the time the request has left (504 when it runs out)
+- optionally hedges it: if the call is still running after the stage's
+  recent p95 latency, an identical call is sent and the first to succeed
+  wins. Hedges are capped at HEDGE_BUDGET_RATIO of calls.
+
+`DeadlineMiddleware` cancels the handler when the client disconnects. The
+cancellation reaches the async provider calls in flight (Gemini), so those
+stop instead of running to completion. Blocking SDK work in the threadpool
+(Bedrock embeddings, watsonx) can't be interrupted: the request stops
+waiting for it, but the thread runs the call to completion and keeps its
+threadpool slot until then.
+"""
+
+import asyncio
+import math
+import os
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Deque, Dict, NamedTuple, Optional, TypeVar
+
+from fastapi import HTTPException
+
+from .metrics import DEADLINES_EXCEEDED, DISCONNECTS, HEDGES
+
+T = TypeVar("T")
+
+DEADLINE_HEADER = "x-request-timeout-ms"
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "120"))
+REQUEST_MAX_DEADLINE_SECONDS = float(os.getenv("REQUEST_MAX_DEADLINE_SECONDS", "300"))
+# Route defaults for the interactive endpoints
+OTP_DEADLINE_SECONDS = float(os.getenv("OTP_DEADLINE_SECONDS", "30"))
+SIGNATURE_DEADLINE_SECONDS = float(os.getenv("SIGNATURE_DEADLINE_SECONDS", "60"))
+CHAT_DEADLINE_SECONDS = float(os.getenv("CHAT_DEADLINE_SECONDS", "60"))
+# Document extraction re-renders failing pages and batches fan out over many pages, so they get longer
+OCR_DEADLINE_SECONDS = float(os.getenv("OCR_DEADLINE_SECONDS", "300"))
+OCR_BATCH_DEADLINE_SECONDS = float(os.getenv("OCR_BATCH_DEADLINE_SECONDS", "900"))
+SIGNATURE_BATCH_DEADLINE_SECONDS = float(os.getenv("SIGNATURE_BATCH_DEADLINE_SECONDS", "900"))
+
+HEDGING_ENABLED = os.getenv("HEDGING_ENABLED", "false").lower() == "true"
+# Hedges may add at most this fraction of extra provider calls
+HEDGE_BUDGET_RATIO = float(os.getenv("HEDGE_BUDGET_RATIO", "0.05"))
+HEDGE_PERCENTILE = float(os.getenv("HEDGE_PERCENTILE", "95"))
+HEDGE_MIN_SAMPLES = int(os.getenv("HEDGE_MIN_SAMPLES", "20"))
+HEDGE_WINDOW = 200
+
+
+class Deadline(NamedTuple):
+    at: float  # time.monotonic() value
+    explicit: bool  # set by the client, route defaults don't override it
+
+
+_deadline: ContextVar[Optional[Deadline]] = ContextVar("request_deadline", default=None)
+
+
+class DeadlineExceeded(HTTPException):
+    """The request's deadline passed while waiting on a provider; surfaces as 504."""
+
+    def __init__(self, stage: str):
+        super().__init__(status_code=504, detail=f"Request deadline exceeded while waiting for {stage}")
+
+
+def set_deadline(seconds: float, explicit: bool = False) -> None:
+    _deadline.set(Deadline(time.monotonic() + seconds, explicit))
+
+
+def remaining() -> Optional[float]:
+    """Seconds left for the current request, None outside a request (e.g. background jobs)."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline.at - time.monotonic()
+
+
+def route_deadline(seconds: float):
+    """
+    Dependency that gives a route its own default deadline, e.g.
+    `APIRouter(dependencies=[Depends(route_deadline(60))])`.
+
+    A deadline sent by the client still takes precedence.
+    """
+    async def apply() -> None:
+        # Must be async: a sync dependency runs in a worker thread and its contextvar changes would be lost
+        deadline = _deadline.get()
+        if deadline is None or not deadline.explicit:
+            set_deadline(seconds)
+    return apply
+
+
+class _LatencyWindow:
+    """Recent successful call latencies of one stage, for the hedge delay."""
+
+    def __init__(self):
+        self.samples: Deque[float] = deque(maxlen=HEDGE_WINDOW)
+
+    def percentile(self, q: float) -> Optional[float]:
+        if len(self.samples) < HEDGE_MIN_SAMPLES:
+            return None
+        ordered = sorted(self.samples)
+        return ordered[min(len(ordered) - 1, int(len(ordered) * q / 100))]
+
+
+class HedgeBudget:
+    """Token bucket: every primary call earns `ratio` of a hedge, every hedge spends one."""
+
+    def __init__(self, ratio: float = HEDGE_BUDGET_RATIO, burst: float = 10.0):
+        self.ratio = ratio
+        self.burst = burst
+        self.tokens = 0.0
+        self._lock = threading.Lock()
+
+    def earn(self) -> None:
+        with self._lock:
+            self.tokens = min(self.burst, self.tokens + self.ratio)
+
+    def spend(self) -> bool:
+        with self._lock:
+            if self.tokens < 1:
+                return False
+            self.tokens -= 1
+            return True
+
+
+_windows: Dict[str, _LatencyWindow] = {}
+_budget = HedgeBudget()
+
+
+def _window(stage: str) -> _LatencyWindow:
+    window = _windows.get(stage)
+    if window is None:
+        window = _windows.setdefault(stage, _LatencyWindow())
+    return window
+
+
+async def _timed(call: Callable[[], Awaitable[T]]):
+    start = time.perf_counter()
+    result = await call()
+    return result, time.perf_counter() - start
+
+
+async def call_with_deadline(stage: str, call: Callable[[], Awaitable[T]], hedge: bool = True) -> T:
+    """
+    Await `call()` within the request's remaining time, hedging it when it runs long.
+
+    Args:
+        stage: Metrics stage, also the key for the stage's latency history
+        call: Starts one provider call; invoked a second time for a hedge
+        hedge: Allow a hedge for this call (only when HEDGING_ENABLED)
+
+    Raises:
+        DeadlineExceeded: The deadline passed first; every call still running is cancelled
+    """
+    timeout = remaining()
+    if timeout is not None and timeout <= 0:
+        DEADLINES_EXCEEDED.inc(stage=stage)
+        raise DeadlineExceeded(stage)
+
+    window = _window(stage)
+    hedge_delay = window.percentile(HEDGE_PERCENTILE) if HEDGING_ENABLED and hedge else None
+    _budget.earn()
+    tasks = [asyncio.ensure_future(_timed(call))]
+    try:
+        if hedge_delay is not None and (timeout is None or hedge_delay < timeout):
+            done, _ = await asyncio.wait(tasks, timeout=hedge_delay)
+            if not done and _budget.spend():
+                HEDGES.inc(stage=stage, outcome="sent")
+                tasks.append(asyncio.ensure_future(_timed(call)))
+
+        pending = set(tasks)
+        error = None
+        while pending:
+            left = remaining()
+            if left is not None and left <= 0:
+                break
+            done, pending = await asyncio.wait(pending, timeout=left, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    result, latency = task.result()
+                    window.samples.append(latency)
+                    if task is not tasks[0]:
+                        HEDGES.inc(stage=stage, outcome="won")
+                    return result
+                error = error or task.exception()
+            if not done:
+                break
+        if error is not None and not pending:
+            # Every attempt failed: report the first failure as is
+            raise error
+        DEADLINES_EXCEEDED.inc(stage=stage)
+        raise DeadlineExceeded(stage)
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+
+
+async def wait_with_deadline(stage: str, awaitable: Awaitable[T]) -> T:
+    """
+    Bound a single awaitable (e.g. blocking SDK work in the threadpool) by the request deadline, without hedging.
+
+    Only the wait is bounded: a threadpool call that is still running when the
+    deadline passes keeps running in its thread, its result is discarded.
+    """
+    return await call_with_deadline(stage, lambda: awaitable, hedge=False)
+
+
+class DeadlineMiddleware:
+    """
+    ASGI middleware: starts each request's deadline and cancels the handler
+    when the client disconnects before the response is complete.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        seconds, explicit = REQUEST_DEADLINE_SECONDS, False
+        for name, value in scope.get("headers", []):
+            if name.decode("latin-1").lower() == DEADLINE_HEADER:
+                try:
+                    requested = float(value) / 1000.0
+                except ValueError:
+                    continue
+                # nan, inf and non-positive values are ignored like malformed ones
+                if math.isfinite(requested) and requested > 0:
+                    seconds, explicit = min(requested, REQUEST_MAX_DEADLINE_SECONDS), True
+        set_deadline(seconds, explicit)
+
+        body_done = asyncio.Event()
+        disconnected = asyncio.Event()
+
+        async def app_receive():
+            # Once the body is read, only the watcher below reads from the client
+            if body_done.is_set():
+                await disconnected.wait()
+                return {"type": "http.disconnect"}
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                disconnected.set()
+            elif not message.get("more_body", False):
+                body_done.set()
+            return message
+
+        handler = asyncio.ensure_future(self.app(scope, app_receive, send))
+
+        async def watch():
+            await body_done.wait()
+            while True:
+                message = await receive()
+                if message["type"] == "http.disconnect":
+                    disconnected.set()
+                    if not handler.done():
+                        DISCONNECTS.inc()
+                        handler.cancel()
+                    return
+
+        watcher = asyncio.ensure_future(watch())
+        try:
+            await handler
+        except asyncio.CancelledError:
+            if not disconnected.is_set():
+                raise
+            # Nobody is left to send a response to
+        finally:
+            watcher.cancel()
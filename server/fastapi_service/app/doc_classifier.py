@@ -0,0 +1,87 @@
+"""
+Local Aadhaar / PAN page classification from colour cues.
+
+Lets a mixed KYC bundle go through `/ocr/extract` in one pass: every page is
+classified on a small render (a few milliseconds with OpenCV) and sent only
+to the matching extractor.
+
+- PAN cards (old and current designs) have a light blue/cyan background that
+  covers most of the card.
+- Aadhaar cards and e-Aadhaar letters are white with the saffron and green
+  bands of the header; blue is rare on them.
+
+When a card outline is found the colours are measured inside it only, so a
+card photographed on a blue desk or cloth is judged by the card itself.
+
+A page that shows neither cue clearly - black-and-white photocopies always
+end up here - is "unknown"; `/ocr/extract` then asks Gemini for the type on
+a small render (DOC_CLASSIFIER_GEMINI_FALLBACK) before falling back to the
+caller's default.
+"""
+
+import os
+from typing import NamedTuple
+
+import cv2
+import numpy as np
+
+from .page_filter import find_card, is_blank
+
+DOC_CLASSIFIER_PAN_BLUE_RATIO = float(os.getenv("DOC_CLASSIFIER_PAN_BLUE_RATIO", "0.04"))
+DOC_CLASSIFIER_FLAG_RATIO = float(os.getenv("DOC_CLASSIFIER_FLAG_RATIO", "0.0015"))
+# Classification only needs colour, render PDF pages this small for it
+DOC_CLASSIFIER_DPI = int(os.getenv("DOC_CLASSIFIER_DPI", "50"))
+# Ask Gemini for the type of pages without a colour cue, on a render just large enough to read the card
+DOC_CLASSIFIER_GEMINI_FALLBACK = os.getenv("DOC_CLASSIFIER_GEMINI_FALLBACK", "true").lower() == "true"
+DOC_CLASSIFIER_FALLBACK_DPI = int(os.getenv("DOC_CLASSIFIER_FALLBACK_DPI", "100"))
+DOC_CLASSIFIER_FALLBACK_LONG_EDGE = int(os.getenv("DOC_CLASSIFIER_FALLBACK_LONG_EDGE", "768"))
+CLASSIFY_LONG_EDGE = 400
+
+
+class PageClass(NamedTuple):
+    doc_type: str  # aadhaar, pan or unknown
+    blue_ratio: float
+    saffron_ratio: float
+    green_ratio: float
+
+
+def colour_ratios(image: np.ndarray):
+    """Fractions of the page that are PAN blue, saffron and green (OpenCV hue is 0-180)."""
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    hue, saturation, value = hsv[:, :, 0], hsv[:, :, 1], hsv[:, :, 2]
+    lit = value > 90
+    blue = lit & (saturation > 25) & (hue >= 85) & (hue <= 125)
+    saffron = lit & (saturation > 90) & (hue >= 5) & (hue <= 25)
+    green = lit & (saturation > 60) & (hue >= 35) & (hue <= 85)
+    return float(blue.mean()), float(saffron.mean()), float(green.mean())
+
+
+def is_blank_page(image_bytes: bytes) -> bool:
+    """Blank separator sheets are left unknown rather than sent to Gemini for classification."""
+    gray = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_2)
+    return gray is None or is_blank(gray)
+
+
+def classify_page(image_bytes: bytes) -> PageClass:
+    """Classify one page or photo as "aadhaar", "pan" or "unknown"."""
+    image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        return PageClass("unknown", 0.0, 0.0, 0.0)
+    scale = CLASSIFY_LONG_EDGE / float(max(image.shape[:2]))
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+
+    card = find_card(image)
+    if card is not None:
+        x, y, width, height = card
+        image = image[y:y + height, x:x + width]
+
+    blue, saffron, green = colour_ratios(image)
+    # Blue has to dominate: old PAN cards carry a small flag, so flag colours alone don't decide
+    if blue >= DOC_CLASSIFIER_PAN_BLUE_RATIO and blue > 2 * (saffron + green):
+        doc_type = "pan"
+    elif saffron >= DOC_CLASSIFIER_FLAG_RATIO and green >= DOC_CLASSIFIER_FLAG_RATIO:
+        doc_type = "aadhaar"
+    else:
+        doc_type = "unknown"
+    return PageClass(doc_type, blue, saffron, green)
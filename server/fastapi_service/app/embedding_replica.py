@@ -0,0 +1,237 @@
+"""
+In-process replica of the `policy_embeddings` table.
+
+The replica is loaded once at startup and then kept fresh by polling Supabase
+for rows with a newer `created_at` and for tombstones of deleted rows, so the
+fallback retrieval ranks against local memory instead of downloading the
+table on every request.
+"""
+
+import asyncio
+import json
+import os
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+from .metrics import STAGE_LATENCY
+from .vector_codec import VECTOR_TRANSPORT_DTYPE, decode_pgvector_batch, split_rows
+
+TABLE = "policy_embeddings"
+TOMBSTONE_TABLE = "policy_embeddings_tombstones"
+
+REPLICA_POLL_SECONDS = float(os.getenv("EMBEDDING_REPLICA_POLL_SECONDS", "30"))
+REPLICA_PAGE_SIZE = int(os.getenv("EMBEDDING_REPLICA_PAGE_SIZE", "500"))
+
+
+def parse_embedding(value) -> np.ndarray:
+    """Convert a pgvector value (JSON text or list) to a float32 vector."""
+    if isinstance(value, str):
+        value = json.loads(value)
+    return np.asarray(value, dtype=np.float32)
+
+
+class _Snapshot:
+    """Immutable view of the replica, swapped atomically so readers never take a lock."""
+
+    def __init__(self, ids: List[str], records: List[dict], matrix: np.ndarray):
+        self.ids = ids
+        self.records = records
+        self.matrix = matrix  # rows are L2-normalized embeddings
+        self.index = {record_id: i for i, record_id in enumerate(ids)}
+
+
+class EmbeddingReplica:
+    """Local copy of `policy_embeddings` with incremental background sync."""
+
+    def __init__(self, supabase, poll_interval: float = REPLICA_POLL_SECONDS, page_size: int = REPLICA_PAGE_SIZE):
+        self.supabase = supabase
+        self.poll_interval = poll_interval
+        self.page_size = page_size
+        self._snapshot = _Snapshot([], [], np.zeros((0, 0), dtype=np.float32))
+        self._sync_lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._rows_cursor: Optional[Tuple[str, str]] = None
+        self._tombstone_cursor: Optional[Tuple[str, str]] = None
+        self._tombstones_supported = True
+        self._binary_supported = True
+        self.last_sync: Optional[float] = None
+        self.last_error: Optional[str] = None
+
+    @property
+    def ready(self) -> bool:
+        return self.last_sync is not None
+
+    async def start(self) -> None:
+        """Load the table, then keep polling for deltas in the background."""
+        try:
+            await run_in_threadpool(self.sync)
+        except Exception as e:
+            # Retrieval falls back to Supabase until a sync succeeds
+            self.last_error = str(e)
+            print(f"Initial embedding replica load failed: {e}")
+        self._task = asyncio.create_task(self._poll())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _poll(self) -> None:
+        while True:
+            await asyncio.sleep(self.poll_interval)
+            try:
+                await run_in_threadpool(self.sync)
+            except Exception as e:
+                self.last_error = str(e)
+                print(f"Embedding replica sync failed: {e}")
+
+    def sync(self) -> None:
+        """Fetch rows and tombstones newer than the last seen ones and apply them."""
+        with self._sync_lock, STAGE_LATENCY.time(stage="replica_sync", provider="supabase"):
+            records, vectors, rows_cursor = self._fetch_new_rows()
+            deletes, tombstone_cursor = self._fetch_tombstones()
+            if records or deletes:
+                self._apply(records, vectors, deletes)
+            # Only advance the cursors once the deltas are applied, so a failed sync is retried in full
+            self._rows_cursor, self._tombstone_cursor = rows_cursor, tombstone_cursor
+            self.last_sync = time.time()
+            self.last_error = None
+
+    def _fetch_new_rows(self) -> Tuple[List[dict], List[np.ndarray], Optional[Tuple[str, str]]]:
+        records, vectors = [], []
+        cursor = self._rows_cursor
+        while True:
+            page = self._fetch_page(cursor)
+            if page:
+                cursor = (page[-1]["created_at"], page[-1]["id"])
+                page_records, page_vectors = self._decode_page(page)
+                records.extend(page_records)
+                vectors.extend(page_vectors)
+            if len(page) < self.page_size:
+                return records, vectors, cursor
+
+    def _fetch_page(self, cursor: Optional[Tuple[str, str]]) -> List[dict]:
+        """Next page after `cursor` in (created_at, id) order, over the binary RPC when available."""
+        if self._binary_supported:
+            params = {"max_rows": self.page_size, "half_precision": VECTOR_TRANSPORT_DTYPE == "float16"}
+            if cursor is not None:
+                params["after_created_at"], params["after_id"] = cursor
+            try:
+                return self.supabase.rpc("fetch_policy_embeddings_binary", params).execute().data or []
+            except Exception as e:
+                # PGRST202: the RPC is not installed yet (see setup_supabase.sql); other errors are retried next poll
+                if "PGRST202" not in str(e):
+                    raise
+                self._binary_supported = False
+                print(f"Binary embedding fetch unavailable, replica will sync over JSON: {e}")
+
+        query = self.supabase.table(TABLE).select("*").order("created_at").order("id").limit(self.page_size)
+        if cursor is not None:
+            # Keyset pagination on (created_at, id): rows inserted in one statement share a timestamp
+            created_at, last_id = cursor
+            query = query.or_(f'created_at.gt."{created_at}",and(created_at.eq."{created_at}",id.gt.{last_id})')
+        return query.execute().data or []
+
+    def _decode_page(self, page: List[dict]) -> Tuple[List[dict], List[np.ndarray]]:
+        if "embedding_b64" in page[0]:
+            records, blobs = split_rows(page)
+            return records, list(decode_pgvector_batch(blobs))
+
+        records, vectors = [], []
+        for row in page:
+            try:
+                vectors.append(parse_embedding(row["embedding"]))
+            except (ValueError, TypeError) as e:
+                print(f"Skipping record with invalid embedding: {e}")
+                continue
+            records.append({key: value for key, value in row.items() if key != "embedding"})
+        return records, vectors
+
+    def _fetch_tombstones(self) -> Tuple[List[str], Optional[Tuple[str, str]]]:
+        if not self._tombstones_supported:
+            return [], self._tombstone_cursor
+        deletes = []
+        cursor = self._tombstone_cursor
+        while True:
+            try:
+                page = self._fetch_tombstone_page(cursor)
+            except Exception as e:
+                # 42P01 / PGRST205: table not created yet (see setup_supabase.sql), keep serving inserts only;
+                # other errors are retried next poll
+                if "42P01" not in str(e) and "PGRST205" not in str(e):
+                    raise
+                self._tombstones_supported = False
+                print(f"Embedding replica tombstones unavailable, deletes will not be mirrored: {e}")
+                return [], self._tombstone_cursor
+            if page:
+                cursor = (page[-1]["deleted_at"], page[-1]["id"])
+                deletes.extend(tombstone["id"] for tombstone in page)
+            if len(page) < self.page_size:
+                return deletes, cursor
+
+    def _fetch_tombstone_page(self, cursor: Optional[Tuple[str, str]]) -> List[dict]:
+        """Next page of tombstones after `cursor` in (deleted_at, id) order."""
+        query = self.supabase.table(TOMBSTONE_TABLE).select("id,deleted_at").order("deleted_at").order("id").limit(self.page_size)
+        if cursor is not None:
+            # A bulk delete stamps every tombstone with the same NOW(), so the id breaks ties
+            deleted_at, last_id = cursor
+            query = query.or_(f'deleted_at.gt."{deleted_at}",and(deleted_at.eq."{deleted_at}",id.gt.{last_id})')
+        return query.execute().data or []
+
+    def _apply(self, upserts: List[dict], vectors: List[np.ndarray], deletes: List[str]) -> None:
+        current = self._snapshot
+        deleted = set(deletes)
+        records: Dict[str, Tuple[dict, np.ndarray]] = {
+            record_id: (current.records[i], current.matrix[i])
+            for record_id, i in current.index.items() if record_id not in deleted
+        }
+        for record, vector in zip(upserts, vectors):
+            if record["id"] in deleted:
+                continue
+            norm = np.linalg.norm(vector)
+            if norm == 0:
+                continue
+            records[record["id"]] = (record, vector / norm)
+
+        ids = list(records)
+        if ids:
+            matrix = np.vstack([records[record_id][1] for record_id in ids]).astype(np.float32, copy=False)
+        else:
+            matrix = np.zeros((0, 0), dtype=np.float32)
+        self._snapshot = _Snapshot(ids, [records[record_id][0] for record_id in ids], matrix)
+
+    def search(self, query_embedding: List[float], top_k: int) -> List[dict]:
+        """Return the `top_k` most similar records by cosine similarity."""
+        snapshot = self._snapshot
+        if not snapshot.ids:
+            return []
+        query_vec = np.asarray(query_embedding, dtype=np.float32)
+        query_vec = query_vec / np.linalg.norm(query_vec)
+        scores = snapshot.matrix @ query_vec
+        top_k = min(top_k, len(scores))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best])]
+        return [dict(snapshot.records[i], similarity=float(scores[i])) for i in best]
+
+    def status(self) -> dict:
+        """Replica size and staleness for health output."""
+        snapshot = self._snapshot
+        return {
+            "ready": self.ready,
+            "rows": len(snapshot.ids),
+            "bytes": int(snapshot.matrix.nbytes),
+            "last_sync": datetime.fromtimestamp(self.last_sync, timezone.utc).isoformat() if self.last_sync else None,
+            "staleness_seconds": round(time.time() - self.last_sync, 1) if self.last_sync else None,
+            "tombstones_supported": self._tombstones_supported,
+            "binary_transport": self._binary_supported,
+            "last_error": self.last_error,
+        }
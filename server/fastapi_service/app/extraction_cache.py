@@ -0,0 +1,231 @@
+"""
+Result cache for Gemini extractions, keyed by the images actually sent.
+
+Operators re-upload the same scans many times during a KYC case. Entries are
+keyed by a hash of the preprocessed image bytes, the document type and the
+prompt version; a perceptual hash (difference hash) of each image lets
+re-encoded or re-saved copies of the same scan hit too.
+
+The perceptual tier is off by default (EXTRACTION_CACHE_PHASH_DISTANCE=0
+only matches identical hashes). Cards of the same type share a template and
+a difference hash is dominated by that layout, so with a non-zero distance
+another person's card can hit and return that person's extraction: entries
+are scoped by document type and prompt, not by customer. Leave it at 0
+unless every upload sharing the cache belongs to the same person.
+
+Extractions are PII, so entries are kept in process memory and, when
+EXTRACTION_CACHE_DIR is set, persisted to disk only as Fernet (AES-CBC +
+HMAC) tokens under EXTRACTION_CACHE_KEY, which every worker sharing the
+directory must use; without a key the cache stays in memory. Both tiers
+are bounded by entry count/bytes and a TTL.
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, List, NamedTuple, Optional, Sequence, Tuple
+
+import cv2
+import numpy as np
+from cryptography.fernet import Fernet, InvalidToken
+
+from .metrics import CACHE_LOOKUPS
+
+EXTRACTION_CACHE_ENABLED = os.getenv("EXTRACTION_CACHE_ENABLED", "true").lower() == "true"
+EXTRACTION_CACHE_TTL_SECONDS = int(os.getenv("EXTRACTION_CACHE_TTL_SECONDS", "21600"))
+EXTRACTION_CACHE_MAX_ENTRIES = int(os.getenv("EXTRACTION_CACHE_MAX_ENTRIES", "2000"))
+EXTRACTION_CACHE_DIR = os.getenv("EXTRACTION_CACHE_DIR", "")
+EXTRACTION_CACHE_MAX_DISK_BYTES = int(os.getenv("EXTRACTION_CACHE_MAX_DISK_BYTES", str(256 * 1024 * 1024)))
+# Fernet key (urlsafe base64, 32 bytes); generate with `python -c "from cryptography.fernet import Fernet; print(Fernet.generate_key().decode())"`
+EXTRACTION_CACHE_KEY = os.getenv("EXTRACTION_CACHE_KEY", "")
+# Max differing bits (of 256) for two images to count as the same scan; 0 only matches identical hashes.
+# Non-zero values can match another person's card printed on the same template, see the module docstring.
+EXTRACTION_CACHE_PHASH_DISTANCE = int(os.getenv("EXTRACTION_CACHE_PHASH_DISTANCE", "0"))
+
+DHASH_SIZE = 16
+
+
+def content_key(doc_type: str, prompt_version: str, prompt: str, images: Sequence[bytes]) -> str:
+    digest = hashlib.sha256()
+    for part in (doc_type, prompt_version, prompt):
+        digest.update(part.encode("utf-8") + b"\x00")
+    for image in images:
+        digest.update(len(image).to_bytes(8, "big"))
+        digest.update(image)
+    return digest.hexdigest()
+
+
+def dhash(image_bytes: bytes) -> Optional[int]:
+    """256-bit difference hash: which neighbouring pixels get brighter on a 17x16 thumbnail."""
+    gray = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_4)
+    if gray is None:
+        return None
+    thumb = cv2.resize(gray, (DHASH_SIZE + 1, DHASH_SIZE), interpolation=cv2.INTER_AREA)
+    bits = (thumb[:, 1:] > thumb[:, :-1]).flatten()
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+
+def perceptual_key(images: Sequence[bytes]) -> Optional[Tuple[int, ...]]:
+    hashes = tuple(dhash(image) for image in images)
+    return None if any(h is None for h in hashes) else hashes
+
+
+class _Entry(NamedTuple):
+    value: Any
+    expires_at: float
+    scope: str  # doc type + prompt version, perceptual matches never cross scopes
+    phash: Optional[Tuple[int, ...]]
+
+
+class ExtractionCache:
+    """Thread-safe TTL/LRU cache with an optional encrypted disk tier."""
+
+    def __init__(
+        self,
+        ttl_seconds: int = EXTRACTION_CACHE_TTL_SECONDS,
+        max_entries: int = EXTRACTION_CACHE_MAX_ENTRIES,
+        directory: str = EXTRACTION_CACHE_DIR,
+        encryption_key: str = EXTRACTION_CACHE_KEY,
+        max_disk_bytes: int = EXTRACTION_CACHE_MAX_DISK_BYTES,
+        phash_distance: int = EXTRACTION_CACHE_PHASH_DISTANCE,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_disk_bytes = max_disk_bytes
+        self.phash_distance = phash_distance
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        self.directory = directory or None
+        self._fernet = None
+        if self.directory and not encryption_key:
+            # Worker processes share the directory, so they must share the key too: with a key per
+            # process each worker would discard the others' entries as unreadable
+            print("EXTRACTION_CACHE_DIR is set but EXTRACTION_CACHE_KEY is not, keeping the extraction cache in memory only")
+            self.directory = None
+        if self.directory:
+            self._fernet = Fernet(encryption_key.encode())
+            os.makedirs(self.directory, mode=0o700, exist_ok=True)
+            self._load()
+
+    def get(self, key: str, scope: str, phash: Optional[Tuple[int, ...]]) -> Tuple[Optional[Any], str]:
+        """
+        Look up an extraction.
+
+        Returns:
+            Tuple of (value, outcome) where outcome is "hit", "perceptual_hit" or "miss"
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > now:
+                self._entries.move_to_end(key)
+                return entry.value, "hit"
+            if phash is not None:
+                for other_key, other in reversed(self._entries.items()):
+                    if other.scope == scope and other.expires_at > now and self._similar(phash, other.phash):
+                        self._entries.move_to_end(other_key)
+                        return other.value, "perceptual_hit"
+        return None, "miss"
+
+    def set(self, key: str, scope: str, phash: Optional[Tuple[int, ...]], value: Any) -> None:
+        entry = _Entry(value, time.time() + self.ttl_seconds, scope, phash)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            evicted = []
+            while len(self._entries) > self.max_entries:
+                evicted.append(self._entries.popitem(last=False)[0])
+        if self._fernet is not None:
+            # The extraction already succeeded; a failed disk write only costs a later miss
+            try:
+                self._write(key, entry)
+                for old_key in evicted:
+                    self._remove(old_key)
+                self._trim_disk()
+            except Exception as e:
+                print(f"Extraction cache disk write failed: {e}")
+
+    def _similar(self, a: Tuple[int, ...], b: Optional[Tuple[int, ...]]) -> bool:
+        if b is None or len(a) != len(b):
+            return False
+        return all(bin(x ^ y).count("1") <= self.phash_distance for x, y in zip(a, b))
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.bin")
+
+    def _write(self, key: str, entry: _Entry) -> None:
+        payload = json.dumps({
+            "value": entry.value,
+            "expires_at": entry.expires_at,
+            "scope": entry.scope,
+            "phash": list(entry.phash) if entry.phash is not None else None,
+        }).encode("utf-8")
+        # Per process, so two workers storing the same key don't rename each other's file away
+        tmp_path = f"{self._path(key)}.{os.getpid()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self._fernet.encrypt(payload))
+        os.replace(tmp_path, self._path(key))
+
+    def _remove(self, key: str) -> None:
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _disk_files(self) -> List[Tuple[os.DirEntry, os.stat_result]]:
+        """Cache files with their stat, oldest first; files another worker removes meanwhile are skipped."""
+        files = []
+        for entry in os.scandir(self.directory):
+            if not entry.name.endswith(".bin"):
+                continue
+            try:
+                files.append((entry, entry.stat()))
+            except FileNotFoundError:
+                continue
+        return sorted(files, key=lambda item: item[1].st_mtime)
+
+    def _trim_disk(self) -> None:
+        files = self._disk_files()
+        total = sum(stat.st_size for _, stat in files)
+        while files and total > self.max_disk_bytes:
+            oldest, stat = files.pop(0)
+            total -= stat.st_size
+            self._remove(oldest.name[:-len(".bin")])
+            with self._lock:
+                self._entries.pop(oldest.name[:-len(".bin")], None)
+
+    def _load(self) -> None:
+        """Restore unexpired entries from disk, oldest first so LRU order survives restarts."""
+        now = time.time()
+        for file, _ in self._disk_files():
+            key = file.name[:-len(".bin")]
+            try:
+                with open(file.path, "rb") as f:
+                    data = json.loads(self._fernet.decrypt(f.read(), ttl=self.ttl_seconds))
+            except FileNotFoundError:
+                # Trimmed by another worker meanwhile
+                continue
+            except (InvalidToken, ValueError):
+                # Expired, or written under a different key
+                self._remove(key)
+                continue
+            if data["expires_at"] <= now:
+                self._remove(key)
+                continue
+            phash = tuple(data["phash"]) if data["phash"] is not None else None
+            self._entries[key] = _Entry(data["value"], data["expires_at"], data["scope"], phash)
+        while len(self._entries) > self.max_entries:
+            self._remove(self._entries.popitem(last=False)[0])
+
+    def lookup(self, doc_type: str, prompt_version: str, prompt: str, images: Sequence[bytes]) -> Tuple[str, str, Optional[Tuple[int, ...]], Optional[Any]]:
+        """Hash the images and look them up; returns (key, scope, phash, value or None) for a later `set`."""
+        key = content_key(doc_type, prompt_version, prompt, images)
+        scope = f"{doc_type}:{prompt_version}:{hashlib.sha256(prompt.encode('utf-8')).hexdigest()[:16]}"
+        phash = perceptual_key(images)
+        value, outcome = self.get(key, scope, phash)
+        CACHE_LOOKUPS.inc(cache="extraction", outcome=outcome)
+        return key, scope, phash, value
@@ -0,0 +1,443 @@
+"""
+Persistent background queue for large OCR batches.
+
+A job is a set of uploaded documents of one type. Submitting it only writes
+the files to a local SQLite database; a small pool of worker tasks claims
+documents one at a time, extracts them with the shared OcrAgent and stores
+each result as soon as it is ready, so clients poll or stream progress
+instead of holding one HTTP request open for the whole batch.
+
+Claims are leases: a document whose worker died (crash, deploy) becomes
+claimable again once its lease expires, and several worker processes can
+share the same database file. A worker renews its lease while extracting,
+only the current lease holder can store a result, and a document whose
+worker keeps dying is failed after OCR_JOB_MAX_ATTEMPTS claims. Quota
+errors are retried with exponential backoff.
+
+Uploads and results are PII: both are stored as Fernet tokens under
+OCR_JOBS_KEY (or EXTRACTION_CACHE_KEY), which every process sharing the
+database must use; without a key the queue is not available. Uploaded bytes
+are dropped, and overwritten on disk, as soon as a document is finished.
+"""
+
+import asyncio
+import functools
+import json
+import os
+import random
+import sqlite3
+import time
+import uuid
+from typing import Dict, List, Optional
+
+from cryptography.fernet import Fernet
+from fastapi.concurrency import run_in_threadpool
+from pydantic import TypeAdapter
+
+from .agents import APIQuotaExceededException
+from .extraction_cache import EXTRACTION_CACHE_KEY
+from .utils import OcrAgent, begin_gemini_slots
+
+OCR_JOBS_DB = os.getenv("OCR_JOBS_DB", "ocr_jobs.sqlite3")
+OCR_JOB_WORKERS = int(os.getenv("OCR_JOB_WORKERS", "2"))
+OCR_JOB_MAX_ATTEMPTS = int(os.getenv("OCR_JOB_MAX_ATTEMPTS", "5"))
+OCR_JOB_BACKOFF_SECONDS = float(os.getenv("OCR_JOB_BACKOFF_SECONDS", "15"))
+OCR_JOB_MAX_BACKOFF_SECONDS = float(os.getenv("OCR_JOB_MAX_BACKOFF_SECONDS", "600"))
+OCR_JOB_LEASE_SECONDS = float(os.getenv("OCR_JOB_LEASE_SECONDS", "600"))
+OCR_JOB_RETENTION_SECONDS = float(os.getenv("OCR_JOB_RETENTION_SECONDS", "86400"))
+OCR_JOB_POLL_SECONDS = float(os.getenv("OCR_JOB_POLL_SECONDS", "1"))
+# Fernet key for uploads and results at rest; the extraction cache key is used when unset
+OCR_JOBS_KEY = os.getenv("OCR_JOBS_KEY", "") or EXTRACTION_CACHE_KEY
+# Every Fernet token starts with its version byte and timestamp, base64-encoded
+FERNET_TOKEN_PREFIX = b"gAAAAA"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS ocr_jobs (
+    id TEXT PRIMARY KEY,
+    doc_type TEXT NOT NULL,
+    options TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    finished_at REAL
+);
+CREATE TABLE IF NOT EXISTS ocr_job_documents (
+    job_id TEXT NOT NULL REFERENCES ocr_jobs(id) ON DELETE CASCADE,
+    idx INTEGER NOT NULL,
+    filename TEXT,
+    content_type TEXT NOT NULL,
+    content BLOB,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    available_at REAL NOT NULL,
+    lease_expires_at REAL,
+    lease_owner TEXT,
+    result TEXT,
+    error TEXT,
+    finished_at REAL,
+    PRIMARY KEY (job_id, idx)
+);
+CREATE INDEX IF NOT EXISTS ocr_job_documents_claim ON ocr_job_documents (status, available_at);
+"""
+
+_records = TypeAdapter(list)
+
+
+def backoff_seconds(attempts: int) -> float:
+    """Exponential backoff with full jitter, capped."""
+    return random.uniform(0, min(OCR_JOB_MAX_BACKOFF_SECONDS, OCR_JOB_BACKOFF_SECONDS * 2 ** (attempts - 1)))
+
+
+class JobQueue:
+    """SQLite-backed OCR job queue with a bounded pool of asyncio workers."""
+
+    def __init__(self, ocr_agent: OcrAgent, path: str = OCR_JOBS_DB, workers: int = OCR_JOB_WORKERS,
+                 encryption_key: str = OCR_JOBS_KEY):
+        """
+        Raises:
+            ValueError: No encryption key is configured
+        """
+        if not encryption_key:
+            raise ValueError("OCR_JOBS_KEY or EXTRACTION_CACHE_KEY is required to store uploads and results encrypted")
+        self._fernet = Fernet(encryption_key.encode())
+        self.ocr_agent = ocr_agent
+        self.path = path
+        self.workers = workers
+        self.worker_id = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+        self._last_purge = 0.0
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA foreign_keys = ON")
+        # Cleared uploads and purged results are overwritten, not left in free pages
+        conn.execute("PRAGMA secure_delete = ON")
+        return conn
+
+    def _encrypt(self, data: bytes) -> bytes:
+        return self._fernet.encrypt(data)
+
+    def _decrypt(self, token: bytes) -> bytes:
+        return self._fernet.decrypt(token)
+
+    def _init_db(self) -> None:
+        conn = self._connect()
+        try:
+            # WAL lets status polls read while a worker writes
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(SCHEMA)
+            columns = {row["name"] for row in conn.execute("PRAGMA table_info(ocr_job_documents)")}
+            if "lease_owner" not in columns:
+                # Databases created before leases had owners
+                conn.execute("ALTER TABLE ocr_job_documents ADD COLUMN lease_owner TEXT")
+            self._encrypt_plaintext_rows(conn)
+        finally:
+            conn.close()
+
+    def _encrypt_plaintext_rows(self, conn: sqlite3.Connection) -> None:
+        """Encrypt uploads and results stored in the clear by earlier versions (results were TEXT, tokens are BLOBs)."""
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("UPDATE ocr_job_documents SET content = NULL WHERE status IN ('done', 'failed') AND content IS NOT NULL")
+            rows = conn.execute(
+                "SELECT job_id, idx, content, result FROM ocr_job_documents WHERE content IS NOT NULL OR typeof(result) = 'text'"
+            ).fetchall()
+            for row in rows:
+                content, result = row["content"], row["result"]
+                if content is not None and not bytes(content).startswith(FERNET_TOKEN_PREFIX):
+                    content = self._encrypt(bytes(content))
+                if isinstance(result, str):
+                    result = self._encrypt(result.encode("utf-8"))
+                if content is not row["content"] or result is not row["result"]:
+                    conn.execute(
+                        "UPDATE ocr_job_documents SET content = ?, result = ? WHERE job_id = ? AND idx = ?",
+                        (content, result, row["job_id"], row["idx"]),
+                    )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    async def start(self) -> None:
+        await run_in_threadpool(self._init_db)
+        self._tasks = [asyncio.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    # Submission and status
+
+    def _submit(self, doc_type: str, files: List[dict], options: dict) -> str:
+        job_id = uuid.uuid4().hex
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(
+                "INSERT INTO ocr_jobs (id, doc_type, options, created_at) VALUES (?, ?, ?, ?)",
+                (job_id, doc_type, json.dumps(options), now),
+            )
+            conn.executemany(
+                "INSERT INTO ocr_job_documents (job_id, idx, filename, content_type, content, available_at) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (job_id, idx, file['filename'], file['content_type'], self._encrypt(file['content']), now)
+                    for idx, file in enumerate(files)
+                ],
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        return job_id
+
+    async def submit(self, doc_type: str, files: List[dict], options: dict) -> str:
+        """
+        Queue a batch for extraction.
+
+        Args:
+            doc_type: "aadhaar" or "pan"
+            files: Dicts with 'content', 'content_type' and 'filename'
+            options: Extraction options passed to `OcrAgent.extract_file`
+
+        Returns:
+            str: The new job id
+        """
+        job_id = await run_in_threadpool(self._submit, doc_type, files, options)
+        self._wakeup.set()
+        return job_id
+
+    def _status(self, job_id: str, after: int = -1, include_results: bool = True) -> Optional[Dict]:
+        conn = self._connect()
+        try:
+            job = conn.execute("SELECT * FROM ocr_jobs WHERE id = ?", (job_id,)).fetchone()
+            if job is None:
+                return None
+            counts = dict(conn.execute(
+                "SELECT status, COUNT(*) FROM ocr_job_documents WHERE job_id = ? GROUP BY status", (job_id,)
+            ).fetchall())
+            documents = conn.execute(
+                "SELECT idx, filename, status, attempts, result, error FROM ocr_job_documents "
+                "WHERE job_id = ? AND idx > ? ORDER BY idx",
+                (job_id, after),
+            ).fetchall()
+        finally:
+            conn.close()
+
+        total = sum(counts.values())
+        completed = counts.get("done", 0)
+        failed = counts.get("failed", 0)
+        if completed + failed == total:
+            status = "completed" if failed == 0 else ("failed" if completed == 0 else "partial")
+        else:
+            status = "running" if counts.get("running") or completed or failed else "queued"
+        return {
+            "job_id": job["id"],
+            "doc_type": job["doc_type"],
+            "status": status,
+            "total": total,
+            "completed": completed,
+            "failed": failed,
+            "progress": (completed + failed) / total if total else 1.0,
+            "created_at": job["created_at"],
+            "finished_at": job["finished_at"],
+            "documents": [
+                {
+                    "index": row["idx"],
+                    "filename": row["filename"],
+                    "status": row["status"],
+                    "attempts": row["attempts"],
+                    "results": json.loads(self._decrypt(row["result"])) if include_results and row["result"] else None,
+                    "error": row["error"],
+                }
+                for row in documents
+            ],
+        }
+
+    async def status(self, job_id: str, include_results: bool = True) -> Optional[Dict]:
+        """Job progress with every document's state (and results, if requested); None for an unknown job."""
+        return await run_in_threadpool(self._status, job_id, -1, include_results)
+
+    async def stream(self, job_id: str):
+        """
+        Yield each document as it finishes, then the final job status.
+
+        Documents are yielded as dicts with "type": "document"; the last item
+        has "type": "job".
+        """
+        sent = set()
+        while True:
+            job = await run_in_threadpool(self._status, job_id)
+            if job is None:
+                return
+            for document in job["documents"]:
+                if document["index"] not in sent and document["status"] in ("done", "failed"):
+                    sent.add(document["index"])
+                    yield {"type": "document", "job_id": job_id, **document}
+            if job["status"] not in ("queued", "running"):
+                job.pop("documents")
+                yield {"type": "job", **job}
+                return
+            await asyncio.sleep(OCR_JOB_POLL_SECONDS)
+
+    # Workers
+
+    def _claim(self) -> Optional[Dict]:
+        """Lease the next due document; documents whose worker died too often are failed instead."""
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            while True:
+                row = conn.execute(
+                    "SELECT d.job_id, d.idx, d.content_type, d.content, d.attempts, d.status, j.doc_type, j.options "
+                    "FROM ocr_job_documents d JOIN ocr_jobs j ON j.id = d.job_id "
+                    "WHERE (d.status = 'queued' AND d.available_at <= ?) "
+                    "   OR (d.status = 'running' AND d.lease_expires_at < ?) "
+                    "ORDER BY j.created_at, d.idx LIMIT 1",
+                    (now, now),
+                ).fetchone()
+                if row is None or row["status"] == "queued" or row["attempts"] < OCR_JOB_MAX_ATTEMPTS:
+                    break
+                # The lease expired every time: the document keeps killing or stalling its worker
+                conn.execute(
+                    "UPDATE ocr_job_documents SET status = 'failed', error = ?, content = NULL, lease_expires_at = NULL, "
+                    "lease_owner = NULL, finished_at = ? WHERE job_id = ? AND idx = ?",
+                    (f"Worker stopped while processing the document {row['attempts']} times", now, row["job_id"], row["idx"]),
+                )
+                self._finish_job(conn, row["job_id"], now)
+
+            claim = None
+            if row is not None:
+                claim = dict(row, lease_owner=f"{self.worker_id}-{uuid.uuid4().hex[:8]}", content=self._decrypt(row["content"]))
+                conn.execute(
+                    "UPDATE ocr_job_documents SET status = 'running', lease_expires_at = ?, lease_owner = ?, "
+                    "attempts = attempts + 1 WHERE job_id = ? AND idx = ?",
+                    (now + OCR_JOB_LEASE_SECONDS, claim["lease_owner"], row["job_id"], row["idx"]),
+                )
+            conn.execute("COMMIT")
+            return claim
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+
+    def _renew(self, job_id: str, idx: int, lease_owner: str) -> bool:
+        """Extend a lease still held by `lease_owner`; False once another worker has taken it over."""
+        conn = self._connect()
+        try:
+            renewed = conn.execute(
+                "UPDATE ocr_job_documents SET lease_expires_at = ? "
+                "WHERE job_id = ? AND idx = ? AND status = 'running' AND lease_owner = ?",
+                (time.time() + OCR_JOB_LEASE_SECONDS, job_id, idx, lease_owner),
+            ).rowcount
+        finally:
+            conn.close()
+        return renewed == 1
+
+    @staticmethod
+    def _finish_job(conn: sqlite3.Connection, job_id: str, now: float) -> None:
+        conn.execute(
+            "UPDATE ocr_jobs SET finished_at = ? WHERE id = ? AND finished_at IS NULL AND NOT EXISTS ("
+            "SELECT 1 FROM ocr_job_documents WHERE job_id = ? AND status NOT IN ('done', 'failed'))",
+            (now, job_id, job_id),
+        )
+
+    def _finish(self, job_id: str, idx: int, lease_owner: str, status: str, result: Optional[list] = None,
+                error: Optional[str] = None, retry_at: Optional[float] = None) -> None:
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if retry_at is not None:
+                updated = conn.execute(
+                    "UPDATE ocr_job_documents SET status = 'queued', available_at = ?, lease_expires_at = NULL, "
+                    "lease_owner = NULL, error = ? WHERE job_id = ? AND idx = ? AND lease_owner = ?",
+                    (retry_at, error, job_id, idx, lease_owner),
+                ).rowcount
+            else:
+                # The upload is no longer needed once the document has a final outcome
+                updated = conn.execute(
+                    "UPDATE ocr_job_documents SET status = ?, result = ?, error = ?, content = NULL, "
+                    "lease_expires_at = NULL, lease_owner = NULL, finished_at = ? "
+                    "WHERE job_id = ? AND idx = ? AND lease_owner = ?",
+                    (
+                        status, self._encrypt(json.dumps(result).encode("utf-8")) if result is not None else None,
+                        error, now, job_id, idx, lease_owner,
+                    ),
+                ).rowcount
+                if updated:
+                    self._finish_job(conn, job_id, now)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        if not updated:
+            print(f"OCR job {job_id} document {idx}: lease lost to another worker, result discarded")
+
+    def _purge(self) -> None:
+        """Delete finished jobs past their retention, results are PII."""
+        conn = self._connect()
+        try:
+            conn.execute("DELETE FROM ocr_jobs WHERE finished_at < ?", (time.time() - OCR_JOB_RETENTION_SECONDS,))
+        finally:
+            conn.close()
+
+    async def _keep_lease(self, row: Dict) -> None:
+        """Renew the lease while the document is being extracted, so long documents aren't reclaimed."""
+        while True:
+            await asyncio.sleep(OCR_JOB_LEASE_SECONDS / 3)
+            try:
+                if not await run_in_threadpool(self._renew, row["job_id"], row["idx"], row["lease_owner"]):
+                    return
+            except Exception as e:
+                # Retried on the next beat, well before the lease runs out
+                print(f"Renewing lease of OCR job {row['job_id']} document {row['idx']} failed: {e}")
+
+    async def _process(self, row: Dict) -> None:
+        options = json.loads(row["options"])
+        begin_gemini_slots()
+        finish = functools.partial(self._finish, row["job_id"], row["idx"], row["lease_owner"])
+        heartbeat = asyncio.create_task(self._keep_lease(row))
+        try:
+            records = await self.ocr_agent.extract_file(row["doc_type"], row["content"], row["content_type"], **options)
+            await run_in_threadpool(finish, "done", _records.dump_python(records, mode="json"))
+        except APIQuotaExceededException as e:
+            if row["attempts"] + 1 >= OCR_JOB_MAX_ATTEMPTS:
+                await run_in_threadpool(finish, "failed", None, str(e))
+            else:
+                retry_at = time.time() + backoff_seconds(row["attempts"] + 1)
+                await run_in_threadpool(finish, "queued", None, str(e), retry_at)
+        except Exception as e:
+            await run_in_threadpool(finish, "failed", None, f"Error processing document: {str(e)}")
+        finally:
+            heartbeat.cancel()
+
+    async def _work(self) -> None:
+        while True:
+            try:
+                if time.time() - self._last_purge > 60:
+                    self._last_purge = time.time()
+                    await run_in_threadpool(self._purge)
+                row = await run_in_threadpool(self._claim)
+                if row is not None:
+                    await self._process(row)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"OCR job worker error: {e}")
+
+            # Nothing claimable: sleep until a submit or the next poll (retries become due over time)
+            self._wakeup.clear()
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=OCR_JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
@@ -0,0 +1,21 @@
+"""
+Media type sniffing for uploaded images.
+
+Kept free of heavy imports so the lightweight modules (signature features,
+OCR preprocessing) can share it without pulling in each other's dependencies.
+"""
+
+
+def detect_media_type(data: bytes) -> str:
+    """Identify the image format from its magic bytes rather than trusting the upload's content type."""
+    if data.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "image/png"
+    if data.startswith(b"\xff\xd8\xff"):
+        return "image/jpeg"
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    if data.startswith(b"BM"):
+        return "image/bmp"
+    if data.startswith(b"%PDF"):
+        return "application/pdf"
+    return "application/octet-stream"
@@ -0,0 +1,221 @@
+"""
+Lightweight in-process metrics with Prometheus text exposition.
+
+Only the pieces the service needs (labelled counters and histograms) are
+implemented here, so recording a sample is a dict lookup and a couple of
+additions under a lock.
+"""
+
+import threading
+import time
+from abc import ABC, abstractmethod
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Dict, List, Sequence, Tuple
+
+# Buckets in seconds, spanning local image work up to slow LLM round trips
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Buckets in bytes, from a small JSON body up to a multi-page scanned PDF
+BYTE_BUCKETS = (1024, 10240, 102400, 512000, 1048576, 5242880, 10485760, 52428800, 104857600)
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str]) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric(ABC):
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, "")) for name in self.labelnames)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return lines
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """Sample lines in the text exposition format."""
+
+
+class Counter(_Metric):
+    """Monotonic counter, e.g. fallbacks taken or quota errors."""
+
+    kind = "counter"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+
+    def inc(self, amount: float = 1.0, **labels: str) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: str) -> float:
+        return self._values.get(self._key(labels), 0.0)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}" for key, value in items]
+
+
+class Histogram(_Metric):
+    """Cumulative-bucket histogram, e.g. stage latency or payload size."""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        # label key -> [per-bucket counts (+Inf last), sum, count]
+        self._values: Dict[Tuple[str, ...], list] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = self._key(labels)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels: str):
+        """Observe the wall time spent inside the block, including when it raises."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _samples(self) -> List[str]:
+        with self._lock:
+            items = [(key, (list(state[0]), state[1], state[2])) for key, state in self._values.items()]
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += bucket_count
+                labels = _format_labels(self.labelnames + ("le",), key + (_format_value(bound),))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            lines.append(f"{self.name}_count{labels} {count}")
+        return lines
+
+
+class Registry:
+    """Collection of metrics rendered together on /metrics."""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+REQUEST_LATENCY = REGISTRY.register(Histogram(
+    "verifypro_request_duration_seconds",
+    "End-to-end HTTP request latency by route.",
+    ("method", "route", "status"),
+))
+STAGE_LATENCY = REGISTRY.register(Histogram(
+    "verifypro_stage_duration_seconds",
+    "Latency of individual pipeline stages by provider.",
+    ("stage", "provider"),
+))
+PAYLOAD_BYTES = REGISTRY.register(Histogram(
+    "verifypro_payload_bytes",
+    "Size of payloads received from clients or sent to providers.",
+    ("stage", "direction"),
+    buckets=BYTE_BUCKETS,
+))
+FALLBACKS = REGISTRY.register(Counter(
+    "verifypro_fallbacks_total",
+    "Number of times a degraded fallback path was taken.",
+    ("stage",),
+))
+QUOTA_ERRORS = REGISTRY.register(Counter(
+    "verifypro_quota_errors_total",
+    "Number of provider calls rejected for quota or rate limits.",
+    ("provider",),
+))
+CACHE_LOOKUPS = REGISTRY.register(Counter(
+    "verifypro_cache_lookups_total",
+    "Result cache lookups by outcome (hit, perceptual_hit, miss).",
+    ("cache", "outcome"),
+))
+PAGES_SKIPPED = REGISTRY.register(Counter(
+    "verifypro_pages_skipped_total",
+    "Pages screened out locally before reaching the LLM, by reason.",
+    ("reason",),
+))
+PAGES_CLASSIFIED = REGISTRY.register(Counter(
+    "verifypro_pages_classified_total",
+    "Pages classified before routing to an extractor, by detected type and classifier (opencv, or gemini for pages opencv left unknown).",
+    ("doc_type", "provider"),
+))
+OTP_RECOGNITIONS = REGISTRY.register(Counter(
+    "verifypro_otp_recognitions_total",
+    "OTP images answered by the on-device recognizer (local) or sent to Gemini (gemini).",
+    ("source",),
+))
+HEDGES = REGISTRY.register(Counter(
+    "verifypro_hedged_calls_total",
+    "Duplicate provider calls sent after the stage's p95 latency (sent) and how often the duplicate answered first (won).",
+    ("stage", "outcome"),
+))
+DEADLINES_EXCEEDED = REGISTRY.register(Counter(
+    "verifypro_deadlines_exceeded_total",
+    "Provider calls abandoned because the request deadline passed.",
+    ("stage",),
+))
+DISCONNECTS = REGISTRY.register(Counter(
+    "verifypro_client_disconnects_total",
+    "Requests cancelled because the client disconnected before the response was complete.",
+))
+SIGNATURE_DECISIONS = REGISTRY.register(Counter(
+    "verifypro_signature_decisions_total",
+    "Signature comparisons by who decided them: local_match, local_mismatch or llm.",
+    ("decision",),
+))
+SIGNATURE_IDENTICAL_PAIRS = REGISTRY.register(Counter(
+    "verifypro_signature_identical_pairs_total",
+    "Signature comparisons whose two normalized images were identical, a sign of a copied or replayed signature.",
+))
@@ -0,0 +1,415 @@
+"""
+On-device OTP reader: paper detection, digit segmentation and a small CNN.
+
+`/otp/detect` only needs 4-8 digits off a sheet of paper, so most images can
+be read on the CPU in milliseconds instead of a Gemini round trip:
+
+1. find the sheet: the largest bright, unsaturated region of the photo
+2. segment digits: adaptive threshold, connected components, keep the
+   dominant line of similarly sized blobs, sort left to right
+3. classify each digit (28x28, MNIST-style) with `DigitCNN`
+4. confidence: product of the temperature-calibrated per-digit
+   probabilities and the segmentation quality (see `segmentation_quality`);
+   zero when segmentation doesn't yield 4-8 digits
+
+The caller only trusts a result at or above OTP_LOCAL_CONFIDENCE and falls
+back to Gemini otherwise. Weights are not shipped; train (and calibrate) them
+on a labelled sample set with:
+
+    python -m app.otp_recognizer --samples path/to/labelled --output app/models/otp_digits.pt
+
+where the sample directory holds images and a `labels.csv` (filename,otp).
+Without --samples the model is trained on synthetic renders of printed
+Hershey fonts only, which say little about handwritten sheets.
+
+Weights are only used once benchmarks/bench_otp_recognizer.py has been run on
+real labelled samples with --record: it stores the threshold it validated in
+the weights file, and `OtpRecognizer.load` refuses weights without such a
+record, or validated only for a stricter threshold than OTP_LOCAL_CONFIDENCE.
+"""
+
+import argparse
+import csv
+import os
+import random
+from typing import List, Optional, Tuple
+
+import cv2
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from .schemas import OTPExtractedData
+
+OTP_RECOGNIZER_ENABLED = os.getenv("OTP_RECOGNIZER_ENABLED", "true").lower() == "true"
+OTP_MODEL_PATH = os.getenv("OTP_MODEL_PATH", os.path.join(os.path.dirname(__file__), "models", "otp_digits.pt"))
+# Minimum calibrated confidence for answering without Gemini
+OTP_LOCAL_CONFIDENCE = float(os.getenv("OTP_LOCAL_CONFIDENCE", "0.97"))
+OTP_MIN_DIGITS = 4
+OTP_MAX_DIGITS = 8
+
+DIGIT_SIZE = 28
+PAPER_WIDTH = 640
+
+
+class DigitCNN(nn.Module):
+    """Two conv blocks and a small classifier head, ~100k parameters."""
+
+    def __init__(self):
+        super().__init__()
+        self.conv1 = nn.Conv2d(1, 16, 3, padding=1)
+        self.conv2 = nn.Conv2d(16, 32, 3, padding=1)
+        self.fc1 = nn.Linear(32 * 7 * 7, 64)
+        self.fc2 = nn.Linear(64, 10)
+        self.dropout = nn.Dropout(0.25)
+
+    def forward(self, x: torch.Tensor) -> torch.Tensor:
+        x = F.max_pool2d(F.relu(self.conv1(x)), 2)
+        x = F.max_pool2d(F.relu(self.conv2(x)), 2)
+        x = self.dropout(F.relu(self.fc1(x.flatten(1))))
+        return self.fc2(x)
+
+
+# Image processing
+
+def find_paper(image: np.ndarray) -> Optional[np.ndarray]:
+    """Grayscale crop of the largest bright, low-saturation region, scaled to PAPER_WIDTH."""
+    height, width = image.shape[:2]
+    scale = 800.0 / max(height, width)
+    if scale < 1:
+        image = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        height, width = image.shape[:2]
+
+    hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+    value = hsv[:, :, 2]
+    # Brighter than the rest of the photo (Otsu split), so dim indoor shots and pale walls both work
+    bright, _ = cv2.threshold(value, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    mask = ((hsv[:, :, 1] < 60) & (value >= max(120, bright))).astype(np.uint8) * 255
+    kernel = cv2.getStructuringElement(cv2.MORPH_RECT, (max(3, width // 40), max(3, height // 40)))
+    # Closing fills in the digits written on the sheet
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, kernel)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, kernel)
+
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+    paper = max(contours, key=cv2.contourArea)
+    if cv2.contourArea(paper) < 0.02 * width * height:
+        return None
+
+    # Rotate the sheet upright (by at most 45 degrees, so the writing keeps its orientation)
+    (cx, cy), (w, h), angle = cv2.minAreaRect(paper)
+    if angle > 45:
+        angle -= 90
+        w, h = h, w
+    elif angle < -45:
+        angle += 90
+        w, h = h, w
+    rotation = cv2.getRotationMatrix2D((cx, cy), angle, 1.0)
+    gray = cv2.warpAffine(cv2.cvtColor(image, cv2.COLOR_BGR2GRAY), rotation, (width, height), flags=cv2.INTER_LINEAR)
+    # Inset a little so no background survives along the sheet's edges
+    w, h = int(w * 0.94), int(h * 0.94)
+    if w < 20 or h < 10:
+        return None
+    sheet = cv2.getRectSubPix(gray, (w, h), (cx, cy))
+    return cv2.resize(sheet, (PAPER_WIDTH, max(1, int(h * PAPER_WIDTH / w))), interpolation=cv2.INTER_CUBIC)
+
+
+def to_digit_tensor(binary: np.ndarray) -> np.ndarray:
+    """Fit a binary digit crop into a 20x20 box centred in 28x28, like MNIST."""
+    h, w = binary.shape
+    side = max(h, w)
+    square = np.zeros((side, side), np.uint8)
+    square[(side - h) // 2:(side - h) // 2 + h, (side - w) // 2:(side - w) // 2 + w] = binary
+    digit = np.zeros((DIGIT_SIZE, DIGIT_SIZE), np.float32)
+    digit[4:24, 4:24] = cv2.resize(square, (20, 20), interpolation=cv2.INTER_AREA) / 255.0
+    return digit
+
+
+def segment_digits(paper: np.ndarray) -> Tuple[List[np.ndarray], float]:
+    """
+    Cut the main line of digits out of the paper crop, left to right, as 28x28 arrays.
+
+    Returns:
+        Tuple of (digits, segmentation quality, see `segmentation_quality`)
+    """
+    blurred = cv2.GaussianBlur(paper, (5, 5), 0)
+    binary = cv2.adaptiveThreshold(blurred, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 41, 15)
+    binary = cv2.morphologyEx(binary, cv2.MORPH_OPEN, np.ones((2, 2), np.uint8))
+
+    count, labels, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    height, width = binary.shape
+    boxes = []
+    for label in range(1, count):
+        x, y, w, h, area = stats[label]
+        touches_edge = x <= 1 or y <= 1 or x + w >= width - 1 or y + h >= height - 1
+        if touches_edge or area < 30 or h < 0.08 * height or h > 0.9 * height or w > 1.5 * h:
+            continue
+        boxes.append([x, y, x + w, y + h])
+    if not boxes:
+        return [], 0.0
+
+    # Merge strokes of one digit that came out as separate components (mostly overlapping columns)
+    boxes.sort()
+    merged = [boxes[0]]
+    for box in boxes[1:]:
+        last = merged[-1]
+        overlap = min(last[2], box[2]) - max(last[0], box[0])
+        if overlap > 0.5 * min(last[2] - last[0], box[2] - box[0]):
+            merged[-1] = [min(last[0], box[0]), min(last[1], box[1]), max(last[2], box[2]), max(last[3], box[3])]
+        else:
+            merged.append(box)
+
+    # Keep the dominant line: boxes whose height and vertical centre match the median
+    heights = np.array([b[3] - b[1] for b in merged])
+    centres = np.array([(b[1] + b[3]) / 2 for b in merged])
+    median_height = np.median(heights)
+    median_centre = np.median(centres)
+    line = sorted(
+        b for b, h, c in zip(merged, heights, centres)
+        if 0.6 * median_height <= h <= 1.6 * median_height and abs(c - median_centre) <= 0.6 * median_height
+    )
+    digits = [to_digit_tensor(binary[y0:y1, x0:x1]) for x0, y0, x1, y1 in line]
+    return digits, segmentation_quality(line)
+
+
+def segmentation_quality(boxes: List[List[int]]) -> float:
+    """
+    How much the digit boxes look like one evenly written line, in [0, 1].
+
+    Written digits have similar heights, widths and spacing. Two digits merged
+    into one blob show up as a box much wider than the others, and a dropped
+    digit as a gap much wider than the rest; either way the OTP would have the
+    wrong length, so the classifier's confidence alone can't be trusted.
+    """
+    if len(boxes) < 2:
+        return 0.0
+    widths = np.array([x1 - x0 for x0, _, x1, _ in boxes], np.float32)
+    heights = np.array([y1 - y0 for _, y0, _, y1 in boxes], np.float32)
+    gaps = np.array([b[0] - a[2] for a, b in zip(boxes, boxes[1:])], np.float32)
+    median_width, median_height = float(np.median(widths)), float(np.median(heights))
+
+    def falloff(value: float, start: float, span: float) -> float:
+        return float(np.clip(1.0 - (value - start) / span, 0.0, 1.0))
+
+    height_score = falloff((heights.max() - heights.min()) / median_height, 0.3, 0.5)
+    # Not the narrowest box: a "1" is legitimately much narrower than the rest
+    width_score = falloff(widths.max() / median_width, 1.5, 0.6)
+    gap_score = falloff((gaps.max() - np.median(gaps)) / median_width, 0.8, 0.7)
+    return height_score * width_score * gap_score
+
+
+class OtpRecognizer:
+    """Loaded CNN plus its calibration temperature; `recognize` is thread-safe."""
+
+    def __init__(self, model: DigitCNN, temperature: float = 1.0):
+        self.model = model.eval()
+        self.temperature = temperature
+
+    @classmethod
+    def load(cls, path: str = OTP_MODEL_PATH, require_validation: bool = True) -> Optional["OtpRecognizer"]:
+        """
+        Load trained weights, or None when there are none or they were never
+        validated on real samples at OTP_LOCAL_CONFIDENCE (every OTP then goes to Gemini).
+        """
+        if not os.path.exists(path):
+            print(f"OTP recognizer weights not found at {path}, OTP detection will use Gemini only")
+            return None
+        checkpoint = torch.load(path, map_location="cpu", weights_only=True)
+        validation = checkpoint.get("validation")
+        if require_validation and (validation is None or validation["threshold"] > OTP_LOCAL_CONFIDENCE):
+            print(
+                f"OTP recognizer weights at {path} were not validated on real labelled samples at "
+                f"OTP_LOCAL_CONFIDENCE={OTP_LOCAL_CONFIDENCE} (run benchmarks/bench_otp_recognizer.py "
+                "--samples ... --record), OTP detection will use Gemini only"
+            )
+            return None
+        model = DigitCNN()
+        model.load_state_dict(checkpoint["state_dict"])
+        return cls(model, float(checkpoint.get("temperature", 1.0)))
+
+    def digit_probabilities(self, digits: List[np.ndarray]) -> np.ndarray:
+        batch = torch.from_numpy(np.stack(digits)).unsqueeze(1)
+        with torch.inference_mode():
+            logits = self.model(batch)
+        return torch.softmax(logits / self.temperature, dim=1).numpy()
+
+    def recognize(self, image_bytes: bytes) -> OTPExtractedData:
+        """
+        Read the OTP from a selfie-with-sheet image.
+
+        Returns:
+            OTPExtractedData: The digits and a calibrated confidence, or
+            otp=None/confidence=0 when the sheet or a 4-8 digit line wasn't found
+        """
+        image = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return OTPExtractedData(otp=None, confidence=0.0)
+        paper = find_paper(image)
+        if paper is None:
+            return OTPExtractedData(otp=None, confidence=0.0)
+        digits, quality = segment_digits(paper)
+        if not OTP_MIN_DIGITS <= len(digits) <= OTP_MAX_DIGITS:
+            return OTPExtractedData(otp=None, confidence=0.0)
+
+        probabilities = self.digit_probabilities(digits)
+        otp = "".join(str(d) for d in probabilities.argmax(axis=1))
+        # A merged or dropped digit gives a confidently classified OTP of the wrong length
+        return OTPExtractedData(otp=otp, confidence=float(np.prod(probabilities.max(axis=1))) * quality)
+
+
+# Synthetic data, training and calibration
+
+FONTS = [
+    cv2.FONT_HERSHEY_SIMPLEX, cv2.FONT_HERSHEY_DUPLEX, cv2.FONT_HERSHEY_COMPLEX,
+    cv2.FONT_HERSHEY_TRIPLEX, cv2.FONT_HERSHEY_SCRIPT_SIMPLEX, cv2.FONT_HERSHEY_SCRIPT_COMPLEX,
+]
+
+
+def synthetic_otp_image(rng: random.Random, otp: Optional[str] = None) -> Tuple[np.ndarray, str]:
+    """
+    Render a selfie-like photo: cluttered background, a face-coloured blob and
+    a sheet of paper with the OTP written on it.
+    """
+    if otp is None:
+        otp = "".join(rng.choice("0123456789") for _ in range(rng.randint(OTP_MIN_DIGITS, 6)))
+    height, width = 720, 960
+    base = np.array([rng.randint(20, 140) for _ in range(3)], np.float32)
+    image = np.clip(base + np.random.default_rng(rng.randint(0, 2 ** 31)).normal(0, 18, (height, width, 3)), 0, 255).astype(np.uint8)
+    cv2.ellipse(image, (rng.randint(150, 300), rng.randint(200, 400)), (110, 150), 0, 0, 360,
+                (rng.randint(90, 150), rng.randint(130, 180), rng.randint(170, 230)), -1)
+
+    paper_w, paper_h = rng.randint(420, 560), rng.randint(220, 320)
+    paper = np.full((paper_h, paper_w, 3), rng.randint(215, 250), np.uint8)
+    font = rng.choice(FONTS)
+    thickness = rng.randint(2, 6)
+    font_scale = rng.uniform(2.0, 3.2)
+    (text_w, text_h), _ = cv2.getTextSize(otp, font, font_scale, thickness)
+    font_scale *= min(1.0, (paper_w - 40) / text_w)
+    (text_w, text_h), _ = cv2.getTextSize(otp, font, font_scale, thickness)
+    ink = tuple(rng.randint(0, 70) for _ in range(3))
+    cv2.putText(paper, otp, ((paper_w - text_w) // 2, (paper_h + text_h) // 2), font, font_scale, ink, thickness, cv2.LINE_AA)
+
+    angle = rng.uniform(-8, 8)
+    rotation = cv2.getRotationMatrix2D((paper_w / 2, paper_h / 2), angle, 1.0)
+    x0, y0 = rng.randint(380, width - paper_w - 10), rng.randint(60, height - paper_h - 60)
+    rotation[:, 2] += (x0, y0)
+    warped = cv2.warpAffine(paper, rotation, (width, height), flags=cv2.INTER_LINEAR, borderValue=(0, 0, 0))
+    mask = cv2.warpAffine(np.full((paper_h, paper_w), 255, np.uint8), rotation, (width, height))
+    image[mask > 0] = warped[mask > 0]
+
+    image = cv2.GaussianBlur(image, (3, 3), rng.uniform(0.1, 1.2))
+    ok, encoded = cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, rng.randint(60, 95)])
+    return cv2.imdecode(encoded, cv2.IMREAD_COLOR), otp
+
+
+def _augment(digit: np.ndarray, rng: random.Random) -> np.ndarray:
+    matrix = cv2.getRotationMatrix2D((14, 14), rng.uniform(-12, 12), rng.uniform(0.85, 1.1))
+    matrix[0, 1] += rng.uniform(-0.2, 0.2)
+    matrix[:, 2] += (rng.uniform(-1.5, 1.5), rng.uniform(-1.5, 1.5))
+    return cv2.warpAffine(digit, matrix, (DIGIT_SIZE, DIGIT_SIZE))
+
+
+def labelled_digits(images: List[Tuple[np.ndarray, str]]) -> Tuple[List[np.ndarray], List[int]]:
+    """Segment labelled OTP images; keep only those whose digit count matches the label."""
+    digits, labels = [], []
+    for image, otp in images:
+        paper = find_paper(image)
+        if paper is None:
+            continue
+        segmented, _ = segment_digits(paper)
+        if len(segmented) == len(otp):
+            digits.extend(segmented)
+            labels.extend(int(c) for c in otp)
+    return digits, labels
+
+
+def load_labelled_samples(directory: str) -> List[Tuple[np.ndarray, str]]:
+    """Read `labels.csv` (filename,otp) and the images next to it."""
+    samples = []
+    with open(os.path.join(directory, "labels.csv"), newline="") as f:
+        for row in csv.DictReader(f):
+            image = cv2.imread(os.path.join(directory, row["filename"]), cv2.IMREAD_COLOR)
+            if image is not None:
+                samples.append((image, row["otp"].strip()))
+    return samples
+
+
+def fit_temperature(logits: torch.Tensor, labels: torch.Tensor) -> float:
+    """Temperature scaling: the single scalar that minimises held-out NLL."""
+    log_temperature = torch.zeros(1, requires_grad=True)
+    optimizer = torch.optim.LBFGS([log_temperature], lr=0.1, max_iter=100)
+
+    def closure():
+        optimizer.zero_grad()
+        loss = F.cross_entropy(logits / log_temperature.exp(), labels)
+        loss.backward()
+        return loss
+
+    optimizer.step(closure)
+    return float(log_temperature.exp())
+
+
+def train(output: str, samples: Optional[str], synthetic: int, epochs: int, seed: int) -> None:
+    rng = random.Random(seed)
+    torch.manual_seed(seed)
+
+    images = [synthetic_otp_image(rng) for _ in range(synthetic)]
+    if samples:
+        real = load_labelled_samples(samples)
+        # Real samples are scarce, weight them up
+        images.extend(real * 5)
+        print(f"Loaded {len(real)} labelled samples from {samples}")
+    digits, labels = labelled_digits(images)
+    print(f"Segmented {len(digits)} digits from {len(images)} images")
+
+    order = list(range(len(digits)))
+    rng.shuffle(order)
+    split = int(0.85 * len(order))
+    train_idx, val_idx = order[:split], order[split:]
+    x_val = torch.from_numpy(np.stack([digits[i] for i in val_idx])).unsqueeze(1)
+    y_val = torch.tensor([labels[i] for i in val_idx])
+
+    model = DigitCNN()
+    optimizer = torch.optim.Adam(model.parameters(), lr=1e-3)
+    for epoch in range(epochs):
+        model.train()
+        rng.shuffle(train_idx)
+        for start in range(0, len(train_idx), 128):
+            batch = train_idx[start:start + 128]
+            x = torch.from_numpy(np.stack([_augment(digits[i], rng) for i in batch])).unsqueeze(1)
+            y = torch.tensor([labels[i] for i in batch])
+            optimizer.zero_grad()
+            F.cross_entropy(model(x), y).backward()
+            optimizer.step()
+        model.eval()
+        with torch.inference_mode():
+            accuracy = (model(x_val).argmax(1) == y_val).float().mean().item()
+        print(f"epoch {epoch + 1}: validation digit accuracy {accuracy:.4f}")
+
+    model.eval()
+    with torch.no_grad():
+        # Never sharpen: a synthetic validation set is easier than real photos, and an
+        # overconfident model would skip the Gemini fallback on exactly the hard cases
+        temperature = max(1.0, fit_temperature(model(x_val), y_val))
+    print(f"Calibrated temperature {temperature:.3f}")
+
+    os.makedirs(os.path.dirname(os.path.abspath(output)), exist_ok=True)
+    torch.save({"state_dict": model.state_dict(), "temperature": temperature}, output)
+    print(f"Saved {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Train and calibrate the OTP digit CNN.")
+    parser.add_argument("--output", default=OTP_MODEL_PATH)
+    parser.add_argument("--samples", help="Directory with labelled OTP photos and labels.csv (filename,otp)")
+    parser.add_argument("--synthetic", type=int, default=4000, help="Synthetic OTP images to render")
+    parser.add_argument("--epochs", type=int, default=6)
+    parser.add_argument("--seed", type=int, default=7)
+    args = parser.parse_args()
+    train(args.output, args.samples, args.synthetic, args.epochs, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,158 @@
+"""
+Cheap local screening of pages before they are sent to Gemini.
+
+Scanned batches carry blank separator sheets, the same page scanned twice and
+cover letters. Each rendered page is checked with a few OpenCV passes on a
+reduced grayscale copy (tens of milliseconds, against seconds for a Gemini
+call) and only candidate pages reach the LLM:
+
+- blank: almost no intensity variation or almost no ink
+- duplicate: byte-identical to a page already kept in the same request,
+  across pages and files. Near-duplicate rescans are only caught when
+  PAGE_DUPLICATE_DISTANCE is set: pages rendered from one e-Aadhaar or e-PAN
+  template for different people can be only a few bits apart, so perceptual
+  matching is opt-in.
+- no_document: no card-shaped rectangle and no face anywhere on the page
+"""
+
+import hashlib
+import os
+import threading
+from typing import List, Optional, Set, Tuple
+
+import cv2
+import numpy as np
+
+from .extraction_cache import dhash
+
+PAGE_FILTER_ENABLED = os.getenv("PAGE_FILTER_ENABLED", "true").lower() == "true"
+PAGE_BLANK_STDDEV = float(os.getenv("PAGE_BLANK_STDDEV", "6"))
+PAGE_BLANK_INK_RATIO = float(os.getenv("PAGE_BLANK_INK_RATIO", "0.002"))
+# Max differing dHash bits (of 256) for a near-duplicate; negative disables perceptual matching
+PAGE_DUPLICATE_DISTANCE = int(os.getenv("PAGE_DUPLICATE_DISTANCE", "-1"))
+PAGE_CARD_CHECK = os.getenv("PAGE_CARD_CHECK", "true").lower() == "true"
+
+# ID-1 cards (Aadhaar, PAN) are 85.6 x 54 mm
+CARD_ASPECT = 85.6 / 54.0
+CARD_ASPECT_TOLERANCE = 0.1
+CARD_MIN_AREA_RATIO = 0.04
+
+_face_detector = None
+
+
+def _faces():
+    """Haar frontal-face detector bundled with opencv-python, or None in builds without it."""
+    global _face_detector
+    if _face_detector is None and hasattr(cv2, "CascadeClassifier"):
+        _face_detector = cv2.CascadeClassifier(os.path.join(cv2.data.haarcascades, "haarcascade_frontalface_default.xml"))
+    return _face_detector
+
+
+def is_blank(gray: np.ndarray) -> bool:
+    if float(gray.std()) < PAGE_BLANK_STDDEV:
+        return True
+    # Dark pixels relative to the page's own background, so grey scans of white paper still count as blank
+    ink = gray < (np.median(gray) - 60)
+    return float(ink.mean()) < PAGE_BLANK_INK_RATIO
+
+
+def _is_card_aspect(width: float, height: float) -> bool:
+    if min(width, height) <= 0:
+        return False
+    aspect = max(width, height) / min(width, height)
+    return abs(aspect - CARD_ASPECT) <= CARD_ASPECT_TOLERANCE
+
+
+def find_card(image: np.ndarray) -> Optional[Tuple[int, int, int, int]]:
+    """
+    Bounding box (x, y, width, height) of the largest card-shaped rectangle on the page, if any.
+
+    `image` is grayscale or BGR; on a colour image edges are taken per channel,
+    which also finds a card edge as bright as the surface it lies on.
+    """
+    height, width = image.shape[:2]
+    blurred = cv2.GaussianBlur(image, (5, 5), 0)
+    edges = np.zeros((height, width), np.uint8)
+    for channel in (cv2.split(blurred) if blurred.ndim == 3 else [blurred]):
+        edges |= cv2.Canny(channel, 50, 150)
+    edges = cv2.dilate(edges, np.ones((3, 3), np.uint8))
+    contours, _ = cv2.findContours(edges, cv2.RETR_LIST, cv2.CHAIN_APPROX_SIMPLE)
+    min_area = CARD_MIN_AREA_RATIO * width * height
+    best, best_area = None, 0.0
+    for contour in contours:
+        area = cv2.contourArea(contour)
+        if area < min_area or area <= best_area:
+            continue
+        (_, _), (rect_width, rect_height), _ = cv2.minAreaRect(contour)
+        if _is_card_aspect(rect_width, rect_height) and area > 0.8 * rect_width * rect_height:
+            best, best_area = cv2.boundingRect(contour), area
+    return best
+
+
+def has_id_card(gray: np.ndarray) -> bool:
+    """A card-shaped rectangle (or a card-shaped photo) or a face on the page."""
+    height, width = gray.shape
+    if _is_card_aspect(width, height) or find_card(gray) is not None:
+        return True
+
+    detector = _faces()
+    if detector is None:
+        return False
+    # Only pages without a card outline get here; the cascade dominates the cost, so run it small and coarse
+    scale = min(1.0, 480.0 / max(width, height))
+    small = cv2.resize(gray, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else gray
+    return len(detector.detectMultiScale(small, scaleFactor=1.3, minNeighbors=5, minSize=(16, 16))) > 0
+
+
+class PageFilter:
+    """
+    Per-request page screen; remembers kept pages so duplicates are caught across files.
+
+    Safe to call from several threadpool workers at once.
+    """
+
+    def __init__(self, duplicate_distance: int = PAGE_DUPLICATE_DISTANCE, card_check: bool = PAGE_CARD_CHECK):
+        self.duplicate_distance = duplicate_distance
+        self.card_check = card_check
+        self._seen_digests: Set[bytes] = set()
+        self._seen: List[int] = []
+        self._lock = threading.Lock()
+
+    def check(self, image_bytes: bytes, require_card: bool = True) -> Optional[str]:
+        """
+        Screen one page image.
+
+        Args:
+            image_bytes: Encoded page image
+            require_card: Also reject pages without anything that looks like an
+                ID card (used for PDF pages, not for photos the user took of a card)
+
+        Returns:
+            None to keep the page, otherwise why it was skipped: "blank",
+            "duplicate" or "no_document"
+        """
+        gray = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_REDUCED_GRAYSCALE_2)
+        if gray is None:
+            # Not decodable here; let the LLM call report the problem
+            return None
+        if is_blank(gray):
+            return "blank"
+        if require_card and self.card_check and not has_id_card(gray):
+            return "no_document"
+
+        digest = hashlib.sha256(image_bytes).digest()
+        page_hash = dhash(image_bytes) if self.duplicate_distance >= 0 else None
+        with self._lock:
+            if digest in self._seen_digests:
+                return "duplicate"
+            if page_hash is not None:
+                if any(bin(page_hash ^ seen).count("1") <= self.duplicate_distance for seen in self._seen):
+                    return "duplicate"
+                self._seen.append(page_hash)
+            self._seen_digests.add(digest)
+        return None
+
+
+def new_page_filter() -> Optional[PageFilter]:
+    """A fresh filter for one request, or None when filtering is switched off."""
+    return PageFilter() if PAGE_FILTER_ENABLED else None
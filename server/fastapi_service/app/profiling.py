@@ -0,0 +1,101 @@
+"""
+On-demand profiling of individual requests.
+
+A request is profiled when it carries `X-Profile-Token` matching
+PROFILING_TOKEN, or when it is picked by PROFILING_SAMPLE_RATE. The profile
+is taken with pyinstrument in async mode: time spent awaiting a provider,
+the rasterizer or threadpool work is attributed to the `await` that waited
+for it, next to CPU time on the event loop (pydantic validation, image
+preprocessing, ...). It is written to PROFILE_DIR in speedscope format
+(open it at https://www.speedscope.app) and its file name is returned in the
+`X-Profile-Id` response header.
+
+With neither a token nor a sample rate configured the middleware passes
+requests straight through; pyinstrument is only imported when a request is
+actually profiled.
+"""
+
+import hmac
+import os
+import random
+import re
+import time
+import uuid
+
+from fastapi.concurrency import run_in_threadpool
+
+PROFILING_TOKEN = os.getenv("PROFILING_TOKEN", "")
+PROFILING_SAMPLE_RATE = float(os.getenv("PROFILING_SAMPLE_RATE", "0"))
+PROFILE_DIR = os.getenv("PROFILE_DIR", "profiles")
+PROFILING_INTERVAL_SECONDS = float(os.getenv("PROFILING_INTERVAL_SECONDS", "0.001"))
+# Oldest profiles are deleted beyond this many files
+PROFILE_MAX_FILES = int(os.getenv("PROFILE_MAX_FILES", "200"))
+PROFILE_HEADER = "x-profile-token"
+
+
+def _profile_name(scope) -> str:
+    path = re.sub(r"[^A-Za-z0-9]+", "-", scope["path"]).strip("-") or "root"
+    return f"{time.strftime('%Y%m%d-%H%M%S')}-{scope['method'].lower()}-{path}-{uuid.uuid4().hex[:8]}"
+
+
+def _write_profile(session, name: str) -> None:
+    from pyinstrument.renderers import SpeedscopeRenderer
+
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PROFILE_DIR, f"{name}.speedscope.json")
+    with open(path, "w") as f:
+        f.write(SpeedscopeRenderer().render(session))
+
+    profiles = sorted(
+        (entry for entry in os.scandir(PROFILE_DIR) if entry.name.endswith(".speedscope.json")),
+        key=lambda entry: entry.stat().st_mtime,
+    )
+    for entry in profiles[:max(0, len(profiles) - PROFILE_MAX_FILES)]:
+        os.remove(entry.path)
+
+
+class ProfilingMiddleware:
+    """ASGI middleware: profiles requests selected by token or sampling, see the module docstring."""
+
+    def __init__(self, app):
+        self.app = app
+        self.enabled = bool(PROFILING_TOKEN) or PROFILING_SAMPLE_RATE > 0
+        self._token = PROFILING_TOKEN.encode("latin-1")
+
+    def _selected(self, scope) -> bool:
+        if PROFILING_TOKEN:
+            for name, value in scope.get("headers", []):
+                if name == PROFILE_HEADER.encode() and hmac.compare_digest(value, self._token):
+                    return True
+        return PROFILING_SAMPLE_RATE > 0 and random.random() < PROFILING_SAMPLE_RATE
+
+    async def __call__(self, scope, receive, send):
+        if not self.enabled or scope["type"] != "http" or not self._selected(scope):
+            await self.app(scope, receive, send)
+            return
+
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            print("Profiling requested but pyinstrument is not installed")
+            self.enabled = False
+            await self.app(scope, receive, send)
+            return
+
+        name = _profile_name(scope)
+
+        async def send_with_id(message):
+            if message["type"] == "http.response.start":
+                message["headers"] = [*message.get("headers", []), (b"x-profile-id", name.encode())]
+            await send(message)
+
+        profiler = Profiler(interval=PROFILING_INTERVAL_SECONDS, async_mode="enabled")
+        profiler.start()
+        try:
+            await self.app(scope, receive, send_with_id)
+        finally:
+            session = profiler.stop()
+            try:
+                await run_in_threadpool(_write_profile, session, name)
+            except Exception as e:
+                print(f"Writing profile {name} failed: {e}")
@@ -0,0 +1,157 @@
+"""
+Parallel PDF rasterization in a process pool.
+
+PyMuPDF rendering and PNG encoding are CPU-bound and hold the GIL, so doing
+them inside an async handler blocks the event loop. Pages are rendered by
+worker processes instead: an in-memory PDF is placed in shared memory once
+and a spooled upload is memory-mapped from its file, so every worker opens it
+without a pickled copy, and page images are yielded back to the caller as
+soon as each one finishes.
+"""
+
+import asyncio
+import mmap
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager
+from multiprocessing.shared_memory import SharedMemory
+from typing import AsyncIterator, Iterator, List, Optional, Tuple, Union
+
+import fitz  # PyMuPDF
+
+RASTER_WORKERS = int(os.getenv("RASTER_WORKERS", "0")) or os.cpu_count() or 1
+
+# A PDF in memory, or the path of a spooled upload
+PdfSource = Union[bytes, str]
+
+
+@contextmanager
+def open_pdf(source: PdfSource) -> Iterator["fitz.Document"]:
+    """
+    Open a PDF from bytes or a spooled file without reading the file into memory.
+
+    Spool files are memory-mapped, so pages are paged in by the OS as PyMuPDF
+    touches them and nothing is copied onto the Python heap.
+    """
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        document = fitz.open(stream=source, filetype="pdf")
+        try:
+            yield document
+        finally:
+            document.close()
+        return
+
+    with open(source, "rb") as f:
+        mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    view = memoryview(mapped)
+    try:
+        document = fitz.open(stream=view, filetype="pdf")
+        try:
+            yield document
+        finally:
+            # The document holds a view into the map, release it before unmapping
+            document.close()
+    finally:
+        view.release()
+        mapped.close()
+
+
+def count_pages(source: PdfSource) -> int:
+    with open_pdf(source) as document:
+        return len(document)
+
+
+def render_page(document: "fitz.Document", page_num: int, dpi: int) -> bytes:
+    """Render one page of an open document to PNG bytes."""
+    page = document.load_page(page_num)
+    # Calculate matrix for DPI scaling
+    zoom = dpi / 72.0  # 72 is the default DPI
+    pix = page.get_pixmap(matrix=fitz.Matrix(zoom, zoom))
+    return pix.tobytes("png")
+
+
+def _render_shared_page(shm_name: str, size: int, page_num: int, dpi: int) -> Tuple[int, bytes]:
+    """Worker entry point: open the PDF straight from shared memory and render one page."""
+    shm = SharedMemory(name=shm_name)
+    try:
+        buffer = shm.buf[:size]
+        document = fitz.open(stream=buffer, filetype="pdf")
+        try:
+            return page_num, render_page(document, page_num, dpi)
+        finally:
+            # The document holds a view into the segment, release it before closing
+            document.close()
+            buffer.release()
+    finally:
+        shm.close()
+
+
+def _render_file_page(path: str, page_num: int, dpi: int) -> Tuple[int, bytes]:
+    """Worker entry point: memory-map a spooled PDF and render one page."""
+    with open_pdf(path) as document:
+        return page_num, render_page(document, page_num, dpi)
+
+
+class PdfRasterizer:
+    """Process pool that renders PDF pages in parallel across cores."""
+
+    def __init__(self, max_workers: int = RASTER_WORKERS):
+        self.max_workers = max_workers
+        # spawn: forking a process that already runs threads (uvicorn, the threadpool) is unsafe
+        self._pool = ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"))
+
+    async def iter_pages(self, source: PdfSource, dpi: int = 150, pages: Optional[List[int]] = None) -> AsyncIterator[Tuple[int, bytes]]:
+        """
+        Render pages and yield `(page_num, png_bytes)` in completion order.
+
+        Args:
+            source: Raw PDF document, or the path of a spooled upload
+            dpi: Render resolution
+            pages: Page numbers to render, all pages when omitted
+        """
+        loop = asyncio.get_running_loop()
+        if pages is None:
+            pages = list(range(await loop.run_in_executor(None, count_pages, source)))
+        if not pages:
+            return
+
+        if isinstance(source, str):
+            futures = [loop.run_in_executor(self._pool, _render_file_page, source, page_num, dpi) for page_num in pages]
+            try:
+                for next_done in asyncio.as_completed(futures):
+                    yield await next_done
+            finally:
+                for future in futures:
+                    future.cancel()
+            return
+
+        pdf_bytes = source
+        shm = SharedMemory(create=True, size=len(pdf_bytes))
+        futures = []
+        try:
+            shm.buf[:len(pdf_bytes)] = pdf_bytes
+            futures = [
+                loop.run_in_executor(self._pool, _render_shared_page, shm.name, len(pdf_bytes), page_num, dpi)
+                for page_num in pages
+            ]
+            for next_done in asyncio.as_completed(futures):
+                yield await next_done
+        finally:
+            for future in futures:
+                future.cancel()
+            shm.close()
+            shm.unlink()
+
+    async def render(self, source: PdfSource, dpi: int = 150, pages: Optional[List[int]] = None) -> List[bytes]:
+        """Render pages in parallel and return them in page order."""
+        rendered = dict([item async for item in self.iter_pages(source, dpi, pages)])
+        return [rendered[page_num] for page_num in sorted(rendered)]
+
+    async def warm_up(self) -> None:
+        """Start the worker processes now rather than on the first upload."""
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(self._pool, os.getpid) for _ in range(self.max_workers)))
+
+    def close(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,42 @@
+"""
+Per-request counters reported back to the client as response headers.
+
+A middleware opens a `RequestStats` for every request; code anywhere below
+the handler (preprocessing, provider calls, caches) adds to it with
+`record_stat` without having to thread it through every signature.
+"""
+
+from contextvars import ContextVar
+from typing import Dict, Optional, Union
+
+Number = Union[int, float]
+
+_current: ContextVar[Optional["RequestStats"]] = ContextVar("request_stats", default=None)
+
+
+class RequestStats:
+    def __init__(self):
+        self.values: Dict[str, Number] = {}
+
+    def add(self, header: str, amount: Number) -> None:
+        self.values[header] = self.values.get(header, 0) + amount
+
+    def headers(self) -> Dict[str, str]:
+        return {
+            header: str(round(value, 1) if isinstance(value, float) else value)
+            for header, value in self.values.items()
+        }
+
+
+def begin_request_stats() -> RequestStats:
+    """Start collecting for the current request context."""
+    stats = RequestStats()
+    _current.set(stats)
+    return stats
+
+
+def record_stat(header: str, amount: Number) -> None:
+    """Add `amount` to the response header `header`; a no-op outside a request."""
+    stats = _current.get()
+    if stats is not None:
+        stats.add(header, amount)
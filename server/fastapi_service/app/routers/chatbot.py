@@ -1,56 +1,51 @@
-import os
-from fastapi import APIRouter, HTTPException
-from pydantic import BaseModel
-from typing import List, Optional
-import numpy as np
-
-from langchain_aws import BedrockEmbeddings
-from supabase import create_client, Client
-from ibm_watsonx_ai.foundation_models import ModelInference
-from ibm_watsonx_ai.credentials import Credentials
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.concurrency import run_in_threadpool
 
 from app.schemas import ChatRequest, ChatResponse
 from app.chat_utils import retrieve_context, build_prompt, generate_answer
-
-router = APIRouter()
-
-AWS_REGION = os.getenv("AWS_REGION")
-AWS_ACCESS_KEY_ID = os.getenv("AWS_ACCESS_KEY_ID")
-AWS_SECRET_ACCESS_KEY = os.getenv("AWS_SECRET_ACCESS_KEY")
-SUPABASE_URL = os.getenv("SUPABASE_URL")
-SUPABASE_KEY = os.getenv("SUPABASE_ANON_KEY")
-IBM_API_KEY = os.getenv("IBM_API_KEY")
-IBM_PROJECT_ID = os.getenv("IBM_PROJECT_ID")
-EMBEDDING_MODEL = "amazon.titan-embed-text-v1"
-EMBEDDING_DIM = 1536
-
-bedrock_embeddings = BedrockEmbeddings(
-	model_id=EMBEDDING_MODEL,
-	region_name=AWS_REGION
-)
-supabase: Client = create_client(SUPABASE_URL, SUPABASE_KEY)
-ibm_credentials = Credentials(
-	url="https://us-south.ml.cloud.ibm.com",
-	api_key=IBM_API_KEY
-)
-ibm_model = ModelInference(
-	# model_id="ibm/granite-13b-instruct-v2",
-	model_id="meta-llama/llama-2-13b-chat",
-	# model_id="mistralai/mistral-small-3-1-24b-instruct-2503",
-
-	credentials=ibm_credentials,
-	project_id=IBM_PROJECT_ID
-)
+from app.clients import ClientRegistry, get_chat_clients, get_clients
+from app.deadlines import CHAT_DEADLINE_SECONDS, call_with_deadline, route_deadline, wait_with_deadline
+from app.singleflight import SingleFlight, fingerprint, normalize_query
+
+router = APIRouter(dependencies=[Depends(route_deadline(CHAT_DEADLINE_SECONDS))])
+
+# Identical questions asked while one is already being answered share its result
+_inflight = SingleFlight()
+
+
+async def _answer_query(clients: ClientRegistry, query: str, top_k: int) -> ChatResponse:
+	# The provider SDKs are blocking, keep them off the event loop so waiters can join
+	contexts = await wait_with_deadline("retrieve_context", run_in_threadpool(
+		retrieve_context, query, top_k, clients.bedrock_embeddings, clients.supabase, clients.embedding_replica
+	))
+	if not contexts:
+		raise HTTPException(status_code=404, detail="No relevant context found.")
+	prompt = build_prompt(query, contexts)
+	# No hedge: a cancelled threadpool call keeps running, so the loser would still be a billed generation
+	answer = await call_with_deadline(
+		"generate", lambda: run_in_threadpool(generate_answer, prompt, clients.ibm_model, 512), hedge=False
+	)
+	return ChatResponse(answer=answer, context=[c.get('content', '') for c in contexts])
+
+
+@router.get("/chat/health")
+async def chat_health(clients: ClientRegistry = Depends(get_clients)):
+	"""Health of the RAG chat providers and the local embedding replica."""
+	replica = clients.embedding_replica
+	return {
+		"status": "healthy" if not clients.errors else "degraded",
+		"service": "Compliance Chat",
+		"unavailable": clients.errors,
+		"embedding_replica": replica.status() if replica is not None else None
+	}
 
 
 @router.post("/chat", response_model=ChatResponse)
-async def chat_rag(request: ChatRequest):
+async def chat_rag(request: ChatRequest, clients: ClientRegistry = Depends(get_chat_clients)):
+	key = fingerprint("chat", normalize_query(request.query), str(request.top_k))
 	try:
-		contexts = retrieve_context(request.query, request.top_k, bedrock_embeddings, supabase)
-		if not contexts:
-			raise HTTPException(status_code=404, detail="No relevant context found.")
-		prompt = build_prompt(request.query, contexts)
-		answer = generate_answer(prompt, ibm_model, max_tokens=512)
-		return ChatResponse(answer=answer, context=[c.get('content', '') for c in contexts])
+		return await _inflight.do(key, lambda: _answer_query(clients, request.query, request.top_k))
+	except HTTPException:
+		raise
 	except Exception as e:
 		raise HTTPException(status_code=500, detail=str(e))
@@ -0,0 +1,101 @@
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Depends
+from fastapi.responses import StreamingResponse
+from typing import List, Literal
+import json
+from ..jobs import JobQueue
+from ..clients import get_job_queue
+from ..schemas import OCRJobSubmitResponse, OCRJobStatus
+from ..utils import PROGRESSIVE_MIN_DPI, PROGRESSIVE_MAX_DPI
+from ..uploads import spool_uploads
+
+router = APIRouter(prefix="/ocr/jobs", tags=["OCR Jobs"])
+
+
+@router.post("", response_model=OCRJobSubmitResponse, status_code=202)
+async def submit_job(
+    files: List[UploadFile] = File(...),
+    doc_type: Literal["aadhaar", "pan"] = Query(..., description="Document type in every uploaded file"),
+    progressive: bool = Query(True, description="Render PDFs at min_dpi first and re-render only pages that fail validation"),
+    min_dpi: int = Query(PROGRESSIVE_MIN_DPI, ge=50, le=600),
+    max_dpi: int = Query(PROGRESSIVE_MAX_DPI, ge=50, le=600),
+    job_queue: JobQueue = Depends(get_job_queue),
+):
+    """
+    Queue a batch of Aadhaar or PAN documents for background extraction.
+
+    Returns immediately with a job id. Each file is extracted separately by the
+    background workers; poll `status_url` or read `stream_url` (NDJSON) for
+    per-document results as they complete.
+    """
+    if not files:
+        raise HTTPException(status_code=400, detail="No files uploaded")
+
+    allowed_types = {
+        "image/png", "image/jpeg", "image/jpg", "image/webp",
+        "application/pdf"
+    }
+    for file in files:
+        if file.content_type not in allowed_types:
+            raise HTTPException(
+                status_code=400,
+                detail=f"File {file.filename} has unsupported type {file.content_type}. Supported types: images (PNG, JPEG, WEBP) and PDF"
+            )
+    if min_dpi > max_dpi:
+        raise HTTPException(status_code=400, detail=f"min_dpi ({min_dpi}) must not exceed max_dpi ({max_dpi})")
+
+    try:
+        files_data = []
+        for upload in await spool_uploads(files):
+            # Queued documents live in the job database, the spool file is not needed after this
+            files_data.append({
+                'content': upload.read(),
+                'content_type': upload.content_type,
+                'filename': upload.filename
+            })
+            upload.close()
+
+        options = {"progressive": progressive, "min_dpi": min_dpi, "max_dpi": max_dpi}
+        job_id = await job_queue.submit(doc_type, files_data, options)
+        return OCRJobSubmitResponse(
+            job_id=job_id,
+            status="queued",
+            total=len(files_data),
+            status_url=f"/ocr/jobs/{job_id}",
+            stream_url=f"/ocr/jobs/{job_id}/stream",
+        )
+
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error queueing OCR job: {str(e)}")
+
+
+@router.get("/{job_id}", response_model=OCRJobStatus)
+async def get_job(
+    job_id: str,
+    include_results: bool = Query(True, description="Include extracted records of finished documents"),
+    job_queue: JobQueue = Depends(get_job_queue),
+):
+    """Progress of a job and the state of each of its documents."""
+    job = await job_queue.status(job_id, include_results)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+    return job
+
+
+@router.get("/{job_id}/stream")
+async def stream_job(job_id: str, job_queue: JobQueue = Depends(get_job_queue)):
+    """
+    Stream per-document results as newline-delimited JSON.
+
+    One `{"type": "document", ...}` line is written as each document finishes,
+    followed by a final `{"type": "job", ...}` summary line.
+    """
+    if await job_queue.status(job_id, include_results=False) is None:
+        raise HTTPException(status_code=404, detail=f"Job {job_id} not found")
+
+    async def lines():
+        async for event in job_queue.stream(job_id):
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
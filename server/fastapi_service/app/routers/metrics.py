@@ -0,0 +1,13 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+from ..metrics import REGISTRY
+
+router = APIRouter(tags=["Monitoring"])
+
+PROMETHEUS_CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+@router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """Expose stage latencies, fallback and quota counters in Prometheus text format."""
+    return PlainTextResponse(REGISTRY.render(), media_type=PROMETHEUS_CONTENT_TYPE)
@@ -1,9 +1,61 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException, Query
-from typing import List
-from ..utils import OcrAgent, APIQuotaExceededException
-from ..schemas import AadhaarExtractedData, PANExtractedData
+from fastapi import APIRouter, UploadFile, File, HTTPException, Query, Depends
+import asyncio
+from typing import List, Literal, Optional
+from ..utils import OcrAgent, APIQuotaExceededException, begin_gemini_slots, PROGRESSIVE_MIN_DPI, PROGRESSIVE_MAX_DPI, FANOUT_GROUP_SIZE, FANOUT_MAX_CONCURRENCY
+from ..clients import get_ocr_agent
+from ..schemas import AadhaarValidatedData, PANValidatedData, AadhaarFileResult, PANFileResult, ClassifiedExtractionResult
+from ..singleflight import SingleFlight, fingerprint
+from ..uploads import SpooledUpload, spool_uploads, run_with_uploads
+from ..page_filter import new_page_filter
+from ..deadlines import OCR_BATCH_DEADLINE_SECONDS, OCR_DEADLINE_SECONDS, route_deadline
+
+router = APIRouter(prefix="/ocr", tags=["OCR"], dependencies=[Depends(route_deadline(OCR_DEADLINE_SECONDS))])
+
+# Double-submitted uploads wait on the extraction that is already running
+_inflight = SingleFlight()
+
+
+def _upload_fingerprint(endpoint: str, uploads: List[SpooledUpload]) -> str:
+    """Fingerprint an upload by endpoint and the content hash of every file, in order."""
+    parts = [endpoint]
+    for upload in uploads:
+        parts.append(upload.content_type)
+        parts.append(upload.sha256)
+    return fingerprint(*parts)
+
+
+async def _extract_files(ocr_agent: OcrAgent, doc_type: str, uploads: List[SpooledUpload], progressive: bool, min_dpi: int, max_dpi: int) -> list:
+    """Run the extraction for every uploaded file and return the records in upload order."""
+    # One filter for the whole request so a page repeated in two files is only sent once
+    page_filter = new_page_filter()
+    if progressive:
+        # Each file, and each PDF page, is validated on its own and only failures go back at higher resolution
+        per_file = await asyncio.gather(*(
+            ocr_agent.extract_file(doc_type, upload.source, upload.content_type, True, min_dpi, max_dpi, page_filter)
+            for upload in uploads
+        ))
+        return [record for records in per_file for record in records]
+
+    # Convert files to images; everything goes to Gemini in one call so all pages are needed at once
+    all_images = []
+    for upload in uploads:
+        if upload.content_type == 'application/pdf':
+            pdf_images = await ocr_agent.render_pdf(upload.source)
+            all_images.extend(await ocr_agent.filter_pages(page_filter, pdf_images))
+        else:
+            all_images.extend(await ocr_agent.filter_pages(page_filter, [upload.read()], require_card=False))
+    if not all_images:
+        return []
+    
+    if doc_type == "aadhaar":
+        return await ocr_agent.extract_aadhaar_data(all_images)
+    return await ocr_agent.extract_pan_data(all_images)
+
+
+def _check_dpi_range(min_dpi: int, max_dpi: int) -> None:
+    if min_dpi > max_dpi:
+        raise HTTPException(status_code=400, detail=f"min_dpi ({min_dpi}) must not exceed max_dpi ({max_dpi})")
 
-router = APIRouter(prefix="/ocr", tags=["OCR"])
 
 @router.get("/health")
 async def health_check():
@@ -12,18 +64,14 @@ async def health_check():
 
 
 @router.get("/test-gemini")
-async def test_gemini_endpoint():
+async def test_gemini_endpoint(ocr_agent: OcrAgent = Depends(get_ocr_agent)):
     """Test endpoint to verify Gemini API integration is working."""
     try:
-        from ..utils import OcrAgent
         import os
         
         # Get the region being used (note: may not be directly supported by provider)
         region = os.getenv("GEMINI_REGION", "us-central1")
         
-        # Initialize OCR agent (which sets up Gemini)
-        ocr_agent = OcrAgent()
-        
         # Create a simple agent to test text-only queries
         from pydantic_ai import Agent
         from pydantic import BaseModel
@@ -56,8 +104,14 @@ async def test_gemini_endpoint():
         )
 
 
-@router.post("/extract-aadhaar", response_model=List[AadhaarExtractedData])
-async def extract_aadhaar_data(files: List[UploadFile] = File(...)):
+@router.post("/extract-aadhaar", response_model=List[AadhaarValidatedData])
+async def extract_aadhaar_data(
+    files: List[UploadFile] = File(...),
+    progressive: bool = Query(True, description="Render PDFs at min_dpi first and re-render only pages that fail validation"),
+    min_dpi: int = Query(PROGRESSIVE_MIN_DPI, ge=50, le=600, description="Resolution of the first pass over PDF pages"),
+    max_dpi: int = Query(PROGRESSIVE_MAX_DPI, ge=50, le=600, description="Highest resolution a failing page is re-rendered at"),
+    ocr_agent: OcrAgent = Depends(get_ocr_agent),
+):
     """
     Extract data specifically from Aadhaar card images or PDFs.
     
@@ -66,6 +120,13 @@ async def extract_aadhaar_data(files: List[UploadFile] = File(...)):
     - PDF documents (each page will be processed separately)
     - Multiple file uploads for batch processing
     
+    In progressive mode (the default) PDF pages are first rendered at min_dpi and
+    uploads are sent downscaled; only pages whose Aadhaar number fails validation
+    are re-rendered at higher resolution (up to max_dpi) and read again. When a
+    single card's number or date of birth fails, just those fields are re-read
+    from a crop of the card. The PIN code is printed with the address, not on
+    the front of the card, so a page whose PIN fails is read again as a whole.
+    
     Extracted Aadhaar fields:
     - Aadhaar Number (12-digit unique ID)
     - Full Name
@@ -77,6 +138,9 @@ async def extract_aadhaar_data(files: List[UploadFile] = File(...)):
     - Email Address (if available)
     - PIN Code (6-digit)
     - State and District
+    - field_validation: valid/invalid/missing for the Aadhaar number (Verhoeff
+      checksum), date of birth and PIN code; "masked" for an Aadhaar number
+      printed with only its last four digits
     """
     if not files:
         raise HTTPException(status_code=400, detail="No files uploaded")
@@ -91,45 +155,34 @@ async def extract_aadhaar_data(files: List[UploadFile] = File(...)):
                 status_code=400, 
                 detail=f"File {file.filename} has unsupported type {file.content_type}. Supported types: images (PNG, JPEG, WEBP) and PDF"
             )
+    _check_dpi_range(min_dpi, max_dpi)
     
     try:
-        # Read file contents and prepare data
-        files_data = []
-        for file in files:
-            content = await file.read()
-            files_data.append({
-                'content': content,
-                'content_type': file.content_type,
-                'filename': file.filename
-            })
-        
-        # Initialize OCR agent and extract Aadhaar data
-        ocr_agent = OcrAgent()
+        # Stream the uploads out of the request within the size limits; large files are spooled to disk
+        uploads = await spool_uploads(files)
         
-        # Convert files to images
-        all_images = []
-        for file_data in files_data:
-            content = file_data['content']
-            content_type = file_data['content_type']
-            
-            if content_type == 'application/pdf':
-                pdf_images = ocr_agent.convert_pdf_to_images(content)
-                all_images.extend(pdf_images)
-            else:
-                all_images.append(content)
-        
-        # Extract Aadhaar data
-        extracted_data = await ocr_agent.extract_aadhaar_data(all_images)
+        key = _upload_fingerprint(f"/ocr/extract-aadhaar?progressive={progressive}&dpi={min_dpi}-{max_dpi}", uploads)
+        extracted_data = await run_with_uploads(
+            _inflight, key, uploads, lambda: _extract_files(ocr_agent, "aadhaar", uploads, progressive, min_dpi, max_dpi)
+        )
         return extracted_data
     
     except APIQuotaExceededException as e:
         raise HTTPException(status_code=429, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing Aadhaar documents: {str(e)}")
 
 
-@router.post("/extract-pan", response_model=List[PANExtractedData])
-async def extract_pan_data(files: List[UploadFile] = File(...)):
+@router.post("/extract-pan", response_model=List[PANValidatedData])
+async def extract_pan_data(
+    files: List[UploadFile] = File(...),
+    progressive: bool = Query(True, description="Render PDFs at min_dpi first and re-render only pages that fail validation"),
+    min_dpi: int = Query(PROGRESSIVE_MIN_DPI, ge=50, le=600, description="Resolution of the first pass over PDF pages"),
+    max_dpi: int = Query(PROGRESSIVE_MAX_DPI, ge=50, le=600, description="Highest resolution a failing page is re-rendered at"),
+    ocr_agent: OcrAgent = Depends(get_ocr_agent),
+):
     """
     Extract data specifically from PAN card images or PDFs.
     
@@ -138,6 +191,12 @@ async def extract_pan_data(files: List[UploadFile] = File(...)):
     - PDF documents (each page will be processed separately)
     - Multiple file uploads for batch processing
     
+    In progressive mode (the default) PDF pages are first rendered at min_dpi and
+    uploads are sent downscaled; only pages whose PAN number fails validation
+    are re-rendered at higher resolution (up to max_dpi) and read again. When a
+    single card's PAN or date of birth fails, just those fields are re-read from
+    a crop of the card.
+    
     Extracted PAN fields:
     - PAN Number (10-character alphanumeric in format AAAAA9999A)
     - Full Name
@@ -146,6 +205,8 @@ async def extract_pan_data(files: List[UploadFile] = File(...)):
     - Signature Present (boolean)
     - Photo Present (boolean)
     - Permanent Account Number (if different from PAN number)
+    - field_validation: valid/invalid/missing for the PAN (structure and holder
+      type letter) and date of birth
     """
     if not files:
         raise HTTPException(status_code=400, detail="No files uploaded")
@@ -161,38 +222,146 @@ async def extract_pan_data(files: List[UploadFile] = File(...)):
                 status_code=400, 
                 detail=f"File {file.filename} has unsupported type {file.content_type}. Supported types: images (PNG, JPEG, WEBP) and PDF"
             )
+    _check_dpi_range(min_dpi, max_dpi)
     
     try:
-        # Read file contents and prepare data
-        files_data = []
-        for file in files:
-            content = await file.read()
-            files_data.append({
-                'content': content,
-                'content_type': file.content_type,
-                'filename': file.filename
-            })
-        
-        # Initialize OCR agent and extract PAN data
-        ocr_agent = OcrAgent()
+        # Stream the uploads out of the request within the size limits; large files are spooled to disk
+        uploads = await spool_uploads(files)
         
-        # Convert files to images
-        all_images = []
-        for file_data in files_data:
-            content = file_data['content']
-            content_type = file_data['content_type']
-            
-            if content_type == 'application/pdf':
-                pdf_images = ocr_agent.convert_pdf_to_images(content)
-                all_images.extend(pdf_images)
-            else:
-                all_images.append(content)
-        
-        # Extract PAN data
-        extracted_data = await ocr_agent.extract_pan_data(all_images)
+        key = _upload_fingerprint(f"/ocr/extract-pan?progressive={progressive}&dpi={min_dpi}-{max_dpi}", uploads)
+        extracted_data = await run_with_uploads(
+            _inflight, key, uploads, lambda: _extract_files(ocr_agent, "pan", uploads, progressive, min_dpi, max_dpi)
+        )
         return extracted_data
     
     except APIQuotaExceededException as e:
         raise HTTPException(status_code=429, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing PAN documents: {str(e)}")
+
+
+@router.post("/extract", response_model=ClassifiedExtractionResult)
+async def extract_documents(
+    files: List[UploadFile] = File(...),
+    default_type: Optional[Literal["aadhaar", "pan"]] = Query(None, description="Extractor for pages that can't be classified; they are only reported when omitted"),
+    progressive: bool = Query(True, description="Render PDFs at min_dpi first and re-render only pages that fail validation"),
+    min_dpi: int = Query(PROGRESSIVE_MIN_DPI, ge=50, le=600, description="Resolution of the first pass over PDF pages"),
+    max_dpi: int = Query(PROGRESSIVE_MAX_DPI, ge=50, le=600, description="Highest resolution a failing page is re-rendered at"),
+    ocr_agent: OcrAgent = Depends(get_ocr_agent),
+):
+    """
+    Extract a mixed bundle of Aadhaar and PAN images/PDFs in one pass.
+    
+    Every page is classified locally from its colours (PAN blue vs the saffron
+    and green of Aadhaar, measured inside the card outline when one is found);
+    pages without a colour cue, such as black-and-white photocopies, are
+    classified by a small Gemini call. Each page is sent only to the matching
+    extractor. The response
+    groups records by document type and lists which pages went where:
+    - aadhaar / pan: Extracted records, as from /ocr/extract-aadhaar and /ocr/extract-pan
+    - aadhaar_pages / pan_pages: file_index, filename and page of every routed page
+    - unclassified_pages: Pages that were not extracted (see default_type)
+    """
+    if not files:
+        raise HTTPException(status_code=400, detail="No files uploaded")
+    
+    allowed_types = {
+        "image/png", "image/jpeg", "image/jpg", "image/webp", 
+        "application/pdf"
+    }
+    for file in files:
+        if file.content_type not in allowed_types:
+            raise HTTPException(
+                status_code=400, 
+                detail=f"File {file.filename} has unsupported type {file.content_type}. Supported types: images (PNG, JPEG, WEBP) and PDF"
+            )
+    _check_dpi_range(min_dpi, max_dpi)
+    
+    try:
+        uploads = await spool_uploads(files)
+        
+        key = _upload_fingerprint(f"/ocr/extract?default_type={default_type}&progressive={progressive}&dpi={min_dpi}-{max_dpi}", uploads)
+        return await run_with_uploads(
+            _inflight, key, uploads, lambda: ocr_agent.extract_classified(uploads, progressive, min_dpi, max_dpi, default_type)
+        )
+    
+    except APIQuotaExceededException as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing documents: {str(e)}")
+
+
+async def _extract_batch(ocr_agent: OcrAgent, doc_type: str, files: List[UploadFile], group_size: int, max_concurrency: int) -> List[dict]:
+    """Shared body of the fan-out endpoints: validate, read, extract, and map an all-quota failure to 429."""
+    if not files:
+        raise HTTPException(status_code=400, detail="No files uploaded")
+
+    allowed_types = {
+        "image/png", "image/jpeg", "image/jpg", "image/webp",
+        "application/pdf"
+    }
+    for file in files:
+        if file.content_type not in allowed_types:
+            raise HTTPException(
+                status_code=400,
+                detail=f"File {file.filename} has unsupported type {file.content_type}. Supported types: images (PNG, JPEG, WEBP) and PDF"
+            )
+
+    # The request's Gemini budget (FANOUT_MAX_CONCURRENCY by default) follows the requested concurrency
+    begin_gemini_slots(max_concurrency)
+    try:
+        uploads = await spool_uploads(files)
+
+        key = _upload_fingerprint(f"/ocr/extract-{doc_type}/batch?group_size={group_size}", uploads)
+        results = await run_with_uploads(
+            _inflight, key, uploads, lambda: ocr_agent.extract_fanout(doc_type, uploads, group_size, max_concurrency)
+        )
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing {doc_type} documents: {str(e)}")
+
+    # Only when nothing at all came back because of quota is the whole request a 429
+    if all(result["status"] == "failed" and result["quota_exceeded"] for result in results):
+        raise HTTPException(status_code=429, detail="API quota exceeded. Please wait a few minutes or upgrade your plan.")
+    return results
+
+
+@router.post("/extract-aadhaar/batch", response_model=List[AadhaarFileResult], dependencies=[Depends(route_deadline(OCR_BATCH_DEADLINE_SECONDS))])
+async def extract_aadhaar_batch(
+    files: List[UploadFile] = File(...),
+    group_size: int = Query(FANOUT_GROUP_SIZE, ge=1, le=32, description="Pages sent to Gemini in one call"),
+    max_concurrency: int = Query(FANOUT_MAX_CONCURRENCY, ge=1, le=16, description="Gemini calls in flight at once"),
+    ocr_agent: OcrAgent = Depends(get_ocr_agent),
+):
+    """
+    Extract Aadhaar cards from many files, one result per file.
+
+    Pages are split into groups of `group_size` (never mixing files) and the
+    groups are extracted concurrently. Each file's result lists its records,
+    the pages they came from, and any pages whose group failed; a failed group
+    does not affect other files.
+    """
+    return await _extract_batch(ocr_agent, "aadhaar", files, group_size, max_concurrency)
+
+
+@router.post("/extract-pan/batch", response_model=List[PANFileResult], dependencies=[Depends(route_deadline(OCR_BATCH_DEADLINE_SECONDS))])
+async def extract_pan_batch(
+    files: List[UploadFile] = File(...),
+    group_size: int = Query(FANOUT_GROUP_SIZE, ge=1, le=32, description="Pages sent to Gemini in one call"),
+    max_concurrency: int = Query(FANOUT_MAX_CONCURRENCY, ge=1, le=16, description="Gemini calls in flight at once"),
+    ocr_agent: OcrAgent = Depends(get_ocr_agent),
+):
+    """
+    Extract PAN cards from many files, one result per file.
+
+    Pages are split into groups of `group_size` (never mixing files) and the
+    groups are extracted concurrently. Each file's result lists its records,
+    the pages they came from, and any pages whose group failed; a failed group
+    does not affect other files.
+    """
+    return await _extract_batch(ocr_agent, "pan", files, group_size, max_concurrency)
@@ -1,11 +1,21 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
+from fastapi import APIRouter, UploadFile, File, HTTPException, Depends
 from ..utils import OcrAgent, APIQuotaExceededException
+from ..clients import get_ocr_agent
 from ..schemas import OTPExtractedData
+from ..singleflight import SingleFlight, fingerprint
+from ..uploads import spool_upload
+from ..deadlines import OTP_DEADLINE_SECONDS, route_deadline
 
-router = APIRouter(prefix="/otp", tags=["OTP"])
+router = APIRouter(prefix="/otp", tags=["OTP"], dependencies=[Depends(route_deadline(OTP_DEADLINE_SECONDS))])
+
+# Resubmissions of the same image wait on the detection that is already running
+_inflight = SingleFlight()
 
 @router.post("/detect", response_model=OTPExtractedData)
-async def detect_otp_from_image(file: UploadFile = File(..., description="Image file containing face and OTP sheet")):
+async def detect_otp_from_image(
+    file: UploadFile = File(..., description="Image file containing face and OTP sheet"),
+    ocr_agent: OcrAgent = Depends(get_ocr_agent)
+):
     """
     Extract OTP from an image containing a user's face and a sheet with OTP written on it.
     
@@ -32,14 +42,16 @@ async def detect_otp_from_image(file: UploadFile = File(..., description="Image
         )
     
     try:
-        # Read file content
-        content = await file.read()
-        
-        # Initialize OCR agent and extract OTP
-        ocr_agent = OcrAgent()
+        # Read file content within the upload size limit
+        upload = await spool_upload(file)
+        content = upload.read()
+        upload.close()
         
         # Extract OTP from the image
-        result = await ocr_agent.extract_otp_from_image(content)
+        result = await _inflight.do(
+            fingerprint("/otp/detect", content),
+            lambda: ocr_agent.extract_otp_from_image(content)
+        )
         
         if not result.otp:
             raise HTTPException(
@@ -51,6 +63,8 @@ async def detect_otp_from_image(file: UploadFile = File(..., description="Image
         
     except APIQuotaExceededException as e:
         raise HTTPException(status_code=429, detail=str(e))
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=500, 
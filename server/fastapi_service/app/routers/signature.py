@@ -1,13 +1,42 @@
-from fastapi import APIRouter, UploadFile, File, HTTPException
-from ..signature_verifier import SignatureVerifier, APIQuotaExceededException
+from typing import List, Optional, Tuple
+from fastapi import APIRouter, UploadFile, File, Form, HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
+import csv
+import io
+import json
+import zipfile
+from ..signature_verifier import SIGNATURE_BATCH_MAX_PAIRS, SignatureVerifier, APIQuotaExceededException
+from ..signature_store import SignatureStore
+from ..clients import get_signature_store, get_signature_verifier
+from ..singleflight import SingleFlight, fingerprint
+from ..uploads import MAX_UPLOAD_FILE_BYTES, MAX_UPLOAD_REQUEST_BYTES, spool_upload, spool_uploads, close_uploads
+from ..deadlines import SIGNATURE_BATCH_DEADLINE_SECONDS, SIGNATURE_DEADLINE_SECONDS, route_deadline
 
-router = APIRouter(prefix="/signature", tags=["Signature Verification"])
+router = APIRouter(prefix="/signature", tags=["Signature Verification"], dependencies=[Depends(route_deadline(SIGNATURE_DEADLINE_SECONDS))])
+
+# Identical pairs submitted concurrently share one verification
+_inflight = SingleFlight()
+
+ALLOWED_TYPES = ["image/jpeg", "image/jpg", "image/png", "image/bmp"]
+
+
+async def _read_signatures(files: List[UploadFile]) -> List[bytes]:
+    """Check the image types and read the uploads within the size limits."""
+    if any(file.content_type not in ALLOWED_TYPES for file in files):
+        raise HTTPException(status_code=400, detail="Invalid file type. Allowed: JPG, PNG, BMP")
+    uploads = await spool_uploads(files)
+    try:
+        return [upload.read() for upload in uploads]
+    finally:
+        close_uploads(uploads)
 
 
 @router.post("/verify")
 async def verify_signatures_simple_endpoint(
     signature1: UploadFile = File(..., description="First signature image"),
-    signature2: UploadFile = File(..., description="Second signature image")
+    signature2: UploadFile = File(..., description="Second signature image"),
+    verifier: SignatureVerifier = Depends(get_signature_verifier)
 ):
     """
     Simple signature verification endpoint that returns only the accuracy score.
@@ -29,13 +58,14 @@ async def verify_signatures_simple_endpoint(
                 detail="Invalid file type. Allowed: JPG, PNG, BMP"
             )
         
-        # Read image bytes
-        image1_bytes = await signature1.read()
-        image2_bytes = await signature2.read()
+        # Read image bytes within the upload size limits
+        uploads = await spool_uploads([signature1, signature2])
+        image1_bytes, image2_bytes = (upload.read() for upload in uploads)
+        close_uploads(uploads)
         
-        # Use signature verifier
-        verifier = SignatureVerifier()
-        accuracy = await verifier.verify_signatures_simple(image1_bytes, image2_bytes)
+        # Use the shared signature verifier
+        key = fingerprint("/signature/verify", image1_bytes, image2_bytes)
+        accuracy = await _inflight.do(key, lambda: verifier.verify_signatures_simple(image1_bytes, image2_bytes))
         
         # Determine if signatures match (threshold: 0.6)
         is_match = accuracy >= 0.6
@@ -54,4 +84,221 @@ async def verify_signatures_simple_endpoint(
         raise HTTPException(
             status_code=500, 
             detail=f"Error processing signature verification: {str(e)}"
-        )
\ No newline at end of file
+        )
+
+def _pairs_from_archive(data: bytes) -> List[Tuple[str, bytes, bytes]]:
+    """
+    Read (pair_id, probe, reference) from a zip with a `pairs.csv` manifest.
+
+    The manifest has `probe` and `reference` columns with paths inside the
+    archive and an optional `pair_id` column (default: the row number).
+    """
+    try:
+        archive = zipfile.ZipFile(io.BytesIO(data))
+    except zipfile.BadZipFile:
+        raise HTTPException(status_code=400, detail="archive is not a valid zip file")
+    with archive:
+        try:
+            manifest = archive.read("pairs.csv").decode("utf-8-sig")
+        except KeyError:
+            raise HTTPException(status_code=400, detail="archive must contain a pairs.csv manifest")
+        rows = list(csv.DictReader(io.StringIO(manifest)))
+        if rows and not {"probe", "reference"} <= set(rows[0]):
+            raise HTTPException(status_code=400, detail="pairs.csv needs probe and reference columns")
+
+        # Check the uncompressed sizes before inflating anything
+        names = {row[column] for row in rows for column in ("probe", "reference")}
+        members = {}
+        for name in names:
+            try:
+                members[name] = archive.getinfo(name)
+            except KeyError:
+                raise HTTPException(status_code=400, detail=f"{name} is listed in pairs.csv but missing from the archive")
+            if members[name].file_size > MAX_UPLOAD_FILE_BYTES:
+                raise HTTPException(status_code=413, detail=f"File {name} exceeds the per-file limit of {MAX_UPLOAD_FILE_BYTES} bytes")
+        if sum(info.file_size for info in members.values()) > MAX_UPLOAD_REQUEST_BYTES:
+            raise HTTPException(status_code=413, detail=f"Archive content exceeds the per-request limit of {MAX_UPLOAD_REQUEST_BYTES} bytes")
+
+        images = {name: archive.read(info) for name, info in members.items()}
+    return [
+        (row.get("pair_id") or str(index), images[row["probe"]], images[row["reference"]])
+        for index, row in enumerate(rows)
+    ]
+
+
+@router.post("/verify-batch", dependencies=[Depends(route_deadline(SIGNATURE_BATCH_DEADLINE_SECONDS))])
+async def verify_signature_batch(
+    probes: Optional[List[UploadFile]] = File(None, description="Signatures to verify"),
+    references: Optional[List[UploadFile]] = File(None, description="Reference signatures: one per probe, or a single one for all probes"),
+    archive: Optional[UploadFile] = File(None, description="Zip with the images and a pairs.csv manifest (pair_id,probe,reference)"),
+    verifier: SignatureVerifier = Depends(get_signature_verifier)
+):
+    """
+    Verify many signature pairs in one request, streaming results as NDJSON.
+
+    Pairs come either as multipart `probes` + `references` (pair ids are the
+    probe positions) or as a zip `archive`. Repeated images, typically the
+    customer's reference specimen, are normalized once. Clearly different pairs
+    are decided locally; the rest go to Gemini under a per-worker concurrency
+    limit. `identical_images` flags pairs whose two images are the same, which
+    genuine signatures never are.
+
+    One `{"type": "pair", ...}` line is written per pair as it completes, with
+    either the result or its own `status_code` and `error`, followed by a final
+    `{"type": "batch", ...}` summary line with the outcome counts, how many pairs
+    were `decided_locally` and how many `images_deduplicated`. The response
+    headers are sent before any pair is verified, so these counts are not
+    reported as X-* headers.
+    """
+    try:
+        if archive is not None:
+            if probes or references:
+                raise HTTPException(status_code=400, detail="Send either an archive or probes and references, not both")
+            upload = await spool_upload(archive, max_file_bytes=MAX_UPLOAD_REQUEST_BYTES)
+            try:
+                data = upload.read()
+            finally:
+                upload.close()
+            pairs = await run_in_threadpool(_pairs_from_archive, data)
+        else:
+            if not probes or not references:
+                raise HTTPException(status_code=400, detail="Upload probes and references, or an archive")
+            if len(references) not in (1, len(probes)):
+                raise HTTPException(status_code=400, detail="Upload one reference per probe, or a single reference for all probes")
+            images = await _read_signatures(probes + references)
+            probe_images, reference_images = images[:len(probes)], images[len(probes):]
+            if len(reference_images) == 1:
+                reference_images = reference_images * len(probe_images)
+            pairs = [(str(index), probe, reference) for index, (probe, reference) in enumerate(zip(probe_images, reference_images))]
+
+        if not pairs:
+            raise HTTPException(status_code=400, detail="No signature pairs uploaded")
+        if len(pairs) > SIGNATURE_BATCH_MAX_PAIRS:
+            raise HTTPException(status_code=400, detail=f"At most {SIGNATURE_BATCH_MAX_PAIRS} pairs per batch")
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error reading signature batch: {str(e)}")
+
+    async def lines():
+        async for item in verifier.verify_pairs(pairs):
+            yield json.dumps(item) + "\n"
+
+    return StreamingResponse(lines(), media_type="application/x-ndjson")
+
+@router.get("/prefilter")
+async def signature_prefilter_stats(verifier: SignatureVerifier = Depends(get_signature_verifier)):
+    """
+    Local prefilter bands and how many comparisons were decided without Gemini.
+
+    Pairs with a local shape similarity at or below `mismatch_threshold` are
+    rejected locally, and at or above `match_threshold` matched locally (a
+    threshold above 1, the default, disables local matches); the rest goes to
+    the LLM. Counts are per worker process.
+    """
+    return verifier.prefilter.snapshot()
+
+
+@router.post("/templates/{customer_id}")
+async def enroll_signature_templates(
+    customer_id: str,
+    files: List[UploadFile] = File(..., description="Specimen signature images of the customer"),
+    label: Optional[str] = Form(None, description="Optional label, e.g. the source of the specimens"),
+    store: SignatureStore = Depends(get_signature_store)
+):
+    """
+    Enroll specimen signatures for a customer.
+
+    Each specimen is normalized and its features are stored once, so later
+    verifications only upload the probe signature.
+
+    Returns:
+        Dictionary with the new template ids
+    """
+    try:
+        images = await _read_signatures(files)
+        template_ids = await store.enroll(customer_id, images, label)
+        return {"customer_id": customer_id, "template_ids": template_ids}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error enrolling signatures: {str(e)}")
+
+
+@router.get("/templates/{customer_id}")
+async def list_signature_templates(customer_id: str, store: SignatureStore = Depends(get_signature_store)):
+    """List a customer's enrolled signature templates."""
+    return {"customer_id": customer_id, "templates": await store.templates(customer_id)}
+
+
+@router.delete("/templates/{customer_id}")
+async def delete_signature_templates(
+    customer_id: str,
+    template_id: Optional[str] = None,
+    store: SignatureStore = Depends(get_signature_store)
+):
+    """Delete one template (`template_id`) or all of a customer's templates."""
+    deleted = await store.delete(customer_id, template_id)
+    if not deleted:
+        raise HTTPException(status_code=404, detail="No matching signature templates")
+    return {"customer_id": customer_id, "deleted": deleted}
+
+
+@router.post("/templates/{customer_id}/verify")
+async def verify_against_templates(
+    customer_id: str,
+    signature: UploadFile = File(..., description="Signature to verify"),
+    store: SignatureStore = Depends(get_signature_store),
+    verifier: SignatureVerifier = Depends(get_signature_verifier)
+):
+    """
+    Verify a signature against the customer's enrolled templates (1:1).
+
+    The probe is scored locally against every template; clear results are
+    decided without Gemini, otherwise one Gemini call compares it with the
+    best-scoring template.
+
+    Returns:
+        Dictionary with result, accuracy score, best template and per-template scores
+    """
+    try:
+        probe_bytes, = await _read_signatures([signature])
+        return await store.verify(customer_id, probe_bytes, verifier)
+    except KeyError:
+        raise HTTPException(status_code=404, detail=f"No signature templates enrolled for {customer_id}")
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except APIQuotaExceededException as e:
+        raise HTTPException(status_code=429, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing signature verification: {str(e)}")
+
+
+@router.post("/search")
+async def search_signature_templates(
+    signature: UploadFile = File(..., description="Signature to look up"),
+    top_k: int = Form(5, ge=1, le=100),
+    store: SignatureStore = Depends(get_signature_store)
+):
+    """
+    Find the customers whose enrolled signatures most resemble this one (1:N).
+
+    Purely local: HOG vectors of all templates are compared in memory, the
+    closest candidates are re-scored with the full shape similarity.
+
+    Returns:
+        Dictionary with the best matching template per customer, most similar first
+    """
+    try:
+        probe_bytes, = await _read_signatures([signature])
+        return {"matches": await store.search(probe_bytes, top_k)}
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error searching signatures: {str(e)}")
@@ -1,6 +1,6 @@
 
 from pydantic import BaseModel, EmailStr
-from typing import List, Optional
+from typing import Dict, List, Optional
 
 class OTPRequest(BaseModel):
     email: EmailStr
@@ -14,7 +14,7 @@ class ChatResponse(BaseModel):
     context: List[str]
 
 class AadhaarExtractedData(BaseModel):
-    aadhaar_number: Optional[str] = None  # 12-digit Aadhaar number
+    aadhaar_number: Optional[str] = None  # 12-digit Aadhaar number, XXXX XXXX 1234 when printed masked
     full_name: Optional[str] = None
     date_of_birth: Optional[str] = None
     gender: Optional[str] = None  # Male/Female/Transgender
@@ -35,6 +35,78 @@ class PANExtractedData(BaseModel):
     photo_present: Optional[bool] = None  # Whether photo is present on card
     permanent_account_number: Optional[str] = None  # Same as pan_number but full text if different
 
+class AadhaarValidatedData(AadhaarExtractedData):
+    field_validation: Dict[str, str] = {}  # Checked field -> valid, masked, invalid or missing
+
+class PANValidatedData(PANExtractedData):
+    field_validation: Dict[str, str] = {}  # Checked field -> valid, invalid or missing
+
+class PageTypeReading(BaseModel):
+    doc_type: Optional[str] = None  # aadhaar, pan or other
+
+class FieldReading(BaseModel):
+    value: Optional[str] = None  # The single field read from a crop of the card, null if unreadable
+
+class FileExtractionResult(BaseModel):
+    file_index: int  # Position of the file in the upload
+    filename: Optional[str] = None
+    status: str  # ok, partial, failed
+    pages: List[int] = []  # Pages (0-based) the records were extracted from
+    failed_pages: List[int] = []
+    skipped_pages: List[int] = []  # Blank, duplicate or non-ID pages that were never sent to the LLM
+    errors: List[str] = []
+
+class AadhaarFileResult(FileExtractionResult):
+    records: List[AadhaarValidatedData] = []
+
+class PANFileResult(FileExtractionResult):
+    records: List[PANValidatedData] = []
+
+class PageRef(BaseModel):
+    file_index: int  # Position of the file in the upload
+    filename: Optional[str] = None
+    page: int  # 0-based page within the file (0 for images)
+
+class ClassifiedExtractionResult(BaseModel):
+    aadhaar: List[AadhaarValidatedData] = []
+    pan: List[PANValidatedData] = []
+    aadhaar_pages: List[PageRef] = []  # Pages classified as Aadhaar and sent to the Aadhaar extractor
+    pan_pages: List[PageRef] = []
+    unclassified_pages: List[PageRef] = []  # Pages with no Aadhaar/PAN cues, not extracted
+
 class OTPExtractedData(BaseModel):
     otp: Optional[str] = None  # The extracted OTP from the image
     confidence: Optional[float] = None  # Confidence level of the extraction (0-1)
+
+class SignatureAnalysis(BaseModel):
+    confidence_score: float  # 0.0 to 1.0
+    is_match: bool
+    analysis: str
+    reasoning: str
+
+class OCRJobSubmitResponse(BaseModel):
+    job_id: str
+    status: str
+    total: int
+    status_url: str
+    stream_url: str
+
+class OCRJobDocument(BaseModel):
+    index: int
+    filename: Optional[str] = None
+    status: str  # queued, running, done, failed
+    attempts: int
+    results: Optional[List[dict]] = None  # Extracted Aadhaar/PAN records once done
+    error: Optional[str] = None
+
+class OCRJobStatus(BaseModel):
+    job_id: str
+    doc_type: str
+    status: str  # queued, running, completed, partial, failed
+    total: int
+    completed: int
+    failed: int
+    progress: float  # 0-1
+    created_at: float
+    finished_at: Optional[float] = None
+    documents: List[OCRJobDocument]
@@ -0,0 +1,177 @@
+"""
+Local signature comparison used to screen pairs before Gemini.
+
+Both images are reduced to a binary ink mask cropped to the signature and
+fitted into a fixed canvas, then described by:
+
+- HOG: stroke directions on a coarse grid, i.e. the overall shape and layout
+- Hu moments of the ink: rotation/scale invariant global shape
+- aspect ratio and ink density of the cropped signature
+
+The similarity is a weighted mix of the three, in [0, 1]. Pairs at or below
+SIGNATURE_LOCAL_MISMATCH are rejected here; everything else is sent to the
+LLM. A skilled forgery or a traced copy can score as high as a genuine
+signature on these features, so local matches (SIGNATURE_LOCAL_MATCH) are
+off by default and should only be enabled after checking the band on real
+specimens. Identical images are never matched locally: two genuine
+signatures are never pixel-identical, so such a pair points to a copied or
+replayed image.
+
+`normalize_signature` also produces what the LLM is shown: the same ink
+mask at a canonical height, as a 1-bit PNG. Phone photos and large scans
+shrink to a few KB and Gemini sees only the strokes.
+"""
+
+import os
+import threading
+from typing import NamedTuple, Optional
+
+import cv2
+import numpy as np
+
+from .media_types import detect_media_type
+
+SIGNATURE_PREFILTER_ENABLED = os.getenv("SIGNATURE_PREFILTER_ENABLED", "true").lower() == "true"
+# Similarity at or above: match without Gemini (above 1: never); at or below: mismatch without Gemini
+SIGNATURE_LOCAL_MATCH = float(os.getenv("SIGNATURE_LOCAL_MATCH", "1.01"))
+SIGNATURE_LOCAL_MISMATCH = float(os.getenv("SIGNATURE_LOCAL_MISMATCH", "0.45"))
+# Normalization of signatures before they are compared or sent to Gemini
+SIGNATURE_NORMALIZE = os.getenv("SIGNATURE_NORMALIZE", "true").lower() == "true"
+SIGNATURE_CANONICAL_HEIGHT = int(os.getenv("SIGNATURE_CANONICAL_HEIGHT", "200"))
+SIGNATURE_MARGIN = 8
+
+CANVAS_WIDTH, CANVAS_HEIGHT = 256, 128
+HOG_WEIGHT, HU_WEIGHT, SHAPE_WEIGHT = 0.6, 0.25, 0.15
+
+_hog = cv2.HOGDescriptor((CANVAS_WIDTH, CANVAS_HEIGHT), (32, 32), (16, 16), (16, 16), 9)
+
+
+class SignatureFeatures(NamedTuple):
+    hog: np.ndarray  # L2-normalised
+    hu: np.ndarray  # log-scaled Hu moments
+    aspect: float  # width / height of the ink bounding box
+    density: float  # ink pixels / bounding box area
+
+
+def ink_mask(gray: np.ndarray) -> Optional[np.ndarray]:
+    """Binary mask (ink = 255) cropped to the ink bounding box, None when there is no ink."""
+    _, mask = cv2.threshold(cv2.GaussianBlur(gray, (3, 3), 0), 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    # Specks from scanner noise would stretch the bounding box
+    mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, np.ones((2, 2), np.uint8))
+    points = cv2.findNonZero(mask)
+    if points is None:
+        return None
+    x, y, w, h = cv2.boundingRect(points)
+    return mask[y:y + h, x:x + w]
+
+
+def fit_canvas(mask: np.ndarray) -> np.ndarray:
+    """Scale the cropped mask into the fixed canvas, keeping its aspect ratio, centred."""
+    h, w = mask.shape
+    scale = min(CANVAS_WIDTH / float(w), CANVAS_HEIGHT / float(h))
+    resized = cv2.resize(mask, (max(1, int(w * scale)), max(1, int(h * scale))), interpolation=cv2.INTER_AREA)
+    canvas = np.zeros((CANVAS_HEIGHT, CANVAS_WIDTH), np.uint8)
+    top = (CANVAS_HEIGHT - resized.shape[0]) // 2
+    left = (CANVAS_WIDTH - resized.shape[1]) // 2
+    canvas[top:top + resized.shape[0], left:left + resized.shape[1]] = resized
+    return canvas
+
+
+def features_from_mask(mask: np.ndarray) -> SignatureFeatures:
+    canvas = fit_canvas(mask)
+    # Thicken strokes so pen width and scan resolution matter less than the shape
+    hog = _hog.compute(cv2.dilate(canvas, np.ones((3, 3), np.uint8))).ravel()
+    hog /= np.linalg.norm(hog) or 1.0
+    hu = cv2.HuMoments(cv2.moments(canvas, binaryImage=True)).ravel()
+    hu = -np.sign(hu) * np.log10(np.abs(hu) + 1e-30)
+    h, w = mask.shape
+    return SignatureFeatures(hog.astype(np.float32), hu.astype(np.float32), w / float(h), float((mask > 0).mean()))
+
+
+def extract_features(image_bytes: bytes) -> Optional[SignatureFeatures]:
+    """Features of an encoded signature image, None if it can't be decoded or has no ink."""
+    gray = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        return None
+    mask = ink_mask(gray)
+    return None if mask is None else features_from_mask(mask)
+
+
+class NormalizedSignature(NamedTuple):
+    data: bytes
+    media_type: str
+    features: Optional[SignatureFeatures]  # None when the image has no readable ink
+    original_bytes: int
+
+
+def render_mask(mask: np.ndarray, height: int = SIGNATURE_CANONICAL_HEIGHT) -> bytes:
+    """Cropped ink mask as black strokes on white at `height` pixels plus a margin, encoded as a 1-bit PNG."""
+    h, w = mask.shape
+    inner = height - 2 * SIGNATURE_MARGIN
+    width = max(1, int(round(w * inner / float(h))))
+    interpolation = cv2.INTER_AREA if inner < h else cv2.INTER_LINEAR
+    resized = cv2.resize(mask, (width, inner), interpolation=interpolation)
+    page = np.full((height, width + 2 * SIGNATURE_MARGIN), 255, np.uint8)
+    page[SIGNATURE_MARGIN:SIGNATURE_MARGIN + inner, SIGNATURE_MARGIN:SIGNATURE_MARGIN + width] = np.where(resized >= 128, 0, 255)
+    ok, encoded = cv2.imencode(".png", page, [cv2.IMWRITE_PNG_BILEVEL, 1, cv2.IMWRITE_PNG_COMPRESSION, 9])
+    if not ok:
+        raise ValueError("Could not encode signature as PNG")
+    return encoded.tobytes()
+
+
+def normalize_signature(image_bytes: bytes) -> NormalizedSignature:
+    """
+    Decode, binarize (Otsu), crop to the ink and re-encode a signature at the canonical height.
+
+    The features are computed from the same mask, so a normalized pair can be
+    compared without decoding again. Images OpenCV can't decode, or without
+    ink, are returned as they are with their real media type.
+    """
+    gray = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+    mask = ink_mask(gray) if gray is not None else None
+    if mask is None:
+        return NormalizedSignature(image_bytes, detect_media_type(image_bytes), None, len(image_bytes))
+    return NormalizedSignature(render_mask(mask), "image/png", features_from_mask(mask), len(image_bytes))
+
+
+def similarity(a: SignatureFeatures, b: SignatureFeatures) -> float:
+    """Shape similarity of two signatures in [0, 1]."""
+    hog = float(np.dot(a.hog, b.hog))
+    # The first Hu moments are the stable ones; beyond ~1.5 decades apart the shapes are unrelated
+    hu = max(0.0, 1.0 - float(np.abs(a.hu[:4] - b.hu[:4]).mean()) / 1.5)
+    shape = min(a.aspect, b.aspect) / max(a.aspect, b.aspect) * min(a.density, b.density) / max(a.density, b.density)
+    return HOG_WEIGHT * hog + HU_WEIGHT * hu + SHAPE_WEIGHT * shape
+
+
+def is_local_decision(score: Optional[float], identical: bool = False) -> bool:
+    """Whether a pair with this local similarity is decided without the LLM; identical images never are."""
+    return SIGNATURE_PREFILTER_ENABLED and score is not None and not identical and (
+        score >= SIGNATURE_LOCAL_MATCH or score <= SIGNATURE_LOCAL_MISMATCH
+    )
+
+
+class PrefilterStats:
+    """How many comparisons were decided locally; reported on /signature/prefilter."""
+
+    def __init__(self):
+        self.local_match = 0
+        self.local_mismatch = 0
+        self.llm = 0
+        self._lock = threading.Lock()
+
+    def record(self, decision: str) -> None:
+        with self._lock:
+            setattr(self, decision, getattr(self, decision) + 1)
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            total = self.local_match + self.local_mismatch + self.llm
+            return {
+                "enabled": SIGNATURE_PREFILTER_ENABLED,
+                "match_threshold": SIGNATURE_LOCAL_MATCH,
+                "mismatch_threshold": SIGNATURE_LOCAL_MISMATCH,
+                "local_match": self.local_match,
+                "local_mismatch": self.local_mismatch,
+                "llm": self.llm,
+                "llm_calls_avoided_fraction": round((total - self.llm) / total, 4) if total else 0.0,
+            }
@@ -0,0 +1,296 @@
+"""
+Enrolled reference signatures for 1:1 verification and 1:N search.
+
+A customer's specimen signatures are enrolled once: each is normalized and
+stored as a small PNG (what Gemini is shown)
+together with its precomputed features (see `signature_features`) in a local
+SQLite database. Verifying a cheque or form then only decodes the probe.
+
+- verify: the probe is scored locally against every template of the
+  customer. Clear results are decided locally; otherwise one Gemini call is
+  made against the best-scoring template, not one per template.
+- search: the probe's HOG vector is compared with every enrolled template,
+  kept in memory as one matrix, to find the customers whose specimens it
+  resembles (fraud checks).
+"""
+
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from fastapi.concurrency import run_in_threadpool
+
+from .signature_features import (
+    SignatureFeatures, is_local_decision, normalize_signature, similarity,
+)
+from .signature_verifier import SignatureVerifier
+
+SIGNATURE_TEMPLATES_DB = os.getenv("SIGNATURE_TEMPLATES_DB", "signature_templates.sqlite3")
+# HOG candidates re-scored with the full similarity in a 1:N search
+SIGNATURE_SEARCH_CANDIDATES = int(os.getenv("SIGNATURE_SEARCH_CANDIDATES", "50"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS signature_templates (
+    id TEXT PRIMARY KEY,
+    customer_id TEXT NOT NULL,
+    label TEXT,
+    image BLOB NOT NULL,
+    hog BLOB NOT NULL,
+    hu BLOB NOT NULL,
+    aspect REAL NOT NULL,
+    density REAL NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS signature_templates_customer ON signature_templates (customer_id);
+-- Bumped by every write, so each worker process notices templates changed by another one
+CREATE TABLE IF NOT EXISTS signature_templates_version (
+    id INTEGER PRIMARY KEY CHECK (id = 1),
+    version INTEGER NOT NULL
+);
+INSERT OR IGNORE INTO signature_templates_version VALUES (1, 0);
+"""
+
+
+def _features(row: sqlite3.Row) -> SignatureFeatures:
+    return SignatureFeatures(
+        np.frombuffer(row["hog"], np.float32), np.frombuffer(row["hu"], np.float32), row["aspect"], row["density"]
+    )
+
+
+def prepare_template(image_bytes: bytes) -> Tuple[bytes, SignatureFeatures]:
+    """
+    Normalized PNG (see `normalize_signature`) and features of one specimen.
+
+    Raises:
+        ValueError: The image can't be decoded or contains no ink
+    """
+    normalized = normalize_signature(image_bytes)
+    if normalized.features is None:
+        raise ValueError("No signature found in the image")
+    return normalized.data, normalized.features
+
+
+class SignatureStore:
+    """
+    SQLite template store with an in-memory HOG matrix for 1:N search.
+
+    Every worker process keeps its own matrix; a version row bumped on each
+    write tells a worker to reload it before searching.
+    """
+
+    def __init__(self, path: str = SIGNATURE_TEMPLATES_DB):
+        self.path = path
+        self._lock = threading.Lock()
+        self._ids: List[str] = []
+        self._customers: List[str] = []
+        self._matrix = np.zeros((0, 0), np.float32)
+        self._version = -1
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def _init_db(self) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.executescript(SCHEMA)
+        finally:
+            conn.close()
+        self._load()
+
+    def _load(self) -> None:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN")
+            version = conn.execute("SELECT version FROM signature_templates_version").fetchone()[0]
+            rows = conn.execute("SELECT id, customer_id, hog FROM signature_templates ORDER BY created_at").fetchall()
+            conn.execute("COMMIT")
+        finally:
+            conn.close()
+        with self._lock:
+            self._version = version
+            self._ids = [row["id"] for row in rows]
+            self._customers = [row["customer_id"] for row in rows]
+            self._matrix = np.stack([np.frombuffer(row["hog"], np.float32) for row in rows]) if rows else np.zeros((0, 0), np.float32)
+
+    async def start(self) -> None:
+        await run_in_threadpool(self._init_db)
+
+    # Enrollment
+
+    def _enroll(self, customer_id: str, images: List[bytes], label: Optional[str]) -> List[str]:
+        prepared = [prepare_template(image) for image in images]
+        now = time.time()
+        rows = [
+            (uuid.uuid4().hex, customer_id, label, png, features.hog.tobytes(), features.hu.tobytes(), features.aspect, features.density, now)
+            for png, features in prepared
+        ]
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.executemany("INSERT INTO signature_templates VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+            conn.execute("UPDATE signature_templates_version SET version = version + 1")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        self._load()
+        return [row[0] for row in rows]
+
+    async def enroll(self, customer_id: str, images: List[bytes], label: Optional[str] = None) -> List[str]:
+        """
+        Store specimen signatures for a customer.
+
+        Returns:
+            List[str]: The new template ids, in upload order
+
+        Raises:
+            ValueError: One of the images has no usable signature; nothing is stored then
+        """
+        return await run_in_threadpool(self._enroll, customer_id, images, label)
+
+    def _templates(self, customer_id: str, with_data: bool = False) -> List[sqlite3.Row]:
+        columns = "*" if with_data else "id, label, created_at"
+        conn = self._connect()
+        try:
+            return conn.execute(
+                f"SELECT {columns} FROM signature_templates WHERE customer_id = ? ORDER BY created_at", (customer_id,)
+            ).fetchall()
+        finally:
+            conn.close()
+
+    async def templates(self, customer_id: str) -> List[Dict]:
+        rows = await run_in_threadpool(self._templates, customer_id)
+        return [{"template_id": row["id"], "label": row["label"], "created_at": row["created_at"]} for row in rows]
+
+    def _delete(self, customer_id: str, template_id: Optional[str]) -> int:
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            if template_id is None:
+                deleted = conn.execute("DELETE FROM signature_templates WHERE customer_id = ?", (customer_id,)).rowcount
+            else:
+                deleted = conn.execute(
+                    "DELETE FROM signature_templates WHERE customer_id = ? AND id = ?", (customer_id, template_id)
+                ).rowcount
+            conn.execute("UPDATE signature_templates_version SET version = version + 1")
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        finally:
+            conn.close()
+        if deleted:
+            self._load()
+        return deleted
+
+    async def delete(self, customer_id: str, template_id: Optional[str] = None) -> int:
+        """Delete one template, or all of a customer's; returns how many were removed."""
+        return await run_in_threadpool(self._delete, customer_id, template_id)
+
+    # Matching
+
+    def _score_templates(self, customer_id: str, probe: SignatureFeatures) -> List[Dict]:
+        return sorted(
+            (
+                {"template_id": row["id"], "label": row["label"], "score": similarity(probe, _features(row)), "image": row["image"]}
+                for row in self._templates(customer_id, with_data=True)
+            ),
+            key=lambda item: item["score"],
+            reverse=True,
+        )
+
+    async def verify(self, customer_id: str, probe_bytes: bytes, verifier: SignatureVerifier) -> Dict:
+        """
+        Verify a probe signature against a customer's enrolled templates.
+
+        Every template is scored locally from its stored features. Only the
+        best-scoring template is passed on to `verify_signatures`, which decides
+        locally inside the prefilter bands and otherwise makes one Gemini call
+        on the two normalized images.
+
+        Raises:
+            ValueError: The probe has no usable signature
+            KeyError: The customer has no enrolled templates
+        """
+        probe_png, probe = await run_in_threadpool(prepare_template, probe_bytes)
+        scored = await run_in_threadpool(self._score_templates, customer_id, probe)
+        if not scored:
+            raise KeyError(customer_id)
+
+        best = scored[0]
+        confidence, is_match, analysis = await verifier.verify_signatures(
+            best["image"], probe_png, score=best["score"], normalized=True
+        )
+        # A probe identical to an enrolled specimen is a copy of it, not a new signature
+        identical = best["image"] == probe_png
+        return {
+            "customer_id": customer_id,
+            "result": "matched" if is_match else "unmatched",
+            "accuracy_score": round(confidence, 4),
+            "best_template_id": best["template_id"],
+            "decided_locally": is_local_decision(best["score"], identical),
+            "identical_images": identical,
+            "analysis": analysis,
+            "template_scores": [
+                {"template_id": item["template_id"], "label": item["label"], "score": round(item["score"], 4)}
+                for item in scored
+            ],
+        }
+
+    def _refresh(self) -> None:
+        """Reload the HOG matrix if another worker process changed the templates."""
+        conn = self._connect()
+        try:
+            version = conn.execute("SELECT version FROM signature_templates_version").fetchone()[0]
+        finally:
+            conn.close()
+        if version != self._version:
+            self._load()
+
+    def _search(self, probe: SignatureFeatures, top_k: int) -> List[Dict]:
+        self._refresh()
+        with self._lock:
+            ids, customers, matrix = list(self._ids), list(self._customers), self._matrix
+        if not ids:
+            return []
+        candidates = np.argsort(-(matrix @ probe.hog))[:SIGNATURE_SEARCH_CANDIDATES]
+        placeholders = ",".join("?" for _ in candidates)
+        conn = self._connect()
+        try:
+            rows = {
+                row["id"]: row for row in conn.execute(
+                    f"SELECT id, hog, hu, aspect, density FROM signature_templates WHERE id IN ({placeholders})",
+                    [ids[i] for i in candidates],
+                )
+            }
+        finally:
+            conn.close()
+
+        best: Dict[str, Dict] = {}
+        for i in candidates:
+            row = rows.get(ids[i])
+            if row is None:
+                continue
+            score = similarity(probe, _features(row))
+            if customers[i] not in best or score > best[customers[i]]["score"]:
+                best[customers[i]] = {"customer_id": customers[i], "template_id": ids[i], "score": round(score, 4)}
+        return sorted(best.values(), key=lambda item: item["score"], reverse=True)[:top_k]
+
+    async def search(self, probe_bytes: bytes, top_k: int = 5) -> List[Dict]:
+        """
+        Customers whose enrolled signatures are most similar to the probe, best template per customer.
+
+        Raises:
+            ValueError: The probe has no usable signature
+        """
+        _, probe = await run_in_threadpool(prepare_template, probe_bytes)
+        return await run_in_threadpool(self._search, probe, top_k)
@@ -1,80 +1,148 @@
-from typing import Tuple
-from pydantic_ai import Agent, BinaryContent
+from contextlib import nullcontext
+from typing import AsyncIterator, Dict, List, Optional, Tuple
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+from pydantic_ai import BinaryContent
 from pydantic_ai.models.gemini import GeminiModel
 from pydantic_ai.providers.google_gla import GoogleGLAProvider
-from pydantic import BaseModel
+import asyncio
+import hashlib
 import os
 
+from .agents import SIGNATURE_AGENT, APIQuotaExceededException, run_agent
+from .metrics import SIGNATURE_DECISIONS, SIGNATURE_IDENTICAL_PAIRS
+from .request_stats import record_stat
+from .signature_features import (
+    SIGNATURE_LOCAL_MATCH, SIGNATURE_LOCAL_MISMATCH, SIGNATURE_NORMALIZE, SIGNATURE_PREFILTER_ENABLED,
+    NormalizedSignature, PrefilterStats, extract_features, is_local_decision, normalize_signature, similarity,
+)
+from .media_types import detect_media_type
 
-class APIQuotaExceededException(Exception):
-    """Exception raised when API quota is exceeded."""
-    pass
+# Batch verification: pairs per request and Gemini calls in flight per worker, across all batches
+SIGNATURE_BATCH_MAX_PAIRS = int(os.getenv("SIGNATURE_BATCH_MAX_PAIRS", "1000"))
+SIGNATURE_BATCH_LLM_CONCURRENCY = int(os.getenv("SIGNATURE_BATCH_LLM_CONCURRENCY", "8"))
 
 
 class SignatureVerifier:
     """AI-based signature verification using Gemini"""
     
-    def __init__(self):
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY environment variable is required")
-        
-        self.model = GeminiModel(
-            "gemini-2.0-flash-lite",
-            provider=GoogleGLAProvider(api_key=api_key),
-        )
+    def __init__(self, model: Optional[GeminiModel] = None):
+        """
+        Args:
+            model: Shared Gemini model from the client registry. When omitted a
+                standalone model is built from GEMINI_API_KEY.
+        """
+        if model is None:
+            api_key = os.getenv("GEMINI_API_KEY")
+            if not api_key:
+                raise ValueError("GEMINI_API_KEY environment variable is required")
+            
+            model = GeminiModel(
+                "gemini-2.0-flash-lite",
+                provider=GoogleGLAProvider(api_key=api_key),
+            )
+        self.model = model
+        self.prefilter = PrefilterStats()
+        # Shared by every batch in this worker: the Gemini quota is per API key, not per request
+        self.batch_llm_slots = asyncio.Semaphore(SIGNATURE_BATCH_LLM_CONCURRENCY)
+
+    @staticmethod
+    def local_similarity(image1_bytes: bytes, image2_bytes: bytes) -> Optional[float]:
+        """Local shape similarity (0-1), or None when either image has no readable ink."""
+        if image1_bytes == image2_bytes:
+            return 1.0
+        features1, features2 = extract_features(image1_bytes), extract_features(image2_bytes)
+        if features1 is None or features2 is None:
+            return None
+        return similarity(features1, features2)
+
+    @staticmethod
+    def normalize_pair(image1_bytes: bytes, image2_bytes: bytes) -> Tuple[NormalizedSignature, NormalizedSignature, Optional[float]]:
+        """Normalize both signatures and score them locally from the same decode."""
+        first = normalize_signature(image1_bytes)
+        second = first if image2_bytes == image1_bytes else normalize_signature(image2_bytes)
+        if first is second:
+            score = 1.0
+        elif first.features is None or second.features is None:
+            score = None
+        else:
+            score = similarity(first.features, second.features)
+        return first, second, score
+
+    def _decide(self, decision: str, record_stats: bool) -> None:
+        self.prefilter.record(decision)
+        SIGNATURE_DECISIONS.inc(decision=decision)
+        if decision != "llm" and record_stats:
+            record_stat("X-LLM-Calls-Avoided", 1)
     
-    async def verify_signatures(self, image1_bytes: bytes, image2_bytes: bytes) -> Tuple[float, bool, str]:
+    async def verify_signatures(
+        self,
+        image1_bytes: bytes,
+        image2_bytes: bytes,
+        score: Optional[float] = None,
+        normalized: bool = False,
+        llm_slots: Optional[asyncio.Semaphore] = None,
+        record_stats: bool = True,
+    ) -> Tuple[float, bool, str]:
         """
-        Verify two signatures using Gemini AI
+        Verify two signatures, locally when the pair is clearly different (or, when enabled, clearly the same), otherwise with Gemini AI
+
+        Both images are normalized first (binarized, cropped to the ink, canonical height, PNG),
+        so Gemini receives a small image with the correct media type. Identical images always
+        go to Gemini and the analysis warns about them: genuine signatures are never pixel-identical.
         
         Args:
             image1_bytes: First signature image as bytes
             image2_bytes: Second signature image as bytes
+            score: Local similarity of the pair when the caller already has it (e.g. from stored template features)
+            normalized: Both images are already normalized, skip that step
+            llm_slots: Held while the Gemini call runs, to bound concurrent calls (batches)
+            record_stats: Add to the X-* response headers; off for streamed responses, whose headers are already sent
             
         Returns:
             Tuple[float, bool, str]: (confidence_score, is_match, analysis)
         """
-        try:
-            class SignatureAnalysis(BaseModel):
-                confidence_score: float  # 0.0 to 1.0
-                is_match: bool
-                analysis: str
-                reasoning: str
-            
-            agent = Agent(
-                model=self.model,
-                output_type=SignatureAnalysis,
-                system_prompt=(
-                    'You are an expert forensic handwriting analyst specializing in signature verification. '
-                    'Analyze the two signature images provided and determine if they were written by the same person. '
-                    'Consider stroke patterns, pressure points, letter formations, spacing, slant, and overall flow. '
-                    'Provide a confidence score from 0.0 (completely different) to 1.0 (identical). '
-                    'A score above 0.6 typically indicates a match. '
-                    'Be thorough in your analysis and explain your reasoning.'
-                )
-            )
-            
-            binary_images = [
-                BinaryContent(data=image1_bytes, media_type='image/png'),
-                BinaryContent(data=image2_bytes, media_type='image/png')
-            ]
-            
-            result = await agent.run([
+        if SIGNATURE_NORMALIZE and not normalized:
+            first, second, local_score = await run_in_threadpool(self.normalize_pair, image1_bytes, image2_bytes)
+            score = local_score if score is None else score
+        else:
+            first, second = (NormalizedSignature(data, detect_media_type(data), None, len(data)) for data in (image1_bytes, image2_bytes))
+            if SIGNATURE_PREFILTER_ENABLED and score is None:
+                score = await run_in_threadpool(self.local_similarity, image1_bytes, image2_bytes)
+
+        identical = first.data == second.data
+        if SIGNATURE_PREFILTER_ENABLED and not identical:
+            if score is not None and score >= SIGNATURE_LOCAL_MATCH:
+                self._decide("local_match", record_stats)
+                return score, True, f"Decided locally: shape similarity {score:.3f} is at or above the match threshold {SIGNATURE_LOCAL_MATCH}."
+            if score is not None and score <= SIGNATURE_LOCAL_MISMATCH:
+                self._decide("local_mismatch", record_stats)
+                return score, False, f"Decided locally: shape similarity {score:.3f} is at or below the mismatch threshold {SIGNATURE_LOCAL_MISMATCH}."
+        self._decide("llm", record_stats)
+
+        if record_stats:
+            record_stat("X-Upload-Bytes-Original", first.original_bytes + second.original_bytes)
+            record_stat("X-Upload-Bytes-Sent", len(first.data) + len(second.data))
+        binary_images = [
+            BinaryContent(data=first.data, media_type=first.media_type),
+            BinaryContent(data=second.data, media_type=second.media_type)
+        ]
+        
+        async with llm_slots or nullcontext():
+            output = await run_agent(SIGNATURE_AGENT, self.model, "verify_signatures", [
                 'Compare these two signature images. Analyze the handwriting characteristics, stroke patterns, '
                 'letter formations, spacing, slant, and overall signature flow. Determine if they are from the same person. '
                 'Provide a confidence score (0.0-1.0) and detailed reasoning for your decision.',
                 *binary_images
             ])
-            
-            output = result.output
-            return output.confidence_score, output.is_match, f"{output.analysis} Reasoning: {output.reasoning}"
-            
-        except Exception as e:
-            if "429" in str(e) or "RATE_LIMIT_EXCEEDED" in str(e):
-                raise APIQuotaExceededException("API quota exceeded. Please wait a few minutes or upgrade your plan.")
-            else:
-                raise e
+        analysis = f"{output.analysis} Reasoning: {output.reasoning}"
+        if identical:
+            SIGNATURE_IDENTICAL_PAIRS.inc()
+            analysis = (
+                "Warning: the two signature images are identical. Genuine signatures are never pixel-identical; "
+                f"check for a copied or replayed image. {analysis}"
+            )
+        return output.confidence_score, output.is_match, analysis
     
     async def verify_signatures_simple(self, image1_bytes: bytes, image2_bytes: bytes) -> float:
         """
@@ -93,3 +161,89 @@ class SignatureVerifier:
         except Exception as e:
             print(f"Error in Gemini signature verification: {str(e)}")
             return 0.0
+
+    async def verify_pairs(self, pairs: List[Tuple[str, bytes, bytes]]) -> AsyncIterator[Dict]:
+        """
+        Verify many (probe, reference) pairs concurrently, yielding each result as it completes, then a summary.
+
+        Every distinct image is normalized once, however many pairs share it
+        (typically the reference specimen). Locally decided pairs never wait
+        for Gemini; Gemini calls are bounded by `batch_llm_slots`. A failing
+        pair yields an error entry instead of failing the batch. Results are
+        meant to be streamed, so nothing is added to the response headers; the
+        counts go into the summary instead.
+
+        Args:
+            pairs: (pair_id, probe_bytes, reference_bytes)
+
+        Yields:
+            Dict: {"type": "pair", "pair_id", "result", "accuracy_score", "decided_locally", "identical_images"},
+            or {"type": "pair", "pair_id", "status_code", "error"}; finally {"type": "batch", "total", "matched",
+            "unmatched", "errors", "decided_locally", "images_deduplicated"}
+        """
+        images = {}
+        keys = []
+        for _, probe, reference in pairs:
+            probe_key, reference_key = hashlib.sha256(probe).hexdigest(), hashlib.sha256(reference).hexdigest()
+            images.setdefault(probe_key, probe)
+            images.setdefault(reference_key, reference)
+            keys.append((probe_key, reference_key))
+
+        def prepare(data: bytes) -> NormalizedSignature:
+            if SIGNATURE_NORMALIZE:
+                return normalize_signature(data)
+            return NormalizedSignature(data, detect_media_type(data), None, len(data))
+
+        prepared = dict(zip(images, await asyncio.gather(*(run_in_threadpool(prepare, data) for data in images.values()))))
+
+        async def verify_pair(pair_id: str, probe_key: str, reference_key: str) -> Dict:
+            probe, reference = prepared[probe_key], prepared[reference_key]
+            if probe_key == reference_key:
+                score = 1.0
+            elif probe.features is not None and reference.features is not None:
+                score = similarity(probe.features, reference.features)
+            else:
+                score = None
+            try:
+                confidence, is_match, _ = await self.verify_signatures(
+                    reference.data, probe.data, score=score, normalized=True, llm_slots=self.batch_llm_slots,
+                    record_stats=False,
+                )
+            except APIQuotaExceededException as e:
+                return {"pair_id": pair_id, "status_code": 429, "error": str(e)}
+            except HTTPException as e:
+                return {"pair_id": pair_id, "status_code": e.status_code, "error": e.detail}
+            except Exception as e:
+                return {"pair_id": pair_id, "status_code": 500, "error": f"Error processing signature verification: {str(e)}"}
+            identical = probe.data == reference.data
+            return {
+                "pair_id": pair_id,
+                "result": "matched" if is_match else "unmatched",
+                "accuracy_score": round(confidence, 4),
+                "decided_locally": is_local_decision(score, identical),
+                "identical_images": identical,
+            }
+
+        summary = {
+            "type": "batch",
+            "total": len(pairs),
+            "matched": 0,
+            "unmatched": 0,
+            "errors": 0,
+            "decided_locally": 0,
+            "images_deduplicated": 2 * len(pairs) - len(images),
+        }
+        tasks = [asyncio.ensure_future(verify_pair(pair_id, *key)) for (pair_id, _, _), key in zip(pairs, keys)]
+        try:
+            for next_result in asyncio.as_completed(tasks):
+                item = await next_result
+                if "error" in item:
+                    summary["errors"] += 1
+                else:
+                    summary[item["result"]] += 1
+                    summary["decided_locally"] += item["decided_locally"]
+                yield {"type": "pair", **item}
+            yield summary
+        finally:
+            for task in tasks:
+                task.cancel()
@@ -0,0 +1,78 @@
+import asyncio
+import hashlib
+from typing import Awaitable, Callable, Dict, TypeVar, Union
+
+T = TypeVar("T")
+
+
+def normalize_query(query: str) -> str:
+    """Normalize free text so that trivially different queries share a fingerprint."""
+    return " ".join(query.split()).casefold()
+
+
+def fingerprint(*parts: Union[str, bytes]) -> str:
+    """Build a stable fingerprint from request parts (endpoint, query text, upload bytes, ...)."""
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode("utf-8")
+        # Length-prefix every part so ("ab", "c") and ("a", "bc") never collide
+        digest.update(len(part).to_bytes(8, "big"))
+        digest.update(part)
+    return digest.hexdigest()
+
+
+class _Call:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesce concurrent identical requests into one shared in-flight computation.
+
+    The first caller for a key starts the computation; callers arriving while it is
+    still running wait on the same result (or exception) instead of repeating it.
+    Nothing is cached once the computation finishes.
+    """
+
+    def __init__(self):
+        self._calls: Dict[str, _Call] = {}
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+    async def do(self, key: str, fn: Callable[[], Awaitable[T]]) -> T:
+        """
+        Run `fn` for `key`, or join the computation already running for it.
+
+        Args:
+            key: Request fingerprint, see `fingerprint`
+            fn: Zero-argument callable returning the awaitable to share
+
+        Returns:
+            The result of the shared computation
+        """
+        call = self._calls.get(key)
+        if call is None:
+            task = asyncio.ensure_future(fn())
+            call = _Call(task)
+            self._calls[key] = call
+            task.add_done_callback(lambda _: self._forget(key, call))
+
+        call.waiters += 1
+        try:
+            # Shield so one disconnecting client doesn't cancel the work for everyone else
+            return await asyncio.shield(call.task)
+        except asyncio.CancelledError:
+            if call.waiters == 1 and not call.task.done():
+                # Last interested caller went away, nobody needs the result
+                call.task.cancel()
+            raise
+        finally:
+            call.waiters -= 1
+
+    def _forget(self, key: str, call: _Call) -> None:
+        if self._calls.get(key) is call:
+            del self._calls[key]
@@ -0,0 +1,215 @@
+"""
+Bounded-memory handling of uploaded files.
+
+`BodySizeLimitMiddleware` rejects a request body larger than
+MAX_REQUEST_BODY_BYTES with 413 while it is still being received: on its
+declared Content-Length before any of it is parsed, or once a chunked body
+crosses the limit. Starlette's multipart parser has already spooled the
+files of a smaller request by the time the handler runs; they are then
+copied out in fixed-size chunks while the per-file and per-request limits
+are checked. Small files stay in memory; anything larger is spooled to a
+named temporary file, which PDFs are later opened from through a memory map
+(see `rasterizer.open_pdf`) and which rasterizer processes open by path.
+"""
+
+import hashlib
+import os
+import tempfile
+import weakref
+from typing import Awaitable, Callable, List, Optional, TypeVar
+
+from fastapi import HTTPException, UploadFile
+
+from .rasterizer import PdfSource
+from .singleflight import SingleFlight
+
+T = TypeVar("T")
+
+MAX_UPLOAD_FILE_BYTES = int(os.getenv("MAX_UPLOAD_FILE_BYTES", str(25 * 1024 * 1024)))
+MAX_UPLOAD_REQUEST_BYTES = int(os.getenv("MAX_UPLOAD_REQUEST_BYTES", str(100 * 1024 * 1024)))
+# Files up to this size are kept in memory, larger ones go to UPLOAD_SPOOL_DIR
+UPLOAD_SPOOL_THRESHOLD_BYTES = int(os.getenv("UPLOAD_SPOOL_THRESHOLD_BYTES", str(2 * 1024 * 1024)))
+UPLOAD_SPOOL_DIR = os.getenv("UPLOAD_SPOOL_DIR") or None
+UPLOAD_CHUNK_BYTES = 1024 * 1024
+# Whole request body, including multipart framing and form fields next to the files
+MAX_REQUEST_BODY_BYTES = int(os.getenv("MAX_REQUEST_BODY_BYTES", str(MAX_UPLOAD_REQUEST_BYTES + 1024 * 1024)))
+
+
+class BodySizeLimitMiddleware:
+    """
+    ASGI middleware: fails reading a request body larger than `max_body_bytes`
+    with 413, before the body is parsed or written anywhere.
+    """
+
+    def __init__(self, app, max_body_bytes: int = MAX_REQUEST_BODY_BYTES):
+        self.app = app
+        self.max_body_bytes = max_body_bytes
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        declared = None
+        for name, value in scope.get("headers", []):
+            if name == b"content-length":
+                try:
+                    declared = int(value)
+                except ValueError:
+                    pass
+        received = 0
+
+        async def limited_receive():
+            # Raised from the first read, so it surfaces through the handler's normal 413 path
+            nonlocal received
+            if declared is not None and declared > self.max_body_bytes:
+                raise HTTPException(status_code=413, detail=f"Request body exceeds the limit of {self.max_body_bytes} bytes")
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > self.max_body_bytes:
+                    raise HTTPException(status_code=413, detail=f"Request body exceeds the limit of {self.max_body_bytes} bytes")
+            return message
+
+        await self.app(scope, limited_receive, send)
+
+
+def _remove_file(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class SpooledUpload:
+    """One uploaded file, either held in memory or spooled to disk."""
+
+    def __init__(self, filename: Optional[str], content_type: Optional[str]):
+        self.filename = filename
+        self.content_type = content_type
+        self.size = 0
+        self.sha256 = ""
+        self.path: Optional[str] = None
+        self._data: Optional[bytes] = None
+        self._finalizer = None
+
+    @property
+    def source(self) -> PdfSource:
+        """What to hand to the rasterizer: the bytes, or the spool file path."""
+        return self._data if self._data is not None else self.path
+
+    def read(self) -> bytes:
+        """Whole content as bytes (images have to be decoded in memory anyway)."""
+        if self._data is not None:
+            return self._data
+        with open(self.path, "rb") as f:
+            return f.read()
+
+    def close(self) -> None:
+        """Delete the spool file; safe to call more than once."""
+        self._data = None
+        if self._finalizer is not None:
+            self._finalizer()
+
+
+async def spool_upload(
+    file: UploadFile,
+    max_file_bytes: int = MAX_UPLOAD_FILE_BYTES,
+    remaining_request_bytes: Optional[int] = None,
+) -> SpooledUpload:
+    """
+    Copy one upload out of the request in chunks, enforcing the size limits.
+
+    Raises:
+        HTTPException: 413 if the file or the request as a whole is too large
+    """
+    limit = max_file_bytes if remaining_request_bytes is None else min(max_file_bytes, remaining_request_bytes)
+    upload = SpooledUpload(file.filename, file.content_type)
+    digest = hashlib.sha256()
+    buffer = bytearray()
+    spool = None
+    try:
+        while True:
+            chunk = await file.read(UPLOAD_CHUNK_BYTES)
+            if not chunk:
+                break
+            upload.size += len(chunk)
+            if upload.size > limit:
+                if upload.size > max_file_bytes:
+                    detail = f"File {file.filename} exceeds the per-file limit of {max_file_bytes} bytes"
+                else:
+                    detail = f"Upload exceeds the per-request limit of {MAX_UPLOAD_REQUEST_BYTES} bytes"
+                raise HTTPException(status_code=413, detail=detail)
+            digest.update(chunk)
+            if spool is None and len(buffer) + len(chunk) <= UPLOAD_SPOOL_THRESHOLD_BYTES:
+                buffer += chunk
+                continue
+            if spool is None:
+                spool = tempfile.NamedTemporaryFile(prefix="upload-", dir=UPLOAD_SPOOL_DIR, delete=False)
+                upload.path = spool.name
+                upload._finalizer = weakref.finalize(upload, _remove_file, spool.name)
+                spool.write(buffer)
+                buffer = bytearray()
+            spool.write(chunk)
+    except BaseException:
+        if spool is not None:
+            spool.close()
+        upload.close()
+        raise
+    finally:
+        await file.close()
+
+    if spool is not None:
+        spool.close()
+    else:
+        upload._data = bytes(buffer)
+    upload.sha256 = digest.hexdigest()
+    return upload
+
+
+async def spool_uploads(
+    files: List[UploadFile],
+    max_file_bytes: int = MAX_UPLOAD_FILE_BYTES,
+    max_request_bytes: int = MAX_UPLOAD_REQUEST_BYTES,
+) -> List[SpooledUpload]:
+    """Spool every upload of a request; on any error the ones already spooled are deleted."""
+    uploads = []
+    try:
+        for file in files:
+            remaining = max_request_bytes - sum(upload.size for upload in uploads)
+            uploads.append(await spool_upload(file, max_file_bytes, remaining))
+    except BaseException:
+        close_uploads(uploads)
+        raise
+    return uploads
+
+
+def close_uploads(uploads: List[SpooledUpload]) -> None:
+    for upload in uploads:
+        upload.close()
+
+
+async def run_with_uploads(inflight: SingleFlight, key: str, uploads: List[SpooledUpload], fn: Callable[[], Awaitable[T]]) -> T:
+    """
+    Run `fn` (which reads `uploads`) through single-flight and delete the spool files afterwards.
+
+    The files belong to whichever computation uses them: a shared computation
+    deletes them when it finishes, even if the request that started it has
+    gone away while others still wait on it; a request that only joined an
+    existing computation deletes its own copies straight away.
+    """
+    started = False
+
+    async def owned() -> T:
+        nonlocal started
+        started = True
+        try:
+            return await fn()
+        finally:
+            close_uploads(uploads)
+
+    try:
+        return await inflight.do(key, owned)
+    finally:
+        if not started:
+            close_uploads(uploads)
@@ -1,143 +1,822 @@
 
-from typing import List, Tuple, Union
-from .schemas import AadhaarExtractedData, PANExtractedData, OTPExtractedData
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+from .schemas import AadhaarValidatedData, PANValidatedData, OTPExtractedData
+from .metrics import STAGE_LATENCY, PAGES_SKIPPED, PAGES_CLASSIFIED, OTP_RECOGNITIONS
+from .request_stats import record_stat
+from .rasterizer import PdfRasterizer, PdfSource, count_pages, open_pdf, render_page
+from .uploads import SpooledUpload
+from .media_types import detect_media_type
+from .page_filter import PageFilter, new_page_filter
+from .doc_classifier import (
+    DOC_CLASSIFIER_DPI, DOC_CLASSIFIER_FALLBACK_DPI, DOC_CLASSIFIER_FALLBACK_LONG_EDGE, DOC_CLASSIFIER_GEMINI_FALLBACK,
+    classify_page, is_blank_page,
+)
+from .validators import FIELD_VALIDATORS, field_validation
+from .agents import AADHAAR_AGENT, PAN_AGENT, OTP_AGENT, FIELD_AGENT, PAGE_TYPE_AGENT, PROMPT_VERSION, APIQuotaExceededException, run_agent
+from .extraction_cache import ExtractionCache
+from .otp_recognizer import OTP_LOCAL_CONFIDENCE, OtpRecognizer
+from pydantic import TypeAdapter
 from pydantic_ai import Agent, BinaryContent
+from fastapi.concurrency import run_in_threadpool
 from pydantic_ai.models.gemini import GeminiModel
 from pydantic_ai.providers.google_gla import GoogleGLAProvider
-import fitz  # PyMuPDF
+import asyncio
+from contextlib import nullcontext
+from contextvars import ContextVar
+import io
 import os
 import cv2
 import numpy as np
 import torch
-from PIL import Image
+from PIL import Image, ImageOps
+
+# Image preprocessing applied before anything is sent to Gemini
+IMAGE_PREPROCESSING = os.getenv("IMAGE_PREPROCESSING", "true").lower() == "true"
+IMAGE_TARGET_LONG_EDGE = int(os.getenv("IMAGE_TARGET_LONG_EDGE", "1600"))
+IMAGE_OUTPUT_FORMAT = os.getenv("IMAGE_OUTPUT_FORMAT", "jpeg")  # jpeg or webp
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", "85"))
+
+# Progressive extraction: render PDFs small first, re-render only pages that fail validation
+PROGRESSIVE_MIN_DPI = int(os.getenv("PROGRESSIVE_MIN_DPI", "100"))
+PROGRESSIVE_MAX_DPI = int(os.getenv("PROGRESSIVE_MAX_DPI", "300"))
+
+# Fan-out extraction: images per Gemini call and how many calls run at once
+FANOUT_GROUP_SIZE = int(os.getenv("FANOUT_GROUP_SIZE", "4"))
+FANOUT_MAX_CONCURRENCY = int(os.getenv("FANOUT_MAX_CONCURRENCY", "4"))
+
+# Gemini calls one request (or one queued document) may have in flight, across all its pages, files and re-reads
+_gemini_slots: ContextVar[Optional[asyncio.Semaphore]] = ContextVar("ocr_gemini_slots", default=None)
+
+# Targeted re-extraction: where each re-readable field is printed on the front of the
+# deskewed card, as (left, top, right, bottom) fractions. Generous enough to cover
+# both the older and the current PAN layouts.
+FIELD_REGIONS = {
+    "aadhaar": {
+        "aadhaar_number": (0.1, 0.65, 0.9, 0.97),
+        "date_of_birth": (0.25, 0.2, 1.0, 0.7),
+    },
+    "pan": {
+        "pan_number": (0.0, 0.15, 0.75, 0.8),
+        "date_of_birth": (0.0, 0.35, 0.75, 1.0),
+    },
+}
+FIELD_INSTRUCTIONS = {
+    "aadhaar_number": "Read the 12-digit Aadhaar number (printed as three groups of four digits).",
+    "date_of_birth": "Read the date of birth as DD/MM/YYYY, or just the year if only the year of birth is printed.",
+    "pan_number": "Read the 10-character PAN: 5 letters, 4 digits, 1 letter.",
+}
+FIELD_CROP_LONG_EDGE = 1000
+
+VALIDATED_TYPES = {
+    "aadhaar": AadhaarValidatedData,
+    "pan": PANValidatedData,
+}
+
+ENCODERS = {
+    "jpeg": (".jpg", "image/jpeg", cv2.IMWRITE_JPEG_QUALITY),
+    "webp": (".webp", "image/webp", cv2.IMWRITE_WEBP_QUALITY),
+}
+
+
+class PreparedImage(NamedTuple):
+    data: bytes
+    media_type: str
+    original_bytes: int
+
+
+def decode_image(data: bytes) -> np.ndarray:
+    """Decode to a BGR array, applying EXIF orientation so phone photos come out upright."""
+    with Image.open(io.BytesIO(data)) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        return cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
+
+
+def _order_corners(points: np.ndarray) -> np.ndarray:
+    """Order quad corners as top-left, top-right, bottom-right, bottom-left."""
+    sums = points.sum(axis=1)
+    diffs = np.diff(points, axis=1).ravel()
+    return np.array([
+        points[np.argmin(sums)], points[np.argmin(diffs)],
+        points[np.argmax(sums)], points[np.argmax(diffs)],
+    ], dtype=np.float32)
+
+
+def crop_document(image: np.ndarray, min_area_ratio: float = 0.2) -> np.ndarray:
+    """
+    Find the card/page outline and warp it to a flat, upright rectangle.
+
+    Cropping and deskewing happen in one perspective transform. When no
+    convincing four-sided outline is found the image is returned unchanged.
+    """
+    height, width = image.shape[:2]
+    scale = 800.0 / max(height, width)
+    small = cv2.resize(image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA) if scale < 1 else image
+    scale = min(scale, 1.0)
+
+    gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (5, 5), 0)
+    edges = cv2.dilate(cv2.Canny(gray, 50, 150), np.ones((3, 3), np.uint8))
+    contours, _ = cv2.findContours(edges, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    min_area = min_area_ratio * small.shape[0] * small.shape[1]
+    for contour in sorted(contours, key=cv2.contourArea, reverse=True)[:5]:
+        if cv2.contourArea(contour) < min_area:
+            break
+        quad = cv2.approxPolyDP(contour, 0.02 * cv2.arcLength(contour, True), True)
+        if len(quad) != 4:
+            continue
+        corners = _order_corners(quad.reshape(4, 2).astype(np.float32) / scale)
+        top_left, top_right, bottom_right, bottom_left = corners
+        out_width = int(max(np.linalg.norm(top_right - top_left), np.linalg.norm(bottom_right - bottom_left)))
+        out_height = int(max(np.linalg.norm(bottom_left - top_left), np.linalg.norm(bottom_right - top_right)))
+        if out_width < 50 or out_height < 50:
+            continue
+        target = np.array([[0, 0], [out_width - 1, 0], [out_width - 1, out_height - 1], [0, out_height - 1]], dtype=np.float32)
+        transform = cv2.getPerspectiveTransform(corners, target)
+        return cv2.warpPerspective(image, transform, (out_width, out_height))
+    return image
+
+
+def downscale(image: np.ndarray, long_edge: int) -> np.ndarray:
+    height, width = image.shape[:2]
+    scale = long_edge / float(max(height, width))
+    if scale >= 1:
+        return image
+    return cv2.resize(image, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA)
+
+
+def encode_image(image: np.ndarray, output_format: str = IMAGE_OUTPUT_FORMAT, quality: int = IMAGE_QUALITY) -> Tuple[bytes, str]:
+    extension, media_type, quality_flag = ENCODERS[output_format]
+    ok, encoded = cv2.imencode(extension, image, [quality_flag, quality])
+    if not ok:
+        raise ValueError(f"Could not encode image as {output_format}")
+    return encoded.tobytes(), media_type
+
+
+def preprocess_document_image(
+    data: bytes,
+    detect_document: bool = True,
+    target_long_edge: Optional[int] = IMAGE_TARGET_LONG_EDGE,
+    output_format: str = IMAGE_OUTPUT_FORMAT,
+    quality: int = IMAGE_QUALITY,
+) -> PreparedImage:
+    """
+    Shrink an uploaded image or rendered page before it is sent to the LLM.
+
+    Args:
+        data: Encoded image (PNG, JPEG, WEBP, BMP)
+        detect_document: Crop and deskew to the detected card/page outline
+        target_long_edge: Downscale so the longer side is at most this many pixels,
+            None to keep the full resolution
+        output_format: "jpeg" or "webp"
+        quality: Encoder quality (0-100)
+
+    Returns:
+        PreparedImage: Re-encoded bytes with their real media type, or the
+        original bytes when re-encoding would not make them smaller
+    """
+    original_type = detect_media_type(data)
+    image = decode_image(data)
+    if detect_document:
+        image = crop_document(image)
+    if target_long_edge:
+        image = downscale(image, target_long_edge)
+    encoded, media_type = encode_image(image, output_format, quality)
+    if len(encoded) >= len(data) and original_type in ("image/png", "image/jpeg", "image/webp"):
+        return PreparedImage(data, original_type, len(data))
+    return PreparedImage(encoded, media_type, len(data))
+
+
+def crop_field(data: bytes, region: Tuple[float, float, float, float]) -> PreparedImage:
+    """
+    Cut the part of a card image where one field is printed.
+
+    The full image is used when no landscape card outline is found, since the
+    region fractions would not mean anything then.
+    """
+    card = crop_document(decode_image(data))
+    height, width = card.shape[:2]
+    if 1.3 <= width / float(height) <= 2.0:
+        left, top, right, bottom = region
+        card = card[int(top * height):int(bottom * height), int(left * width):int(right * width)]
+    encoded, media_type = encode_image(downscale(card, FIELD_CROP_LONG_EDGE))
+    return PreparedImage(encoded, media_type, len(data))
+
+
+def with_field_validation(doc_type: str, records: list) -> list:
+    """Attach the per-field validation status to extracted records."""
+    validated_type = VALIDATED_TYPES[doc_type]
+    return [
+        validated_type(**record.model_dump(exclude={"field_validation"}), field_validation=field_validation(doc_type, record))
+        for record in records
+    ]
+
+
+def begin_gemini_slots(max_concurrency: int = FANOUT_MAX_CONCURRENCY) -> None:
+    """Start a Gemini concurrency budget for the current request context; without one, calls are not limited."""
+    _gemini_slots.set(asyncio.Semaphore(max_concurrency))
 
-class APIQuotaExceededException(Exception):
-    """Exception raised when API quota is exceeded."""
-    pass
 
 class OcrAgent:
-    def __init__(self):
-        api_key = os.getenv("GEMINI_API_KEY")
-        if not api_key:
-            raise ValueError("GEMINI_API_KEY environment variable is required")
-        
+    def __init__(
+        self,
+        model: Optional[GeminiModel] = None,
+        rasterizer: Optional[PdfRasterizer] = None,
+        cache: Optional[ExtractionCache] = None,
+        otp_recognizer: Optional[OtpRecognizer] = None,
+    ):
+        """
+        Args:
+            model: Shared Gemini model from the client registry. When omitted a
+                standalone model is built from GEMINI_API_KEY.
+            rasterizer: Process pool for PDF rendering. When omitted pages are
+                rendered in the threadpool.
+            cache: Extraction result cache. When omitted every extraction calls Gemini.
+            otp_recognizer: On-device OTP reader tried before Gemini. When omitted
+                every OTP image goes to Gemini.
+        """
         # Get region from environment variable, default to us-central1
         region = os.getenv("GEMINI_REGION", "us-central1")
         
-        self.model = GeminiModel(
-            "gemini-2.0-flash-lite",  # Use Gemini 2.0 Flash Lite
-            provider=GoogleGLAProvider(api_key=api_key),
-        )
+        if model is None:
+            api_key = os.getenv("GEMINI_API_KEY")
+            if not api_key:
+                raise ValueError("GEMINI_API_KEY environment variable is required")
+            
+            model = GeminiModel(
+                "gemini-2.0-flash-lite",  # Use Gemini 2.0 Flash Lite
+                provider=GoogleGLAProvider(api_key=api_key),
+            )
+        self.model = model
+        self.rasterizer = rasterizer
+        self.cache = cache
+        self.otp_recognizer = otp_recognizer
         
         # Store region for reference (provider doesn't directly support region parameter)
         self.region = region
 
-    def convert_pdf_to_images(self, pdf_bytes: bytes, dpi: int = 150) -> List[bytes]:
-        """Convert PDF pages to image bytes."""
+    def convert_pdf_to_images(self, pdf_source: PdfSource, dpi: int = 150, pages: Optional[List[int]] = None) -> List[bytes]:
+        """Convert PDF pages (all of them, or just `pages`) to image bytes."""
         images = []
-        pdf_document = fitz.open(stream=pdf_bytes, filetype="pdf")
-        
-        try:
-            for page_num in range(len(pdf_document)):
-                page = pdf_document.load_page(page_num)
-                # Calculate matrix for DPI scaling
-                zoom = dpi / 72.0  # 72 is the default DPI
-                mat = fitz.Matrix(zoom, zoom)
-                pix = page.get_pixmap(matrix=mat)
-                img_data = pix.tobytes("png")
-                images.append(img_data)
-        finally:
-            pdf_document.close()
+        with STAGE_LATENCY.time(stage="convert_pdf_to_images", provider="pymupdf"):
+            with open_pdf(pdf_source) as pdf_document:
+                for page_num in (range(len(pdf_document)) if pages is None else pages):
+                    images.append(render_page(pdf_document, page_num, dpi))
             
         return images
 
-    async def extract_aadhaar_data(self, images: List[bytes]) -> List[AadhaarExtractedData]:
-        """Extract data specifically from Aadhaar cards."""
-        agent = Agent(
-            model=self.model,
-            output_type=List[AadhaarExtractedData],
-            system_prompt=(
-                'Extract information from Indian Aadhaar cards only. '
-                'Aadhaar cards have a 12-digit unique identification number, photo, and demographic details. '
-                'The card has Government of India logo and "Government of India" text. '
-                'Look for: Aadhaar number (12 digits), name, date of birth, gender, address, PIN code, father\'s name. '
-                'Return null for missing fields. Be very accurate with the Aadhaar number format (12 digits).'
-            )
+    async def render_pdf(self, pdf_source: PdfSource, dpi: int = 150, pages: Optional[List[int]] = None) -> List[bytes]:
+        """Convert PDF pages to image bytes without blocking the event loop."""
+        if self.rasterizer is None:
+            return await run_in_threadpool(self.convert_pdf_to_images, pdf_source, dpi, pages)
+        with STAGE_LATENCY.time(stage="convert_pdf_to_images", provider="pymupdf_pool"):
+            return await self.rasterizer.render(pdf_source, dpi, pages)
+
+    async def iter_pdf_pages(self, pdf_source: PdfSource, dpi: int = 150, pages: Optional[List[int]] = None) -> AsyncIterator[Tuple[int, bytes]]:
+        """Yield `(page_num, image_bytes)` as each page is rendered, so callers never hold the whole document's pages."""
+        if self.rasterizer is not None:
+            async for item in self.rasterizer.iter_pages(pdf_source, dpi, pages):
+                yield item
+            return
+        if pages is None:
+            pages = list(range(await run_in_threadpool(count_pages, pdf_source)))
+        for page_num in pages:
+            image, = await run_in_threadpool(self.convert_pdf_to_images, pdf_source, dpi, [page_num])
+            yield page_num, image
+
+    def _prepare(self, images: List[bytes], detect_document: bool, target_long_edge: Optional[int]) -> List[BinaryContent]:
+        prepared = []
+        for image in images:
+            if IMAGE_PREPROCESSING:
+                try:
+                    prepared.append(preprocess_document_image(image, detect_document=detect_document, target_long_edge=target_long_edge))
+                    continue
+                except Exception as e:
+                    # Undecodable by OpenCV/PIL, let Gemini have the original
+                    print(f"Image preprocessing failed, sending original: {e}")
+            prepared.append(PreparedImage(image, detect_media_type(image), len(image)))
+
+        original = sum(item.original_bytes for item in prepared)
+        sent = sum(len(item.data) for item in prepared)
+        record_stat("X-Upload-Bytes-Original", original)
+        record_stat("X-Upload-Bytes-Sent", sent)
+        return [BinaryContent(data=item.data, media_type=item.media_type) for item in prepared]
+
+    async def prepare_images(
+        self, images: List[bytes], detect_document: bool = True, target_long_edge: Optional[int] = IMAGE_TARGET_LONG_EDGE
+    ) -> List[BinaryContent]:
+        """Crop, deskew, downscale and re-encode images off the event loop, labelled with their real media type."""
+        with STAGE_LATENCY.time(stage="preprocess_images", provider="opencv"):
+            return await run_in_threadpool(self._prepare, images, detect_document, target_long_edge)
+
+    async def keep_page(self, page_filter: Optional[PageFilter], image: bytes, require_card: bool = True) -> bool:
+        """Screen a page locally; skipped pages are counted in X-Pages-Skipped / X-Bytes-Skipped."""
+        if page_filter is None:
+            return True
+        with STAGE_LATENCY.time(stage="page_filter", provider="opencv"):
+            reason = await run_in_threadpool(page_filter.check, image, require_card)
+        if reason is None:
+            return True
+        PAGES_SKIPPED.inc(reason=reason)
+        record_stat("X-Pages-Skipped", 1)
+        record_stat("X-Bytes-Skipped", len(image))
+        return False
+
+    async def filter_pages(self, page_filter: Optional[PageFilter], images: List[bytes], require_card: bool = True) -> List[bytes]:
+        kept = []
+        for image in images:
+            if await self.keep_page(page_filter, image, require_card):
+                kept.append(image)
+        return kept
+
+    async def _run_cached(self, agent: Agent, stage: str, doc_type: str, instruction: str, images: List[BinaryContent]):
+        """Run `agent` on the prepared images, answering from the extraction cache when the same scan was seen before."""
+        prompt = [instruction, *images]
+        if self.cache is None:
+            async with _gemini_slots.get() or nullcontext():
+                return await run_agent(agent, self.model, stage, prompt)
+
+        adapter = TypeAdapter(agent.output_type)
+        key, scope, phash, cached = await run_in_threadpool(
+            self.cache.lookup, doc_type, PROMPT_VERSION, instruction, [image.data for image in images]
         )
+        if cached is not None:
+            record_stat("X-Cache-Hits", 1)
+            return adapter.validate_python(cached)
 
-        binaryimages = [
-            BinaryContent(data=image, media_type='image/png') for image in images
-        ]
+        record_stat("X-Cache-Misses", 1)
+        async with _gemini_slots.get() or nullcontext():
+            output = await run_agent(agent, self.model, stage, prompt)
+        await run_in_threadpool(self.cache.set, key, scope, phash, adapter.dump_python(output, mode="json"))
+        return output
+
+    async def extract_aadhaar_data(
+        self, images: List[bytes], target_long_edge: Optional[int] = IMAGE_TARGET_LONG_EDGE
+    ) -> List[AadhaarValidatedData]:
+        """Extract data specifically from Aadhaar cards."""
+        binaryimages = await self.prepare_images(images, target_long_edge=target_long_edge)
+        # Drop the rendered pages now that they are encoded; the Gemini call can take seconds
+        del images
         
-        try:
-            result = await agent.run([
-                'Extract Aadhaar card data: aadhaar_number (12 digits), full_name, date_of_birth, gender, address, father_name, phone_number, email, pin_code, state, district from each Aadhaar card image.',
-                *binaryimages
-            ])
-            return result.output
-        except Exception as e:
-            if "429" in str(e) or "RATE_LIMIT_EXCEEDED" in str(e):
-                raise APIQuotaExceededException("API quota exceeded. Please wait a few minutes or upgrade your plan.")
-            else:
-                raise e
+        records = await self._run_cached(
+            AADHAAR_AGENT, "extract_aadhaar", "aadhaar",
+            'Extract Aadhaar card data: aadhaar_number (12 digits; for a masked Aadhaar copy the number as printed, e.g. XXXX XXXX 1234), full_name, date_of_birth, gender, address, father_name, phone_number, email, pin_code, state, district from each Aadhaar card image.',
+            binaryimages
+        )
+        return with_field_validation("aadhaar", records)
 
-    async def extract_pan_data(self, images: List[bytes]) -> List[PANExtractedData]:
+    async def extract_pan_data(
+        self, images: List[bytes], target_long_edge: Optional[int] = IMAGE_TARGET_LONG_EDGE
+    ) -> List[PANValidatedData]:
         """Extract data specifically from PAN cards."""
-        agent = Agent(
-            model=self.model,
-            output_type=List[PANExtractedData],
-            system_prompt=(
-                'Extract information from Indian PAN (Permanent Account Number) cards only. '
-                'PAN cards have a 10-character alphanumeric PAN number in format AAAAA9999A, photo, and personal details. '
-                'The card has "INCOME TAX DEPARTMENT GOVT. OF INDIA" header and Indian flag/emblem. '
-                'Look for: PAN number (10 characters), name, father\'s name, date of birth, signature, photo. '
-                'Return null for missing fields. Be very accurate with the PAN number format (5 letters + 4 digits + 1 letter).'
-            )
+        binaryimages = await self.prepare_images(images, target_long_edge=target_long_edge)
+        # Drop the rendered pages now that they are encoded; the Gemini call can take seconds
+        del images
+        
+        records = await self._run_cached(
+            PAN_AGENT, "extract_pan", "pan",
+            'Extract PAN card data: pan_number (format AAAAA9999A), full_name, father_name, date_of_birth, signature_present (boolean), photo_present (boolean), permanent_account_number from each PAN card image.',
+            binaryimages
         )
+        return with_field_validation("pan", records)
+
+    def can_reextract_fields(self, doc_type: str, records: list) -> bool:
+        """
+        Whether a page's failures can be fixed by re-reading single fields: exactly
+        one card on the page (so crops map to it) and every failing field has a known region.
+        """
+        if len(records) != 1:
+            return False
+        failures = FIELD_VALIDATORS[doc_type](records[0])
+        return bool(failures) and all(field in FIELD_REGIONS[doc_type] for field in failures)
+
+    async def reextract_field(self, doc_type: str, field: str, image_bytes: bytes) -> Optional[str]:
+        """Read one field from the region of the card it is printed in."""
+        crop = await run_in_threadpool(crop_field, image_bytes, FIELD_REGIONS[doc_type][field])
+        reading = await self._run_cached(
+            FIELD_AGENT, "reextract_field", f"{doc_type}:{field}",
+            FIELD_INSTRUCTIONS[field],
+            [BinaryContent(data=crop.data, media_type=crop.media_type)]
+        )
+        return reading.value
+
+    async def reextract_fields(self, doc_type: str, image_bytes: bytes, record):
+        """
+        Re-read only the fields of `record` that failed validation, each from a crop of the card.
+
+        A re-read value replaces the original only if it validates.
+        """
+        validate = FIELD_VALIDATORS[doc_type]
+        failures = validate(record)
+        readings = await asyncio.gather(*(self.reextract_field(doc_type, field, image_bytes) for field in failures))
+        record_stat("X-Fields-Reextracted", len(failures))
+        updates = {}
+        for field, value in zip(failures, readings):
+            if value is not None and field not in validate(record.model_copy(update={field: value})):
+                updates[field] = value
+        return with_field_validation(doc_type, [record.model_copy(update=updates)])[0]
+
+    async def extract_otp_from_image(self, image_bytes: bytes) -> OTPExtractedData:
+        """
+        Extract OTP from an image containing a user's face and a sheet with OTP written on it.
+
+        The on-device recognizer is tried first; Gemini is only called when its
+        calibrated confidence is below OTP_LOCAL_CONFIDENCE.
+        """
+        if self.otp_recognizer is not None:
+            with STAGE_LATENCY.time(stage="extract_otp", provider="local"):
+                local = await run_in_threadpool(self.otp_recognizer.recognize, image_bytes)
+            if local.otp is not None and local.confidence >= OTP_LOCAL_CONFIDENCE:
+                OTP_RECOGNITIONS.inc(source="local")
+                record_stat("X-OTP-Local", 1)
+                return local
+        OTP_RECOGNITIONS.inc(source="gemini")
 
-        binaryimages = [
-            BinaryContent(data=image, media_type='image/png') for image in images
-        ]
+        # The sheet is only part of a selfie, so shrink and re-encode without cropping
+        binary_image, = await self.prepare_images([image_bytes], detect_document=False)
         
+        return await self._run_cached(
+            OTP_AGENT, "extract_otp", "otp",
+            'Extract the OTP from this image. The image shows a person with a sheet/paper containing a written OTP. Focus on finding the numerical OTP written on the paper/sheet.',
+            [binary_image]
+        )
+
+    async def extract_pdf_progressive(
+        self,
+        doc_type: str,
+        pdf_source: PdfSource,
+        min_dpi: int = PROGRESSIVE_MIN_DPI,
+        max_dpi: int = PROGRESSIVE_MAX_DPI,
+        page_filter: Optional[PageFilter] = None,
+        pages: Optional[List[int]] = None,
+    ) -> list:
+        """
+        Extract a PDF starting at `min_dpi`, doubling the resolution only for pages whose fields fail validation.
+
+        When a failing page holds a single card and only fields with a known
+        region failed, just those fields are re-read from crops of the page at
+        `max_dpi` instead of repeating the whole extraction.
+
+        Args:
+            doc_type: "aadhaar" or "pan"
+            pdf_source: Raw PDF document, or the path of a spooled upload
+            min_dpi: Resolution of the first pass over every page
+            max_dpi: Highest resolution a failing page is re-rendered at
+            page_filter: Screens first-pass pages; skipped pages are never sent or re-rendered
+            pages: Only extract these pages (0-based), all pages when omitted
+
+        Returns:
+            list: Extracted records in page order
+        """
+        validate = FIELD_VALIDATORS[doc_type]
+        extract = self.extract_aadhaar_data if doc_type == "aadhaar" else self.extract_pan_data
+        results: Dict[int, list] = {}
+        pending = pages
+        first_pass = True
+        dpi = min_dpi
+        while True:
+            # Each page is dispatched as soon as it is rendered and the task owns its only reference.
+            # Rendered pages are already at the resolution we asked for, so don't downscale them again.
+            tasks = {}
+            async for page_num, image in self.iter_pdf_pages(pdf_source, dpi, pending):
+                if first_pass and not await self.keep_page(page_filter, image):
+                    continue
+                tasks[page_num] = asyncio.ensure_future(extract([image], target_long_edge=None))
+                image = None
+            try:
+                extracted = dict(zip(tasks, await asyncio.gather(*tasks.values())))
+            except BaseException:
+                for task in tasks.values():
+                    task.cancel()
+                raise
+
+            failed, targeted = [], []
+            for page_num in sorted(extracted):
+                results[page_num] = merge_records(validate, results.get(page_num, []), extracted[page_num])
+                if self.can_reextract_fields(doc_type, results[page_num]):
+                    targeted.append(page_num)
+                elif not results[page_num] or any(validate(record) for record in results[page_num]):
+                    failed.append(page_num)
+
+            if targeted:
+                tasks = {}
+                async for page_num, image in self.iter_pdf_pages(pdf_source, max_dpi, targeted):
+                    tasks[page_num] = asyncio.ensure_future(self.reextract_fields(doc_type, image, results[page_num][0]))
+                    image = None
+                try:
+                    for page_num, record in zip(tasks, await asyncio.gather(*tasks.values())):
+                        results[page_num] = [record]
+                except BaseException:
+                    for task in tasks.values():
+                        task.cancel()
+                    raise
+
+            if not failed or dpi >= max_dpi:
+                break
+            dpi = min(dpi * 2, max_dpi)
+            pending = failed
+            first_pass = False
+            record_stat("X-Pages-Rerendered", len(failed))
+
+        return with_field_validation(doc_type, [record for page_num in sorted(results) for record in results[page_num]])
+
+    async def extract_image_progressive(self, doc_type: str, image_bytes: bytes, page_filter: Optional[PageFilter] = None) -> list:
+        """
+        Extract an uploaded image downscaled first. If validation fails, re-read just
+        the failing fields from crops of the full-resolution image when possible,
+        otherwise extract the whole image again at full resolution.
+        """
+        # A photo of a card is a card by definition, only blank and repeated uploads are skipped
+        if not await self.keep_page(page_filter, image_bytes, require_card=False):
+            return []
+        validate = FIELD_VALIDATORS[doc_type]
+        extract = self.extract_aadhaar_data if doc_type == "aadhaar" else self.extract_pan_data
+        records = await extract([image_bytes], target_long_edge=IMAGE_TARGET_LONG_EDGE)
+        if records and not any(validate(record) for record in records):
+            return records
+        if self.can_reextract_fields(doc_type, records):
+            return [await self.reextract_fields(doc_type, image_bytes, records[0])]
+        record_stat("X-Pages-Rerendered", 1)
+        retry = await extract([image_bytes], target_long_edge=None)
+        return with_field_validation(doc_type, merge_records(validate, records, retry))
+
+    async def extract_file(
+        self,
+        doc_type: str,
+        source: PdfSource,
+        content_type: str,
+        progressive: bool = True,
+        min_dpi: int = PROGRESSIVE_MIN_DPI,
+        max_dpi: int = PROGRESSIVE_MAX_DPI,
+        page_filter: Optional[PageFilter] = None,
+        pages: Optional[List[int]] = None,
+    ) -> list:
+        """
+        Extract every card in one uploaded image or PDF (bytes, or the path of a spooled upload).
+
+        Pass the same `page_filter` for every file of a request to catch duplicates
+        across files; a fresh one is used otherwise. `pages` restricts a PDF to
+        those pages.
+        """
+        if page_filter is None:
+            page_filter = new_page_filter()
+        if content_type == 'application/pdf':
+            if progressive:
+                return await self.extract_pdf_progressive(doc_type, source, min_dpi, max_dpi, page_filter, pages)
+            images = await self.filter_pages(page_filter, await self.render_pdf(source, pages=pages))
+        else:
+            if isinstance(source, str):
+                with open(source, "rb") as f:
+                    source = f.read()
+            if progressive:
+                return await self.extract_image_progressive(doc_type, source, page_filter)
+            images = await self.filter_pages(page_filter, [source], require_card=False)
+        if not images:
+            return []
+        if doc_type == "aadhaar":
+            return await self.extract_aadhaar_data(images)
+        return await self.extract_pan_data(images)
+
+    async def classify(self, image: bytes) -> str:
+        """Local document type of a page or photo: "aadhaar", "pan" or "unknown"."""
+        with STAGE_LATENCY.time(stage="classify_page", provider="opencv"):
+            page_class = await run_in_threadpool(classify_page, image)
+        PAGES_CLASSIFIED.inc(doc_type=page_class.doc_type, provider="opencv")
+        return page_class.doc_type
+
+    async def needs_gemini_classification(self, doc_type: str, image: bytes) -> bool:
+        """Whether a page the colour cues left unknown should be classified by Gemini."""
+        return doc_type == "unknown" and DOC_CLASSIFIER_GEMINI_FALLBACK and not await run_in_threadpool(is_blank_page, image)
+
+    async def classify_with_gemini(self, image: bytes) -> str:
+        """
+        Document type of a page without colour cues (e.g. a black-and-white photocopy), from a small render.
+
+        A failed call leaves the page "unknown" rather than failing the request.
+        """
         try:
-            result = await agent.run([
-                'Extract PAN card data: pan_number (format AAAAA9999A), full_name, father_name, date_of_birth, signature_present (boolean), photo_present (boolean), permanent_account_number from each PAN card image.',
-                *binaryimages
-            ])
-            return result.output
+            prepared = await self.prepare_images([image], target_long_edge=DOC_CLASSIFIER_FALLBACK_LONG_EDGE)
+            reading = await self._run_cached(
+                PAGE_TYPE_AGENT, "classify_page", "page_type",
+                'Is this an Aadhaar card, a PAN card or something else? Answer aadhaar, pan or other.',
+                prepared
+            )
+            doc_type = reading.doc_type if reading.doc_type in ("aadhaar", "pan") else "unknown"
         except Exception as e:
-            if "429" in str(e) or "RATE_LIMIT_EXCEEDED" in str(e):
-                raise APIQuotaExceededException("API quota exceeded. Please wait a few minutes or upgrade your plan.")
+            print(f"Gemini page classification failed: {e}")
+            doc_type = "unknown"
+        PAGES_CLASSIFIED.inc(doc_type=doc_type, provider="gemini")
+        return doc_type
+
+    async def extract_classified(
+        self,
+        uploads: List[SpooledUpload],
+        progressive: bool = True,
+        min_dpi: int = PROGRESSIVE_MIN_DPI,
+        max_dpi: int = PROGRESSIVE_MAX_DPI,
+        default_type: Optional[str] = None,
+    ) -> dict:
+        """
+        Classify every page of a mixed upload and extract it with the matching extractor only.
+
+        PDF pages are classified locally on a small render (DOC_CLASSIFIER_DPI);
+        non-blank pages without a colour cue are re-rendered at
+        DOC_CLASSIFIER_FALLBACK_DPI and classified by Gemini. Each file's Aadhaar
+        and PAN pages are then extracted as two page subsets, so no page is ever
+        sent to the wrong extractor or to both.
+
+        Args:
+            uploads: Spooled uploads, in order
+            progressive, min_dpi, max_dpi: As for `extract_file`
+            default_type: Extractor for pages that can't be classified; they are
+                only reported when omitted
+
+        Returns:
+            dict: Records per document type, the pages routed to each type and the
+            pages left unclassified
+        """
+        page_filter = new_page_filter()
+        result = {"aadhaar": [], "pan": [], "aadhaar_pages": [], "pan_pages": [], "unclassified_pages": []}
+        routes = []  # (doc_type, upload, pages or None for an image)
+
+        for file_index, upload in enumerate(uploads):
+            by_type = {"aadhaar": [], "pan": [], None: []}
+            if upload.content_type == 'application/pdf':
+                ask_gemini = []
+                async for page_num, image in self.iter_pdf_pages(upload.source, DOC_CLASSIFIER_DPI):
+                    doc_type = await self.classify(image)
+                    if await self.needs_gemini_classification(doc_type, image):
+                        ask_gemini.append(page_num)
+                    else:
+                        by_type[default_type if doc_type == "unknown" else doc_type].append(page_num)
+                if ask_gemini:
+                    tasks = {}
+                    async for page_num, image in self.iter_pdf_pages(upload.source, DOC_CLASSIFIER_FALLBACK_DPI, ask_gemini):
+                        tasks[page_num] = asyncio.ensure_future(self.classify_with_gemini(image))
+                        image = None
+                    for page_num, doc_type in zip(tasks, await asyncio.gather(*tasks.values())):
+                        by_type[default_type if doc_type == "unknown" else doc_type].append(page_num)
             else:
-                raise e
+                image = upload.read()
+                doc_type = await self.classify(image)
+                if await self.needs_gemini_classification(doc_type, image):
+                    doc_type = await self.classify_with_gemini(image)
+                by_type[default_type if doc_type == "unknown" else doc_type].append(0)
 
-    async def extract_otp_from_image(self, image_bytes: bytes) -> OTPExtractedData:
-        """Extract OTP from an image containing a user's face and a sheet with OTP written on it."""
-        agent = Agent(
-            model=self.model,
-            output_type=OTPExtractedData,
-            system_prompt=(
-                'Extract the OTP (One-Time Password) from an image. '
-                'The image contains a person\'s face along with a sheet/paper where an OTP is written. '
-                'Look for numerical digits that appear to be an OTP - typically 4-8 digits. '
-                'Focus on any handwritten or printed numbers on papers, signs, or sheets in the image. '
-                'Ignore any numbers that might be part of documents, IDs, or background elements. '
-                'Return the OTP as a string of digits and provide a confidence score (0-1) based on clarity.'
-            )
-        )
+            for doc_type, pages in by_type.items():
+                refs = [{"file_index": file_index, "filename": upload.filename, "page": page} for page in sorted(pages)]
+                if doc_type is None:
+                    result["unclassified_pages"].extend(refs)
+                elif pages:
+                    result[f"{doc_type}_pages"].extend(refs)
+                    routes.append((doc_type, upload, sorted(pages) if upload.content_type == 'application/pdf' else None))
+
+        extracted = await asyncio.gather(*(
+            self.extract_file(doc_type, upload.source, upload.content_type, progressive, min_dpi, max_dpi, page_filter, pages)
+            for doc_type, upload, pages in routes
+        ))
+        for (doc_type, _, _), records in zip(routes, extracted):
+            result[doc_type].extend(records)
+        record_stat("X-Pages-Unclassified", len(result["unclassified_pages"]))
+        return result
+
+    async def extract_fanout(
+        self,
+        doc_type: str,
+        uploads: List[SpooledUpload],
+        group_size: int = FANOUT_GROUP_SIZE,
+        max_concurrency: int = FANOUT_MAX_CONCURRENCY,
+    ) -> List[dict]:
+        """
+        Split uploads into small groups of pages and extract the groups concurrently.
+
+        Groups never span files, so every record can be traced back to the file
+        and pages it came from, and a failed group only affects its own file.
+        Pages are grouped as they come out of the rasterizer and each group is
+        released as soon as its call returns, so a large PDF is never held in
+        memory as a whole.
+
+        Args:
+            doc_type: "aadhaar" or "pan"
+            uploads: Spooled uploads, in order
+            group_size: Pages (images) sent in one Gemini call
+            max_concurrency: Gemini calls in flight at once
+
+        Returns:
+            List[dict]: One result per file, in upload order, with its records,
+            the pages they came from and any failed pages
+        """
+        extract = self.extract_aadhaar_data if doc_type == "aadhaar" else self.extract_pan_data
+        semaphore = asyncio.Semaphore(max_concurrency)
+        page_filter = new_page_filter()
+        groups = []  # (file_index, page numbers, task)
+
+        async def run_group(images: List[bytes]) -> list:
+            try:
+                return await extract(images)
+            finally:
+                semaphore.release()
+
+        async def dispatch(file_index: int, pages: List[int], images: List[bytes]) -> None:
+            # Wait for a free slot first so rendering can't run far ahead of extraction
+            await semaphore.acquire()
+            groups.append((file_index, pages, asyncio.ensure_future(run_group(images))))
+
+        async def split_file(file_index: int, upload: SpooledUpload, skipped: List[int]) -> None:
+            if upload.content_type != 'application/pdf':
+                image = upload.read()
+                if await self.keep_page(page_filter, image, require_card=False):
+                    await dispatch(file_index, [0], [image])
+                else:
+                    skipped.append(0)
+                return
+            # The rasterizer yields pages as they finish; hold early arrivals until every earlier page
+            # is in, so groups hold consecutive pages and duplicates keep their first occurrence
+            arrived: Dict[int, bytes] = {}
+            next_page = 0
+            pages, images = [], []
+            async for page_num, image in self.iter_pdf_pages(upload.source):
+                arrived[page_num] = image
+                while next_page in arrived:
+                    image = arrived.pop(next_page)
+                    if await self.keep_page(page_filter, image):
+                        pages.append(next_page)
+                        images.append(image)
+                    else:
+                        skipped.append(next_page)
+                    next_page += 1
+                    if len(images) == group_size:
+                        await dispatch(file_index, pages, images)
+                        pages, images = [], []
+            if images:
+                await dispatch(file_index, pages, images)
+
+        results = []
+        for file_index, upload in enumerate(uploads):
+            result = {
+                "file_index": file_index,
+                "filename": upload.filename,
+                "status": "ok",
+                "records": [],
+                "pages": [],
+                "failed_pages": [],
+                "skipped_pages": [],
+                "errors": [],
+                "quota_exceeded": False,
+            }
+            try:
+                await split_file(file_index, upload, result["skipped_pages"])
+            except Exception as e:
+                result["status"] = "failed"
+                result["errors"].append(f"Could not read file: {e}")
+            results.append(result)
 
-        binary_image = BinaryContent(data=image_bytes, media_type='image/png')
-        
         try:
-            result = await agent.run([
-                'Extract the OTP from this image. The image shows a person with a sheet/paper containing a written OTP. Focus on finding the numerical OTP written on the paper/sheet.',
-                binary_image
-            ])
-            return result.output
-        except Exception as e:
-            if "429" in str(e) or "RATE_LIMIT_EXCEEDED" in str(e):
-                raise APIQuotaExceededException("API quota exceeded. Please wait a few minutes or upgrade your plan.")
+            outcomes = await asyncio.gather(*(task for _, _, task in groups), return_exceptions=True)
+        except BaseException:
+            for _, _, task in groups:
+                task.cancel()
+            raise
+
+        for (file_index, pages, _), outcome in sorted(zip(groups, outcomes), key=lambda item: (item[0][0], min(item[0][1]))):
+            result = results[file_index]
+            if isinstance(outcome, BaseException):
+                result["failed_pages"].extend(sorted(pages))
+                result["errors"].append(f"Pages {sorted(pages)}: {outcome}")
+                result["quota_exceeded"] = result["quota_exceeded"] or isinstance(outcome, APIQuotaExceededException)
             else:
-                raise e
+                result["records"].extend(outcome)
+                result["pages"].extend(sorted(pages))
+
+        for result in results:
+            result["skipped_pages"].sort()
+            if result["failed_pages"] or result["status"] == "failed":
+                result["status"] = "partial" if result["pages"] else "failed"
+        return results
+
 
+def merge_records(validate, kept: list, fresh: list) -> list:
+    """
+    Combine a page's earlier extraction with a higher-resolution retry.
 
+    Fields that already validated are kept; fields that failed are taken from
+    the retry when its value validates, and fields the first pass missed are
+    filled in. Records are matched by position.
+    """
+    if not kept:
+        return fresh
+    merged = []
+    for index, record in enumerate(kept):
+        failures = validate(record)
+        if failures and index < len(fresh):
+            retry_failures = validate(fresh[index])
+            updates = {
+                field: value for field, value in fresh[index].model_dump().items()
+                if value is not None and getattr(record, field) is None
+            }
+            updates.update({
+                field: getattr(fresh[index], field)
+                for field in failures if field not in retry_failures
+            })
+            record = record.model_copy(update=updates)
+        merged.append(record)
+    return merged
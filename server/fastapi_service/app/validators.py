@@ -0,0 +1,175 @@
+"""
+Format checks for extracted identity fields.
+
+These decide whether a low-resolution extraction is good enough to return or
+whether a field has to be read again, and are reported per field to the
+caller as "valid", "invalid", "missing" or, for masked Aadhaar numbers,
+"masked".
+"""
+
+import re
+from datetime import date, datetime
+from typing import Dict, List, Optional
+
+from .schemas import AadhaarExtractedData, PANExtractedData
+
+AADHAAR_PATTERN = re.compile(r"^[2-9][0-9]{11}$")
+# Masked Aadhaar (the e-Aadhaar/offline copies banks are meant to collect): only the last four digits printed
+MASKED_AADHAAR_PATTERN = re.compile(r"^[X*]{8}[0-9]{4}$")
+PAN_PATTERN = re.compile(r"^[A-Z]{5}[0-9]{4}[A-Z]$")
+PIN_CODE_PATTERN = re.compile(r"^[1-9][0-9]{5}$")
+
+# Fourth character of a PAN: the holder's status
+PAN_HOLDER_TYPES = {
+    "P": "individual",
+    "C": "company",
+    "H": "hindu undivided family",
+    "F": "firm",
+    "A": "association of persons",
+    "T": "trust",
+    "B": "body of individuals",
+    "L": "local authority",
+    "J": "artificial juridical person",
+    "G": "government",
+}
+
+DATE_FORMATS = ("%d/%m/%Y", "%d-%m-%Y", "%d.%m.%Y", "%Y-%m-%d", "%d %b %Y", "%d %B %Y")
+
+# Verhoeff tables: dihedral group D5 multiplication and the position permutation
+_VERHOEFF_D = [
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9],
+    [1, 2, 3, 4, 0, 6, 7, 8, 9, 5],
+    [2, 3, 4, 0, 1, 7, 8, 9, 5, 6],
+    [3, 4, 0, 1, 2, 8, 9, 5, 6, 7],
+    [4, 0, 1, 2, 3, 9, 5, 6, 7, 8],
+    [5, 9, 8, 7, 6, 0, 4, 3, 2, 1],
+    [6, 5, 9, 8, 7, 1, 0, 4, 3, 2],
+    [7, 6, 5, 9, 8, 2, 1, 0, 4, 3],
+    [8, 7, 6, 5, 9, 3, 2, 1, 0, 4],
+    [9, 8, 7, 6, 5, 4, 3, 2, 1, 0],
+]
+_VERHOEFF_P = [
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9],
+    [1, 5, 7, 6, 2, 8, 3, 0, 9, 4],
+    [5, 8, 0, 3, 7, 9, 6, 1, 4, 2],
+    [8, 9, 1, 6, 0, 4, 3, 5, 2, 7],
+    [9, 4, 5, 3, 1, 2, 6, 8, 7, 0],
+    [4, 2, 8, 6, 5, 7, 3, 9, 0, 1],
+    [2, 7, 9, 3, 8, 0, 6, 4, 1, 5],
+    [7, 0, 4, 6, 9, 1, 3, 2, 5, 8],
+]
+
+
+def normalize_aadhaar_number(value: Optional[str]) -> str:
+    """Drop the spaces and dashes Aadhaar numbers are usually printed with."""
+    return re.sub(r"[\s-]", "", value or "")
+
+
+def normalize_pan_number(value: Optional[str]) -> str:
+    return re.sub(r"\s", "", value or "").upper()
+
+
+def verhoeff_valid(number: str) -> bool:
+    """Whether the last digit of `number` is its Verhoeff check digit (as on Aadhaar numbers)."""
+    check = 0
+    for position, digit in enumerate(reversed(number)):
+        check = _VERHOEFF_D[check][_VERHOEFF_P[position % 8][int(digit)]]
+    return check == 0
+
+
+def is_valid_aadhaar_number(value: Optional[str]) -> bool:
+    number = normalize_aadhaar_number(value)
+    return bool(AADHAAR_PATTERN.match(number)) and verhoeff_valid(number)
+
+
+def is_masked_aadhaar_number(value: Optional[str]) -> bool:
+    return bool(MASKED_AADHAAR_PATTERN.match(normalize_aadhaar_number(value).upper()))
+
+
+def is_valid_pan_number(value: Optional[str]) -> bool:
+    number = normalize_pan_number(value)
+    return bool(PAN_PATTERN.match(number)) and number[3] in PAN_HOLDER_TYPES
+
+
+def is_valid_pin_code(value: Optional[str]) -> bool:
+    return bool(PIN_CODE_PATTERN.match((value or "").strip()))
+
+
+def parse_date(value: Optional[str]) -> Optional[date]:
+    """Parse a printed date of birth; Aadhaar cards sometimes only carry the year of birth."""
+    text = re.sub(r"\s+", " ", (value or "").strip())
+    if re.fullmatch(r"(19|20)[0-9]{2}", text):
+        return date(int(text), 1, 1)
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(text, date_format).date()
+        except ValueError:
+            continue
+    return None
+
+
+def is_valid_date_of_birth(value: Optional[str]) -> bool:
+    parsed = parse_date(value)
+    return parsed is not None and date(1900, 1, 1) <= parsed <= date.today()
+
+
+# Checked fields per document type, and the ones a record is useless without
+FIELD_CHECKS = {
+    "aadhaar": {
+        "aadhaar_number": is_valid_aadhaar_number,
+        "date_of_birth": is_valid_date_of_birth,
+        "pin_code": is_valid_pin_code,
+    },
+    "pan": {
+        "pan_number": is_valid_pan_number,
+        "date_of_birth": is_valid_date_of_birth,
+    },
+}
+# Fields that can legitimately be printed masked; re-reading those can't recover the digits
+MASKED_CHECKS = {
+    "aadhaar": {"aadhaar_number": is_masked_aadhaar_number},
+    "pan": {},
+}
+REQUIRED_FIELDS = {
+    "aadhaar": ("aadhaar_number",),
+    "pan": ("pan_number",),
+}
+
+
+def field_validation(doc_type: str, record) -> Dict[str, str]:
+    """Status of every checked field: "valid", "masked", "invalid" or "missing"."""
+    statuses = {}
+    for field, check in FIELD_CHECKS[doc_type].items():
+        value = getattr(record, field)
+        masked = MASKED_CHECKS[doc_type].get(field)
+        if value is None or not str(value).strip():
+            statuses[field] = "missing"
+        elif masked is not None and masked(value):
+            statuses[field] = "masked"
+        else:
+            statuses[field] = "valid" if check(value) else "invalid"
+    return statuses
+
+
+def field_failures(doc_type: str, record) -> List[str]:
+    """Names of fields that are malformed, or required and missing; masked fields are not failures."""
+    return [
+        field for field, status in field_validation(doc_type, record).items()
+        if status == "invalid" or (status == "missing" and field in REQUIRED_FIELDS[doc_type])
+    ]
+
+
+def aadhaar_field_failures(record: AadhaarExtractedData) -> List[str]:
+    """Return the names of fields that are missing or malformed."""
+    return field_failures("aadhaar", record)
+
+
+def pan_field_failures(record: PANExtractedData) -> List[str]:
+    """Return the names of fields that are missing or malformed."""
+    return field_failures("pan", record)
+
+
+FIELD_VALIDATORS = {
+    "aadhaar": aadhaar_field_failures,
+    "pan": pan_field_failures,
+}
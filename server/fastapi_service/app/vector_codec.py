@@ -0,0 +1,58 @@
+"""
+Compact binary transport for pgvector embeddings.
+
+pgvector values come back from PostgREST as JSON text, roughly 20 KB for a
+1536-dim vector that has to be parsed number by number. The RPCs in
+`setup_supabase.sql` instead return `vector_send()` output (optionally cast to
+halfvec) base64-encoded, which a whole batch decodes with one `np.frombuffer`.
+"""
+
+import base64
+import os
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+# pgvector's binary send format: uint16 dimension, uint16 unused, then big-endian floats
+PGVECTOR_HEADER_BYTES = 4
+
+WIRE_DTYPES = {
+    "float32": np.dtype(">f4"),
+    "float16": np.dtype(">f2"),
+}
+
+VECTOR_TRANSPORT_DTYPE = os.getenv("VECTOR_TRANSPORT_DTYPE", "float32")
+
+
+def decode_pgvector_batch(blobs: Sequence[str], dtype: str = VECTOR_TRANSPORT_DTYPE) -> np.ndarray:
+    """
+    Decode base64 `vector_send`/`halfvec_send` blobs into an (n, dim) float32 matrix.
+
+    Args:
+        blobs: One base64 string per row, all with the same dimension
+        dtype: Wire precision, "float32" or "float16"
+
+    Returns:
+        np.ndarray: Native-endian float32 matrix, one row per blob
+    """
+    wire_dtype = WIRE_DTYPES[dtype]
+    if not blobs:
+        return np.zeros((0, 0), dtype=np.float32)
+    raw = b"".join(base64.b64decode(blob) for blob in blobs)
+    header_items = PGVECTOR_HEADER_BYTES // wire_dtype.itemsize
+    matrix = np.frombuffer(raw, dtype=wire_dtype).reshape(len(blobs), -1)
+    return matrix[:, header_items:].astype(np.float32)
+
+
+def encode_pgvector(vector: Sequence[float], dtype: str = VECTOR_TRANSPORT_DTYPE) -> str:
+    """Encode a vector the way `encode(vector_send(...), 'base64')` would (used by the benchmark and local stand-ins)."""
+    values = np.asarray(vector, dtype=WIRE_DTYPES[dtype])
+    header = len(values).to_bytes(2, "big") + b"\x00\x00"
+    return base64.b64encode(header + values.tobytes()).decode("ascii")
+
+
+def split_rows(rows: List[dict], field: str = "embedding_b64") -> Tuple[List[dict], List[str]]:
+    """Separate the binary embedding column from the rest of each row."""
+    blobs = [row[field] for row in rows]
+    records = [{key: value for key, value in row.items() if key != field} for row in rows]
+    return records, blobs
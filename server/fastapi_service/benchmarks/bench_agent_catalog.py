@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Measure the per-request CPU time saved by sharing prebuilt agents instead of
+building a new Agent (and output schema) on every call.
+
+Uses pydantic-ai's offline TestModel, so no Gemini quota is spent:
+    python benchmarks/bench_agent_catalog.py --requests 500 --concurrency 50
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+from typing import List
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pydantic import BaseModel
+from pydantic_ai import Agent
+from pydantic_ai.models.test import TestModel
+
+from app.agents import AADHAAR_AGENT, SIGNATURE_AGENT
+from app.schemas import AadhaarExtractedData
+
+
+async def per_request_agents(model, prompt: str):
+    """The previous behaviour: new Agent per call, signature schema class defined inline."""
+    class SignatureAnalysis(BaseModel):
+        confidence_score: float
+        is_match: bool
+        analysis: str
+        reasoning: str
+
+    aadhaar = Agent(model=model, output_type=List[AadhaarExtractedData], system_prompt=AADHAAR_AGENT._system_prompts)
+    signature = Agent(model=model, output_type=SignatureAnalysis, system_prompt=SIGNATURE_AGENT._system_prompts)
+    await aadhaar.run(prompt)
+    await signature.run(prompt)
+
+
+async def catalog_agents(model, prompt: str):
+    await AADHAAR_AGENT.run(prompt, model=model)
+    await SIGNATURE_AGENT.run(prompt, model=model)
+
+
+async def drive(fn, requests: int, concurrency: int) -> float:
+    model = TestModel()
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one():
+        async with semaphore:
+            await fn(model, "Extract Aadhaar card data")
+
+    start = time.process_time()
+    await asyncio.gather(*(one() for _ in range(requests)))
+    return time.process_time() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=50)
+    args = parser.parse_args()
+
+    # Warm both paths once so imports and first-use caches don't skew the numbers
+    asyncio.run(drive(per_request_agents, 5, 5))
+    asyncio.run(drive(catalog_agents, 5, 5))
+
+    before = asyncio.run(drive(per_request_agents, args.requests, args.concurrency))
+    after = asyncio.run(drive(catalog_agents, args.requests, args.concurrency))
+    print(f"{args.requests} requests (Aadhaar + signature agent each), concurrency {args.concurrency}")
+    print(f"per-request agents: {before / args.requests * 1000:.2f} ms CPU/request")
+    print(f"catalog agents:     {after / args.requests * 1000:.2f} ms CPU/request")
+    print(f"saved:              {(before - after) / args.requests * 1000:.2f} ms CPU/request ({(1 - after / before) * 100:.0f}%)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Evaluate the on-device OTP recognizer on a labelled sample set: accuracy,
+calibration, how many requests would skip Gemini at each confidence threshold
+and per-image CPU latency.
+
+The sample directory holds images and a labels.csv (filename,otp). Without
+--samples a synthetic set is rendered (use a different seed than training):
+    python benchmarks/bench_otp_recognizer.py --samples data/otp_samples
+    python benchmarks/bench_otp_recognizer.py --synthetic 300 --seed 99
+
+The service only uses weights validated on real samples. With --record the
+run on --samples is written into the weights file when at least
+--min-samples photos were evaluated and no more than --max-wrong-rate of them
+got a wrong OTP at or above OTP_LOCAL_CONFIDENCE:
+    python benchmarks/bench_otp_recognizer.py --samples data/otp_samples --record
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import numpy as np
+import torch
+
+from app.otp_recognizer import OTP_LOCAL_CONFIDENCE, OTP_MODEL_PATH, OtpRecognizer, load_labelled_samples, synthetic_otp_image
+
+
+def expected_calibration_error(confidences: np.ndarray, correct: np.ndarray, bins: int = 10) -> float:
+    edges = np.linspace(0, 1, bins + 1)
+    error = 0.0
+    for low, high in zip(edges[:-1], edges[1:]):
+        in_bin = (confidences > low) & (confidences <= high)
+        if in_bin.any():
+            error += in_bin.mean() * abs(confidences[in_bin].mean() - correct[in_bin].mean())
+    return float(error)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--model", default=OTP_MODEL_PATH)
+    parser.add_argument("--samples", help="Directory with labelled OTP photos and labels.csv")
+    parser.add_argument("--synthetic", type=int, default=300, help="Synthetic images when --samples is not given")
+    parser.add_argument("--seed", type=int, default=99)
+    parser.add_argument("--thresholds", default=f"0.5,0.8,0.9,0.95,{OTP_LOCAL_CONFIDENCE},0.99")
+    parser.add_argument("--record", action="store_true", help="Store the validation at OTP_LOCAL_CONFIDENCE in the weights file")
+    parser.add_argument("--min-samples", type=int, default=200)
+    parser.add_argument("--max-wrong-rate", type=float, default=0.002, help="Wrong local answers per evaluated photo")
+    args = parser.parse_args()
+    if args.record and not args.samples:
+        parser.error("--record needs real labelled photos (--samples), synthetic renders don't validate anything")
+
+    recognizer = OtpRecognizer.load(args.model, require_validation=False)
+    if recognizer is None:
+        sys.exit("Train weights first: python -m app.otp_recognizer --output " + args.model)
+
+    if args.samples:
+        samples = load_labelled_samples(args.samples)
+    else:
+        rng = random.Random(args.seed)
+        samples = [synthetic_otp_image(rng) for _ in range(args.synthetic)]
+    encoded = [(cv2.imencode(".jpg", image)[1].tobytes(), otp) for image, otp in samples]
+
+    recognizer.recognize(encoded[0][0])  # warm up torch
+    confidences, correct, latencies = [], [], []
+    for image_bytes, otp in encoded:
+        start = time.perf_counter()
+        result = recognizer.recognize(image_bytes)
+        latencies.append((time.perf_counter() - start) * 1000)
+        confidences.append(result.confidence)
+        correct.append(result.otp == otp)
+    confidences, correct, latencies = np.array(confidences), np.array(correct, float), np.array(latencies)
+
+    print(f"{len(encoded)} images, exact-match accuracy {correct.mean():.3f}, ECE {expected_calibration_error(confidences, correct):.3f}")
+    print(f"latency ms: p50 {np.percentile(latencies, 50):.1f}  p95 {np.percentile(latencies, 95):.1f}  p99 {np.percentile(latencies, 99):.1f}")
+    print(f"{'threshold':>10} {'local':>8} {'accuracy':>10} {'wrong':>7}")
+    for threshold in sorted(float(t) for t in args.thresholds.split(",")):
+        local = confidences >= threshold
+        accuracy = correct[local].mean() if local.any() else float("nan")
+        # Wrong answers returned without Gemini ever seeing the image
+        wrong = int((local & (correct == 0)).sum())
+        print(f"{threshold:>10.3f} {local.mean():>8.1%} {accuracy:>10.3f} {wrong:>7}")
+
+    if args.record:
+        local = confidences >= OTP_LOCAL_CONFIDENCE
+        wrong = int((local & (correct == 0)).sum())
+        if len(encoded) < args.min_samples:
+            sys.exit(f"Not recorded: {len(encoded)} samples, need at least {args.min_samples}")
+        if wrong > args.max_wrong_rate * len(encoded):
+            sys.exit(f"Not recorded: {wrong} wrong local answers at {OTP_LOCAL_CONFIDENCE} in {len(encoded)} samples")
+        checkpoint = torch.load(args.model, map_location="cpu", weights_only=True)
+        checkpoint["validation"] = {
+            "samples": len(encoded),
+            "threshold": OTP_LOCAL_CONFIDENCE,
+            "local_rate": float(local.mean()),
+            "wrong": wrong,
+        }
+        torch.save(checkpoint, args.model)
+        print(f"Recorded validation at {OTP_LOCAL_CONFIDENCE} in {args.model}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+#!/usr/bin/env python3
+"""
+Compare bytes moved and parse time for bulk embedding reads: pgvector JSON text
+versus the base64 binary blobs returned by fetch_policy_embeddings_binary.
+
+Runs offline on synthetic responses shaped like PostgREST output:
+    python benchmarks/bench_vector_transport.py --rows 1000 --dim 1536
+"""
+
+import argparse
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from app.vector_codec import decode_pgvector_batch, encode_pgvector
+
+
+def parse_json_path(body: bytes) -> np.ndarray:
+    """What retrieve_context did before: json.loads each embedding row by row."""
+    rows = json.loads(body)
+    return np.array([np.array(json.loads(row["embedding"]), dtype=np.float32) for row in rows])
+
+
+def parse_binary_path(body: bytes, dtype: str) -> np.ndarray:
+    rows = json.loads(body)
+    return decode_pgvector_batch([row["embedding_b64"] for row in rows], dtype)
+
+
+def best_of(fn, repeat: int) -> float:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return min(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=1000)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(scale=0.05, size=(args.rows, args.dim)).astype(np.float32)
+    meta = {"content": "x" * 1000, "source_file": "RBI-Guidelines.pdf"}
+
+    # pgvector prints the shortest float4 representation, e.g. "[0.012345678,-0.04567891,...]"
+    json_body = json.dumps([
+        dict(meta, embedding="[" + ",".join(str(v) for v in vec) + "]") for vec in vectors
+    ]).encode()
+    bodies = {"json": json_body}
+    for dtype in ("float32", "float16"):
+        bodies[dtype] = json.dumps([
+            dict(meta, embedding_b64=encode_pgvector(vec, dtype)) for vec in vectors
+        ]).encode()
+
+    print(f"{args.rows} rows x {args.dim} dims (each row also carries {len(meta['content'])} chars of content)")
+    print(f"{'transport':<10} {'bytes':>12} {'per vector':>12} {'parse ms':>10} {'max abs err':>12}")
+    for name, body in bodies.items():
+        if name == "json":
+            parse = lambda: parse_json_path(body)
+        else:
+            parse = lambda: parse_binary_path(body, name)
+        matrix = parse()
+        error = float(np.abs(matrix - vectors).max())
+        per_vector = (len(body) - len(json.dumps([meta] * args.rows))) / args.rows
+        print(f"{name:<10} {len(body):>12,} {per_vector:>12,.0f} {best_of(parse, args.repeat) * 1000:>10.1f} {error:>12.2e}")
+
+
+if __name__ == "__main__":
+    main()
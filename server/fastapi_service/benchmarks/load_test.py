@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+"""
+End-to-end load test of the service against local provider stand-ins.
+
+By default this starts the stand-ins (benchmarks/provider_standins.py) and
+the service itself (`run.py --production`) pointed at them, so no real
+Gemini, Bedrock, Supabase or watsonx quota is spent. It then drives a mix of
+requests across the routers and reports throughput, p50/p95/p99 latency and
+error rates per scenario:
+    python benchmarks/load_test.py --duration 60 --concurrency 32
+    python benchmarks/load_test.py --rate 20 --mix ocr_pan=1,signature=3 \\
+        --provider gemini=median:2,burst_every:30,burst_length:3 --output run2.json --compare run1.json
+
+Closed loop (--concurrency virtual users back to back) by default; --rate
+sends requests at a fixed Poisson rate instead, so a slow server can't slow
+the arrivals down. Use --target to load an already running service (then
+provider behaviour is whatever that service is configured against).
+
+Payloads are synthetic: Aadhaar/PAN card photos, a two-page KYC bundle PDF,
+OTP sheet photos, signature pairs and compliance questions, each rendered in
+--variants versions. The extraction cache of the started service is off so
+repeated payloads still reach the providers.
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cv2
+import fitz  # PyMuPDF
+import httpx
+import numpy as np
+
+from app.otp_recognizer import synthetic_otp_image
+from provider_standins import DEFAULT_PROFILES, StandinServer, parse_profile
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_MIX = "ocr_aadhaar=3,ocr_pan=3,ocr_extract=1,otp=2,signature=3,chat=2"
+NAMES = ["Ramesh Kumar", "Anita Sharma", "Priya Nair", "Mohd Irfan", "Kavya Rao", "Deepak Singh"]
+QUESTIONS = [
+    "What documents are acceptable as officially valid documents for KYC?",
+    "How long must transaction records be retained under PMLA?",
+    "When is video based customer identification allowed?",
+    "What is the periodic KYC update schedule for high risk customers?",
+    "Which customers require enhanced due diligence?",
+    "Can an e-Aadhaar be used for KYC of a non-face-to-face customer?",
+]
+
+
+# Synthetic payloads
+
+def _jpeg(image: np.ndarray) -> bytes:
+    return cv2.imencode(".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, 85])[1].tobytes()
+
+
+def _card_photo(rng: random.Random, background: tuple, bands: bool) -> np.ndarray:
+    """A card filling most of a photo of a darker desk, so the page filter finds its outline and ink."""
+    card = np.full((540, 856, 3), background, np.uint8)
+    if bands:
+        card[:70] = (51, 153, 255)  # saffron (BGR)
+        card[-60:] = (50, 160, 40)  # green
+    y = 150
+    for _ in range(5):
+        text = " ".join(rng.choice(NAMES).split()) + f" {rng.randint(1000, 9999)}"
+        cv2.putText(card, text, (260, y), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (30, 30, 30), 2, cv2.LINE_AA)
+        y += 60
+    cv2.rectangle(card, (40, 120), (220, 380), (120, 120, 120), -1)  # photo
+    photo = np.full((680, 1000, 3), (30, 35, 40), np.uint8)
+    top, left = rng.randint(40, 100), rng.randint(40, 100)
+    photo[top:top + 540, left:left + 856] = card
+    noise = np.random.default_rng(rng.randint(0, 2 ** 31)).normal(0, 6, photo.shape)
+    return np.clip(photo + noise, 0, 255).astype(np.uint8)
+
+
+def aadhaar_photo(rng: random.Random) -> bytes:
+    return _jpeg(_card_photo(rng, (250, 250, 250), bands=True))
+
+
+def pan_photo(rng: random.Random) -> bytes:
+    return _jpeg(_card_photo(rng, (235, 215, 170), bands=False))
+
+
+def kyc_bundle(rng: random.Random) -> bytes:
+    document = fitz.open()
+    for image in (aadhaar_photo(rng), pan_photo(rng)):
+        page = document.new_page(width=595, height=842)
+        page.insert_image(fitz.Rect(40, 40, 555, 400), stream=image)
+    return document.tobytes()
+
+
+def signature(rng: random.Random, name: str) -> bytes:
+    image = np.full((300, 900), 255, np.uint8)
+    cv2.putText(image, name, (40 + rng.randint(-10, 10), 180 + rng.randint(-10, 10)), cv2.FONT_HERSHEY_SCRIPT_SIMPLEX,
+                rng.uniform(2.3, 2.7), 0, rng.randint(2, 4), cv2.LINE_AA)
+    matrix = cv2.getRotationMatrix2D((450, 150), rng.uniform(-5, 5), rng.uniform(0.85, 1.15))
+    image = cv2.warpAffine(image, matrix, (900, 300), borderValue=255)
+    return cv2.imencode(".png", image)[1].tobytes()
+
+
+def build_scenarios(variants: int, seed: int) -> Dict[str, List[dict]]:
+    """Per scenario, `variants` prepared requests (as httpx.request keyword arguments)."""
+    rng = random.Random(seed)
+    scenarios = defaultdict(list)
+    for _ in range(variants):
+        scenarios["ocr_aadhaar"].append({"method": "POST", "url": "/ocr/extract-aadhaar",
+                                         "files": {"files": ("aadhaar.jpg", aadhaar_photo(rng), "image/jpeg")}})
+        scenarios["ocr_pan"].append({"method": "POST", "url": "/ocr/extract-pan",
+                                     "files": {"files": ("pan.jpg", pan_photo(rng), "image/jpeg")}})
+        scenarios["ocr_extract"].append({"method": "POST", "url": "/ocr/extract",
+                                         "files": {"files": ("kyc.pdf", kyc_bundle(rng), "application/pdf")}})
+        otp_image, _ = synthetic_otp_image(rng)
+        scenarios["otp"].append({"method": "POST", "url": "/otp/detect",
+                                 "files": {"file": ("otp.jpg", _jpeg(otp_image), "image/jpeg")}})
+        # Mostly genuine pairs, some forgeries (another name)
+        reference = rng.choice(NAMES)
+        probe = reference if rng.random() < 0.7 else rng.choice(NAMES)
+        scenarios["signature"].append({"method": "POST", "url": "/signature/verify", "files": {
+            "signature1": ("reference.png", signature(rng, reference), "image/png"),
+            "signature2": ("probe.png", signature(rng, probe), "image/png"),
+        }})
+        scenarios["chat"].append({"method": "POST", "url": "/chat",
+                                  "json": {"query": rng.choice(QUESTIONS), "top_k": 3}})
+    return scenarios
+
+
+# Driving load
+
+class Recorder:
+    def __init__(self):
+        self.samples: Dict[str, List[tuple]] = defaultdict(list)  # scenario -> (latency seconds, status)
+        self.recording = False
+
+    async def send(self, client: httpx.AsyncClient, scenario: str, request: dict) -> None:
+        start = time.perf_counter()
+        try:
+            response = await client.request(**request)
+            await response.aread()
+            status = str(response.status_code)
+        except httpx.HTTPError as e:
+            status = type(e).__name__
+        if self.recording:
+            self.samples[scenario].append((time.perf_counter() - start, status))
+
+
+def pick(mix: Dict[str, float], scenarios, rng: random.Random):
+    name = rng.choices(list(mix), weights=list(mix.values()))[0]
+    return name, rng.choice(scenarios[name])
+
+
+async def closed_loop(client, recorder, mix, scenarios, concurrency: int, seconds: float, seed: int) -> None:
+    deadline = time.monotonic() + seconds
+
+    async def user(index: int):
+        rng = random.Random(seed + index)
+        while time.monotonic() < deadline:
+            await recorder.send(client, *pick(mix, scenarios, rng))
+
+    await asyncio.gather(*(user(i) for i in range(concurrency)))
+
+
+async def open_loop(client, recorder, mix, scenarios, rate: float, seconds: float, seed: int) -> None:
+    rng = random.Random(seed)
+    deadline = time.monotonic() + seconds
+    tasks = set()
+    while time.monotonic() < deadline:
+        task = asyncio.ensure_future(recorder.send(client, *pick(mix, scenarios, rng)))
+        tasks.add(task)
+        task.add_done_callback(tasks.discard)
+        await asyncio.sleep(rng.expovariate(rate))
+    await asyncio.gather(*tasks)
+
+
+async def drive(args, mix, scenarios) -> Recorder:
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=max(args.concurrency, 100), max_keepalive_connections=max(args.concurrency, 100))
+    async with httpx.AsyncClient(base_url=args.target, timeout=args.timeout, limits=limits) as client:
+        for phase, seconds in (("warmup", args.warmup), ("measure", args.duration)):
+            recorder.recording = phase == "measure"
+            if args.rate:
+                await open_loop(client, recorder, mix, scenarios, args.rate, seconds, args.seed)
+            else:
+                await closed_loop(client, recorder, mix, scenarios, args.concurrency, seconds, args.seed)
+    return recorder
+
+
+# Reporting
+
+def summarize(recorder: Recorder, seconds: float) -> Dict[str, dict]:
+    summary = {}
+    everything = []
+    for scenario, samples in sorted(recorder.samples.items()):
+        everything.extend(samples)
+        summary[scenario] = _stats(samples, seconds)
+    summary["total"] = _stats(everything, seconds)
+    return summary
+
+
+def _stats(samples: List[tuple], seconds: float) -> dict:
+    latencies = np.array([latency for latency, _ in samples]) * 1000
+    statuses = defaultdict(int)
+    for _, status in samples:
+        statuses[status] += 1
+    errors = sum(count for status, count in statuses.items() if not status.startswith(("2", "3")))
+    return {
+        "requests": len(samples),
+        "rps": round(len(samples) / seconds, 2),
+        "p50_ms": round(float(np.percentile(latencies, 50)), 1) if len(samples) else None,
+        "p95_ms": round(float(np.percentile(latencies, 95)), 1) if len(samples) else None,
+        "p99_ms": round(float(np.percentile(latencies, 99)), 1) if len(samples) else None,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "statuses": dict(statuses),
+    }
+
+
+def print_report(summary: Dict[str, dict], previous: Optional[Dict[str, dict]] = None) -> None:
+    print(f"{'scenario':<12} {'requests':>8} {'rps':>8} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'errors':>7}  statuses")
+    for scenario, stats in summary.items():
+        print(f"{scenario:<12} {stats['requests']:>8} {stats['rps']:>8} {stats['p50_ms']!s:>9} {stats['p95_ms']!s:>9} "
+              f"{stats['p99_ms']!s:>9} {stats['error_rate']:>7.1%}  {stats['statuses']}")
+        before = (previous or {}).get(scenario)
+        if before:
+            deltas = []
+            for key in ("rps", "p50_ms", "p95_ms", "p99_ms"):
+                if before.get(key) and stats.get(key) is not None:
+                    deltas.append(f"{key} {100 * (stats[key] - before[key]) / before[key]:+.1f}%")
+            deltas.append(f"errors {100 * (stats['error_rate'] - before['error_rate']):+.1f}pp")
+            print(f"{'':<12} vs previous: {', '.join(deltas)}")
+
+
+# Service under test
+
+def start_service(args, env: Dict[str, str]) -> subprocess.Popen:
+    data_dir = tempfile.mkdtemp(prefix="loadtest-")
+    env = {
+        **os.environ, **env,
+        "SERVER_PORT": str(args.port),
+        "EXTRACTION_CACHE_ENABLED": "false",
+        "OCR_JOBS_DB": os.path.join(data_dir, "jobs.sqlite3"),
+        "SIGNATURE_TEMPLATES_DB": os.path.join(data_dir, "signature_templates.sqlite3"),
+    }
+    command = [sys.executable, "run.py", "--production", "--workers", str(args.workers)]
+    process = subprocess.Popen(command, cwd=SERVICE_DIR, env=env)
+    deadline = time.monotonic() + 120
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            sys.exit(f"Service exited during startup with code {process.returncode}")
+        try:
+            if httpx.get(f"{args.target}/ocr/health", timeout=2).status_code == 200:
+                return process
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    process.terminate()
+    sys.exit("Service did not become healthy within 120 s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--target", help="URL of an already running service; default: start one")
+    parser.add_argument("--port", type=int, default=8800, help="Port for the started service")
+    parser.add_argument("--workers", type=int, default=2, help="Workers of the started service")
+    parser.add_argument("--standin-port", type=int, default=9100)
+    parser.add_argument("--provider", action="append", default=[], help="Stand-in behaviour, name=option:value,... (repeatable)")
+    parser.add_argument("--mix", default=DEFAULT_MIX, help="Scenario weights")
+    parser.add_argument("--concurrency", type=int, default=16, help="Virtual users (closed loop)")
+    parser.add_argument("--rate", type=float, help="Requests per second (open loop) instead of --concurrency")
+    parser.add_argument("--duration", type=float, default=60, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=5, help="Unmeasured seconds before that")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--variants", type=int, default=20, help="Distinct payloads per scenario")
+    parser.add_argument("--seed", type=int, default=7)
+    parser.add_argument("--output", help="Write the summary as JSON, for --compare in a later run")
+    parser.add_argument("--compare", help="Summary JSON of a previous run")
+    args = parser.parse_args()
+
+    mix = {}
+    for item in args.mix.split(","):
+        name, _, weight = item.partition("=")
+        mix[name] = float(weight or 1)
+    scenarios = build_scenarios(args.variants, args.seed)
+    unknown = set(mix) - set(scenarios)
+    if unknown:
+        sys.exit(f"Unknown scenarios {', '.join(sorted(unknown))}, expected {', '.join(scenarios)}")
+
+    standins = service = None
+    try:
+        if args.target is None:
+            profiles = dict(DEFAULT_PROFILES)
+            profiles.update(parse_profile(spec) for spec in args.provider)
+            standins = StandinServer(profiles, port=args.standin_port, seed=args.seed)
+            standins.start()
+            args.target = f"http://127.0.0.1:{args.port}"
+            service = start_service(args, standins.service_env())
+        else:
+            try:
+                httpx.get(f"{args.target}/ocr/health", timeout=5).raise_for_status()
+            except httpx.HTTPError as e:
+                sys.exit(f"Service at {args.target} is not healthy: {e}")
+
+        mode = f"{args.rate}/s open loop" if args.rate else f"{args.concurrency} users closed loop"
+        print(f"Driving {args.target} for {args.duration:.0f}s ({mode}), mix {args.mix}")
+        recorder = asyncio.run(drive(args, mix, scenarios))
+        summary = summarize(recorder, args.duration)
+
+        previous = None
+        if args.compare:
+            with open(args.compare) as f:
+                previous = json.load(f)["summary"]
+        print_report(summary, previous)
+        if standins is not None:
+            print("provider calls:", httpx.get(f"{standins.url}/standins/stats").json())
+        if args.output:
+            with open(args.output, "w") as f:
+                json.dump({"args": vars(args), "summary": summary}, f, indent=2)
+    finally:
+        if service is not None:
+            service.terminate()
+            service.wait()
+        if standins is not None:
+            standins.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,353 @@
+#!/usr/bin/env python3
+"""
+Local stand-ins for the Gemini, Bedrock, Supabase and watsonx APIs, for load
+tests that must not spend real quota.
+
+One server answers the REST calls the service makes to all four providers:
+- Gemini: POST /v1beta/models/{model}:generateContent, answered with a
+  function call whose arguments are generated from the requested output
+  schema (valid Aadhaar/PAN numbers, dates, OTPs, scores, ...)
+- Bedrock: POST /model/{model_id}/invoke (Titan embeddings)
+- Supabase (PostgREST): /rest/v1/rpc/similarity_search and table reads
+- watsonx: IAM token, foundation model specs and /ml/v1/text/generation
+
+Each provider has its own behaviour: a lognormal latency (median and sigma),
+a rate of 5xx errors, and 429 bursts (for `burst_length` seconds out of every
+`burst_every` seconds every call is rejected, like an exhausted quota):
+    python benchmarks/provider_standins.py --port 9100 \\
+        --provider gemini=median:1.5,sigma:0.6,errors:0.01,burst_every:60,burst_length:5
+
+Point the service at it with (see app/clients.py):
+    GEMINI_BASE_URL=http://127.0.0.1:9100/v1beta/models/
+    BEDROCK_ENDPOINT_URL=http://127.0.0.1:9100
+    SUPABASE_URL=http://127.0.0.1:9100   IBM_URL=http://127.0.0.1:9100
+benchmarks/load_test.py starts it for you.
+"""
+
+import argparse
+import asyncio
+import hashlib
+import math
+import random
+import sys
+import threading
+import time
+from dataclasses import dataclass, fields
+from typing import Dict, Optional
+
+import numpy as np
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+EMBEDDING_DIM = 1536
+
+
+@dataclass
+class ProviderProfile:
+    median: float = 0.05  # seconds
+    sigma: float = 0.4  # lognormal shape: ~p99 = median * exp(2.33 * sigma)
+    errors: float = 0.0  # fraction of calls answered with a 5xx
+    burst_every: float = 0.0  # seconds between the starts of 429 bursts, 0 for none
+    burst_length: float = 0.0  # seconds each burst lasts
+
+    def latency(self, rng: random.Random) -> float:
+        return self.median * math.exp(self.sigma * rng.gauss(0, 1))
+
+    def in_burst(self, elapsed: float) -> bool:
+        return self.burst_every > 0 and elapsed % self.burst_every < self.burst_length
+
+
+# Roughly what the real providers look like from India-region hosts
+DEFAULT_PROFILES = {
+    "gemini": ProviderProfile(median=1.2, sigma=0.5),
+    "bedrock": ProviderProfile(median=0.08, sigma=0.3),
+    "supabase": ProviderProfile(median=0.05, sigma=0.3),
+    "watsonx": ProviderProfile(median=2.5, sigma=0.6),
+}
+
+
+def parse_profile(spec: str) -> tuple:
+    """"gemini=median:1.5,errors:0.01" -> ("gemini", ProviderProfile(...))"""
+    name, _, options = spec.partition("=")
+    if name not in DEFAULT_PROFILES:
+        raise ValueError(f"Unknown provider {name}, expected one of {', '.join(DEFAULT_PROFILES)}")
+    known = {field.name for field in fields(ProviderProfile)}
+    values = {}
+    for option in filter(None, options.split(",")):
+        key, _, value = option.partition(":")
+        if key not in known:
+            raise ValueError(f"Unknown option {key} for {name}, expected one of {', '.join(sorted(known))}")
+        values[key] = float(value)
+    defaults = DEFAULT_PROFILES[name]
+    return name, ProviderProfile(**{**defaults.__dict__, **values})
+
+
+# Output generation for Gemini function calls
+
+VERHOEFF_D = [
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9], [1, 2, 3, 4, 0, 6, 7, 8, 9, 5], [2, 3, 4, 0, 1, 7, 8, 9, 5, 6],
+    [3, 4, 0, 1, 2, 8, 9, 5, 6, 7], [4, 0, 1, 2, 3, 9, 5, 6, 7, 8], [5, 9, 8, 7, 6, 0, 4, 3, 2, 1],
+    [6, 5, 9, 8, 7, 1, 0, 4, 3, 2], [7, 6, 5, 9, 8, 2, 1, 0, 4, 3], [8, 7, 6, 5, 9, 3, 2, 1, 0, 4],
+    [9, 8, 7, 6, 5, 4, 3, 2, 1, 0],
+]
+VERHOEFF_P = [
+    [0, 1, 2, 3, 4, 5, 6, 7, 8, 9], [1, 5, 7, 6, 2, 8, 3, 0, 9, 4], [5, 8, 0, 3, 7, 9, 6, 1, 4, 2],
+    [8, 9, 1, 6, 0, 4, 3, 5, 2, 7], [9, 4, 5, 3, 1, 2, 6, 8, 7, 0], [4, 2, 8, 6, 5, 7, 3, 9, 0, 1],
+    [2, 7, 9, 3, 8, 0, 6, 4, 1, 5], [7, 0, 4, 6, 9, 1, 3, 2, 5, 8],
+]
+VERHOEFF_INV = [0, 4, 3, 2, 1, 5, 6, 7, 8, 9]
+
+
+def aadhaar_number(rng: random.Random) -> str:
+    digits = [rng.randint(2, 9)] + [rng.randint(0, 9) for _ in range(10)]
+    check = 0
+    for i, digit in enumerate(reversed(digits)):
+        check = VERHOEFF_D[check][VERHOEFF_P[(i + 1) % 8][digit]]
+    number = "".join(map(str, digits)) + str(VERHOEFF_INV[check])
+    return f"{number[:4]} {number[4:8]} {number[8:]}"
+
+
+def pan_number(rng: random.Random) -> str:
+    letters = "ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+    return (
+        "".join(rng.choice(letters) for _ in range(3)) + "P" + rng.choice(letters)
+        + f"{rng.randint(0, 9999):04d}" + rng.choice(letters)
+    )
+
+
+FIELD_VALUES = {
+    "aadhaar_number": aadhaar_number,
+    "pan_number": pan_number,
+    "permanent_account_number": pan_number,
+    "date_of_birth": lambda rng: f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(1950, 2004)}",
+    "pin_code": lambda rng: str(rng.randint(110001, 855999)),
+    "gender": lambda rng: rng.choice(["Male", "Female"]),
+    "otp": lambda rng: f"{rng.randint(0, 999999):06d}",
+    "full_name": lambda rng: rng.choice(["Ramesh Kumar", "Anita Sharma", "Priya Nair", "Mohd Irfan"]),
+    "father_name": lambda rng: rng.choice(["Suresh Kumar", "Rajesh Sharma", "K. Nair", "Mohd Salim"]),
+    "address": lambda rng: f"{rng.randint(1, 200)}, MG Road, Bengaluru, Karnataka",
+    "state": lambda rng: "Karnataka",
+    "district": lambda rng: "Bengaluru Urban",
+    "phone_number": lambda rng: f"9{rng.randint(0, 999999999):09d}",
+    "email": lambda rng: None,
+    "is_match": lambda rng: rng.random() < 0.8,
+}
+
+
+def sample_from_schema(schema: dict, rng: random.Random, name: str = ""):
+    """A plausible value for a (Gemini-flavoured) JSON schema, using the property name as a hint."""
+    if name in FIELD_VALUES:
+        return FIELD_VALUES[name](rng)
+    if "anyOf" in schema or "any_of" in schema:
+        options = [option for option in schema.get("anyOf", schema.get("any_of")) if option.get("type") != "null"]
+        return sample_from_schema(options[0], rng, name) if options else None
+    kind = str(schema.get("type", "object")).lower()
+    if kind == "object":
+        return {key: sample_from_schema(value, rng, key) for key, value in schema.get("properties", {}).items()}
+    if kind == "array":
+        return [sample_from_schema(schema.get("items", {}), rng, name)]
+    if kind in ("number", "integer"):
+        value = rng.uniform(0.6, 0.99) if "confidence" in name or "score" in name else rng.uniform(0, 100)
+        return round(value, 3) if kind == "number" else int(value)
+    if kind == "boolean":
+        return rng.random() < 0.5
+    if schema.get("enum"):
+        return rng.choice(schema["enum"])
+    return f"Sample {name.replace('_', ' ')}".strip()
+
+
+def embedding(text: str) -> list:
+    """Deterministic unit vector per text, so identical queries embed identically."""
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "big")
+    vector = np.random.default_rng(seed).normal(size=EMBEDDING_DIM).astype(np.float32)
+    return (vector / np.linalg.norm(vector)).round(6).tolist()
+
+
+POLICY_SNIPPETS = [
+    ("RBI-KYC-Master-Direction.pdf", "Regulated entities shall undertake customer due diligence at account opening ..."),
+    ("PMLA-Rules.pdf", "Every reporting entity shall maintain records of all transactions for five years ..."),
+    ("RBI-Digital-Lending.pdf", "Video based customer identification process may be used with informed consent ..."),
+]
+
+
+def build_app(profiles: Dict[str, ProviderProfile], seed: Optional[int] = None) -> FastAPI:
+    app = FastAPI(title="Provider stand-ins")
+    rng = random.Random(seed)
+    started = time.monotonic()
+    counts: Dict[str, Dict[str, int]] = {name: {"ok": 0, "errors": 0, "throttled": 0} for name in profiles}
+
+    async def behave(provider: str) -> Optional[JSONResponse]:
+        """Sleep for the provider's latency, then maybe fail; None means answer normally."""
+        profile = profiles[provider]
+        await asyncio.sleep(profile.latency(rng))
+        if profile.in_burst(time.monotonic() - started):
+            counts[provider]["throttled"] += 1
+            body = {"error": {"code": 429, "message": "Resource has been exhausted (e.g. check quota).", "status": "RESOURCE_EXHAUSTED"}}
+            return JSONResponse(body, status_code=429)
+        if rng.random() < profile.errors:
+            counts[provider]["errors"] += 1
+            return JSONResponse({"error": {"code": 503, "message": "The service is currently unavailable.", "status": "UNAVAILABLE"}}, status_code=503)
+        counts[provider]["ok"] += 1
+        return None
+
+    @app.get("/standins/stats")
+    async def stats():
+        return counts
+
+    # Gemini
+
+    @app.get("/v1beta/models/")
+    async def gemini_models():
+        return {"models": []}
+
+    @app.post("/v1beta/models/{model_action}")
+    async def gemini_generate(model_action: str, request: Request):
+        body = await request.json()
+        failure = await behave("gemini")
+        if failure is not None:
+            return failure
+        tools = body.get("tools") or {}
+        if isinstance(tools, list):
+            tools = tools[0] if tools else {}
+        declarations = tools.get("function_declarations") or tools.get("functionDeclarations") or []
+        if declarations:
+            declaration = declarations[0]
+            part = {"functionCall": {"name": declaration["name"], "args": sample_from_schema(declaration.get("parameters", {}), rng)}}
+        else:
+            part = {"text": "Sample answer."}
+        return {
+            "candidates": [{"content": {"role": "model", "parts": [part]}, "finishReason": "STOP", "index": 0}],
+            "usageMetadata": {"promptTokenCount": 1000, "candidatesTokenCount": 100, "totalTokenCount": 1100},
+            "modelVersion": model_action.split(":")[0],
+        }
+
+    # Bedrock
+
+    @app.post("/model/{model_id}/invoke")
+    async def bedrock_invoke(model_id: str, request: Request):
+        body = await request.json()
+        failure = await behave("bedrock")
+        if failure is not None:
+            if failure.status_code == 429:
+                return JSONResponse({"message": "Too many requests, please wait before trying again."}, status_code=429,
+                                    headers={"x-amzn-ErrorType": "ThrottlingException"})
+            return JSONResponse({"message": "Internal server error"}, status_code=500,
+                                headers={"x-amzn-ErrorType": "InternalServerException"})
+        text = body.get("inputText", "")
+        return {"embedding": embedding(text), "inputTextTokenCount": len(text.split())}
+
+    # Supabase (PostgREST)
+
+    @app.post("/rest/v1/rpc/{function}")
+    async def supabase_rpc(function: str, request: Request):
+        params = await request.json()
+        failure = await behave("supabase")
+        if failure is not None:
+            return JSONResponse({"code": "PGRST000", "message": "upstream error"}, status_code=failure.status_code)
+        if function != "similarity_search":
+            # Bulk exports (replica sync, fallbacks) come back empty: the chat path under test is the RPC
+            return []
+        return [
+            {"id": i + 1, "source_file": source, "content": content, "similarity": round(0.9 - 0.05 * i, 3)}
+            for i, (source, content) in enumerate(POLICY_SNIPPETS[:params.get("match_count", 3)])
+        ]
+
+    @app.get("/rest/v1/{table}")
+    async def supabase_table(table: str):
+        failure = await behave("supabase")
+        if failure is not None:
+            return JSONResponse({"code": "PGRST000", "message": "upstream error"}, status_code=failure.status_code)
+        return []
+
+    # watsonx
+
+    @app.post("/identity/token")
+    async def iam_token():
+        now = int(time.time())
+        return {"access_token": "standin-token", "refresh_token": "standin-refresh", "token_type": "Bearer",
+                "expires_in": 3600, "expiration": now + 3600}
+
+    @app.get("/ml/v1/foundation_model_specs")
+    async def watsonx_specs():
+        return {"total_count": 1, "resources": [{"model_id": "meta-llama/llama-2-13b-chat", "functions": [{"id": "text_generation"}]}]}
+
+    @app.post("/ml/v1/text/generation")
+    async def watsonx_generate(request: Request):
+        body = await request.json()
+        failure = await behave("watsonx")
+        if failure is not None:
+            return JSONResponse({"errors": [{"code": "rate_limit" if failure.status_code == 429 else "internal_error",
+                                             "message": "stand-in failure"}]}, status_code=failure.status_code)
+        tokens = int((body.get("parameters") or {}).get("max_new_tokens", 128))
+        return {
+            "model_id": body.get("model_id"),
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S.000Z", time.gmtime()),
+            "results": [{
+                "generated_text": " ".join(["compliance"] * tokens),
+                "generated_token_count": tokens,
+                "input_token_count": len(str(body.get("input", "")).split()),
+                "stop_reason": "max_tokens",
+            }],
+        }
+
+    return app
+
+
+class StandinServer:
+    """Runs the stand-ins in a background thread (used by load_test.py)."""
+
+    def __init__(self, profiles: Dict[str, ProviderProfile], host: str = "127.0.0.1", port: int = 9100, seed: Optional[int] = None):
+        config = uvicorn.Config(build_app(profiles, seed), host=host, port=port, log_level="warning")
+        self.server = uvicorn.Server(config)
+        self.url = f"http://{host}:{port}"
+        self._thread = threading.Thread(target=self.server.run, daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+        while not self.server.started:
+            if not self._thread.is_alive():
+                raise RuntimeError("Stand-in server failed to start")
+            time.sleep(0.05)
+
+    def stop(self) -> None:
+        self.server.should_exit = True
+        self._thread.join()
+
+    def service_env(self) -> Dict[str, str]:
+        """Environment that points the service at these stand-ins."""
+        return {
+            "GEMINI_API_KEY": "standin",
+            "GEMINI_BASE_URL": f"{self.url}/v1beta/models/",
+            "BEDROCK_ENDPOINT_URL": self.url,
+            "AWS_REGION": "ap-south-1",
+            "AWS_ACCESS_KEY_ID": "standin",
+            "AWS_SECRET_ACCESS_KEY": "standin",
+            "SUPABASE_URL": self.url,
+            "SUPABASE_ANON_KEY": "standin",
+            "IBM_URL": self.url,
+            "IBM_API_KEY": "standin",
+            "IBM_PROJECT_ID": "standin",
+        }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--provider", action="append", default=[], help="name=option:value,... (repeatable)")
+    parser.add_argument("--seed", type=int)
+    args = parser.parse_args()
+
+    profiles = dict(DEFAULT_PROFILES)
+    try:
+        profiles.update(parse_profile(spec) for spec in args.provider)
+    except ValueError as e:
+        sys.exit(str(e))
+    for name, profile in profiles.items():
+        print(f"{name}: {profile}")
+    uvicorn.run(build_app(profiles, args.seed), host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
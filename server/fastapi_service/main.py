@@ -1,11 +1,34 @@
-from fastapi import FastAPI
+import time
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
-from app.routers import ocr, signature, otp, chatbot
+from app.routers import ocr, jobs, signature, otp, chatbot, metrics
+from app.metrics import REQUEST_LATENCY, PAYLOAD_BYTES
+from app.clients import ClientRegistry
+from app.request_stats import begin_request_stats
+from app.utils import begin_gemini_slots
+from app.deadlines import DeadlineMiddleware
+from app.profiling import ProfilingMiddleware
+from app.uploads import BodySizeLimitMiddleware
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Build the pooled provider clients once per worker and close them on shutdown."""
+    clients = ClientRegistry()
+    await clients.start()
+    app.state.clients = clients
+    try:
+        yield
+    finally:
+        await clients.close()
+
 
 app = FastAPI(
     title="Document OCR & Signature Verification API",
     description="API for extracting information from Indian government documents like Aadhaar and PAN cards, verifying signatures, and detecting OTP from images",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 # Allow CORS from local development servers (Next.js)
@@ -14,15 +37,66 @@ origins = [
     "http://127.0.0.1:3000"
 ]
 
+# Browsers only let the frontend read response headers listed here; keep in step with `record_stat` calls
+stats_headers = [
+    "X-Bytes-Skipped",
+    "X-Cache-Hits",
+    "X-Cache-Misses",
+    "X-Fields-Reextracted",
+    "X-Gemini-Latency-Ms",
+    "X-LLM-Calls-Avoided",
+    "X-OTP-Local",
+    "X-Pages-Rerendered",
+    "X-Pages-Skipped",
+    "X-Pages-Unclassified",
+    "X-Upload-Bytes-Original",
+    "X-Upload-Bytes-Sent",
+    "X-Profile-Id",
+]
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=origins,
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=stats_headers,
 )
 
+# Oversized bodies fail on their first read instead of being spooled by the multipart parser.
+# Inside the metrics middleware: its receive wrapper would turn the 413 into a 400.
+app.add_middleware(BodySizeLimitMiddleware)
+
+
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Record end-to-end latency and request body size per matched route, and expose per-request stats as headers."""
+    start = time.perf_counter()
+    status = 500
+    stats = begin_request_stats()
+    # One budget for every Gemini call the request makes, however its pages and files fan out
+    begin_gemini_slots()
+    try:
+        response = await call_next(request)
+        status = response.status_code
+        response.headers.update(stats.headers())
+        return response
+    finally:
+        # Label by route template rather than raw path to keep label cardinality bounded
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        REQUEST_LATENCY.observe(time.perf_counter() - start, method=request.method, route=route, status=str(status))
+        content_length = request.headers.get("content-length")
+        if content_length and content_length.isdigit():
+            PAYLOAD_BYTES.observe(int(content_length), stage=route, direction="from_client")
+
+# Outside everything else, so a client disconnect cancels everything below it
+app.add_middleware(DeadlineMiddleware)
+# Opt-in (PROFILING_TOKEN / PROFILING_SAMPLE_RATE); outermost so the profile covers the whole request
+app.add_middleware(ProfilingMiddleware)
+
 app.include_router(ocr.router)
+app.include_router(jobs.router)
 app.include_router(signature.router)
 app.include_router(otp.router)
 app.include_router(chatbot.router)
+app.include_router(metrics.router)
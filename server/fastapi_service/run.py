@@ -1,43 +1,175 @@
 #!/usr/bin/env python3
 """
 Run script for the FastAPI OCR service.
-This script starts the FastAPI server with uvicorn.
+
+Development (default): one uvicorn process that reloads on code changes.
+    python run.py
+
+Production: several worker processes, no file watching.
+    python run.py --production          (or RUN_MODE=production)
+
+In production the service runs under gunicorn when it is installed: the app
+is imported once before forking (preload), so the workers share the memory
+of the loaded libraries and models. Workers are recycled after
+SERVER_MAX_REQUESTS requests (with jitter, so they don't all restart at
+once), and on shutdown each worker gets SERVER_GRACEFUL_TIMEOUT seconds to
+finish in-flight requests, including LLM calls, before it is killed.
+Without gunicorn, uvicorn's own multi-process mode is used (no preloading).
+uvloop and httptools are used when they are installed.
+
+Provider clients, the job queue and caches are created per worker in the
+app's lifespan, after the fork, so no connection is shared across processes.
 """
 
-import uvicorn
+import argparse
+import importlib.util
 import os
+
+import uvicorn
 from dotenv import load_dotenv
 
 # Load environment variables
 load_dotenv()
 
-def main():
-    """Start the FastAPI server."""
-    # Check if API key is available
-    api_key = os.getenv("GEMINI_API_KEY")
-    if not api_key:
-        print("❌ Error: GEMINI_API_KEY not found in environment variables")
-        print("Please create a .env file with your Gemini API key:")
-        print("GEMINI_API_KEY=your_api_key_here")
-        return
-    
-    print("🚀 Starting OCR Document Extraction API...")
+RUN_MODE = os.getenv("RUN_MODE", "development")
+SERVER_HOST = os.getenv("SERVER_HOST", "0.0.0.0")
+SERVER_PORT = int(os.getenv("SERVER_PORT", "8000"))
+# WEB_CONCURRENCY is the usual name for the worker count on PaaS hosts
+SERVER_WORKERS = int(os.getenv("WEB_CONCURRENCY", "0")) or os.cpu_count() or 1
+SERVER_MAX_REQUESTS = int(os.getenv("SERVER_MAX_REQUESTS", "2000"))
+SERVER_MAX_REQUESTS_JITTER = int(os.getenv("SERVER_MAX_REQUESTS_JITTER", "200"))
+# Longer than HTTP_TIMEOUT_SECONDS so a provider call that has started can still complete
+SERVER_GRACEFUL_TIMEOUT = int(os.getenv("SERVER_GRACEFUL_TIMEOUT", "130"))
+# A worker that doesn't report to the gunicorn master for this long is restarted
+SERVER_WORKER_TIMEOUT = int(os.getenv("SERVER_WORKER_TIMEOUT", "180"))
+SERVER_KEEPALIVE = int(os.getenv("SERVER_KEEPALIVE", "5"))
+
+
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def event_loop() -> str:
+    return "uvloop" if _installed("uvloop") else "asyncio"
+
+
+def http_protocol() -> str:
+    return "httptools" if _installed("httptools") else "h11"
+
+
+def share_cpus(workers: int) -> None:
+    """
+    Split the CPUs between workers instead of letting every worker size its pools for the whole machine.
+
+    Only defaults are set; explicit settings in the environment win. Must run
+    before the app (and torch) is imported.
+    """
+    per_worker = str(max(1, (os.cpu_count() or 1) // workers))
+    os.environ.setdefault("RASTER_WORKERS", per_worker)
+    os.environ.setdefault("OMP_NUM_THREADS", per_worker)
+
+
+def print_banner(mode: str) -> None:
+    print(f"🚀 Starting OCR Document Extraction API ({mode})...")
     print("📋 Supported formats: Images (PNG, JPEG, WEBP) and PDFs")
     print("🔗 API endpoints:")
-    print("   - POST /ocr/extract - Extract from images/PDFs")
-    print("   - POST /ocr/extract-pdf - PDF-only with custom DPI")
+    print("   - POST /ocr/extract - Mixed Aadhaar/PAN bundles, each page routed by local classification")
+    print("   - POST /ocr/extract-aadhaar - Aadhaar cards from images/PDFs (?progressive, min_dpi, max_dpi)")
+    print("   - POST /ocr/extract-pan - PAN cards from images/PDFs (?progressive, min_dpi, max_dpi)")
     print("   - GET /ocr/health - Health check")
-    print("📖 Documentation will be available at: http://localhost:8000/docs")
+    print(f"📖 Documentation will be available at: http://localhost:{SERVER_PORT}/docs")
     print("-" * 60)
-    
-    # Start the server
+
+
+def run_development() -> None:
     uvicorn.run(
         "main:app",
-        host="0.0.0.0",
-        port=8000,
+        host=SERVER_HOST,
+        port=SERVER_PORT,
         reload=True,  # Auto-reload on code changes
         log_level="info"
     )
 
+
+def run_gunicorn(workers: int) -> None:
+    from gunicorn.app.base import BaseApplication
+
+    if _installed("uvicorn_worker"):
+        from uvicorn_worker import UvicornWorker
+    else:
+        from uvicorn.workers import UvicornWorker
+
+    class Worker(UvicornWorker):
+        CONFIG_KWARGS = {**UvicornWorker.CONFIG_KWARGS, "loop": event_loop(), "http": http_protocol()}
+
+    class Application(BaseApplication):
+        def load_config(self):
+            settings = {
+                "bind": f"{SERVER_HOST}:{SERVER_PORT}",
+                "workers": workers,
+                "worker_class": Worker,
+                "preload_app": True,
+                "max_requests": SERVER_MAX_REQUESTS,
+                "max_requests_jitter": SERVER_MAX_REQUESTS_JITTER,
+                "graceful_timeout": SERVER_GRACEFUL_TIMEOUT,
+                "timeout": SERVER_WORKER_TIMEOUT,
+                "keepalive": SERVER_KEEPALIVE,
+                "loglevel": "info",
+            }
+            for key, value in settings.items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            from main import app
+            return app
+
+    Application().run()
+
+
+def run_uvicorn_workers(workers: int) -> None:
+    # No preloading or jitter here: every worker imports the app itself and restarts after exactly max requests
+    uvicorn.run(
+        "main:app",
+        host=SERVER_HOST,
+        port=SERVER_PORT,
+        workers=workers,
+        loop=event_loop(),
+        http=http_protocol(),
+        limit_max_requests=SERVER_MAX_REQUESTS,
+        timeout_graceful_shutdown=SERVER_GRACEFUL_TIMEOUT,
+        timeout_keep_alive=SERVER_KEEPALIVE,
+        log_level="info"
+    )
+
+
+def main():
+    """Start the FastAPI server."""
+    parser = argparse.ArgumentParser(description="Run the OCR & signature verification API")
+    parser.add_argument("--production", action="store_true", default=RUN_MODE == "production",
+                        help="Multiple workers without auto-reload (default from RUN_MODE)")
+    parser.add_argument("--workers", type=int, default=SERVER_WORKERS, help="Worker processes in production mode")
+    args = parser.parse_args()
+
+    # Check if API key is available
+    api_key = os.getenv("GEMINI_API_KEY")
+    if not api_key:
+        print("❌ Error: GEMINI_API_KEY not found in environment variables")
+        print("Please create a .env file with your Gemini API key:")
+        print("GEMINI_API_KEY=your_api_key_here")
+        return
+
+    if not args.production:
+        print_banner("development, auto-reload")
+        run_development()
+        return
+
+    share_cpus(args.workers)
+    server = "gunicorn" if _installed("gunicorn") else "uvicorn"
+    print_banner(f"production, {args.workers} {server} workers, {event_loop()}/{http_protocol()}")
+    if server == "gunicorn":
+        run_gunicorn(args.workers)
+    else:
+        run_uvicorn_workers(args.workers)
+
 if __name__ == "__main__":
     main()
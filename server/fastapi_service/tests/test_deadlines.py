@@ -0,0 +1,186 @@
+"""
+Unit tests for request deadlines and hedged provider calls in app/deadlines.py.
+
+Run from server/fastapi_service with:
+
+    python -m pytest tests
+"""
+
+import asyncio
+
+import pytest
+
+from app import deadlines
+from app.deadlines import DeadlineExceeded, DeadlineMiddleware, HedgeBudget, call_with_deadline, remaining, set_deadline
+
+
+@pytest.fixture
+def hedging(monkeypatch):
+    """Hedge every call still running after 20 ms, with budget for every hedge."""
+    monkeypatch.setattr(deadlines, "HEDGING_ENABLED", True)
+    monkeypatch.setattr(deadlines, "_windows", {})
+    monkeypatch.setattr(deadlines, "_budget", HedgeBudget(ratio=1.0))
+    window = deadlines._window("test")
+    window.samples.extend([0.02] * deadlines.HEDGE_MIN_SAMPLES)
+
+
+def attempts(*behaviours):
+    """A provider call whose n-th invocation sleeps, then returns or raises, as `behaviours[n]` says."""
+    started = []
+    cancelled = []
+
+    async def call():
+        index = len(started)
+        started.append(index)
+        delay, outcome = behaviours[index]
+        try:
+            await asyncio.sleep(delay)
+        except asyncio.CancelledError:
+            cancelled.append(index)
+            raise
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return call, started, cancelled
+
+
+def test_hedge_wins_when_primary_is_slow(hedging):
+    call, started, cancelled = attempts((5, "primary"), (0, "hedge"))
+
+    async def run():
+        result = await call_with_deadline("test", call)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == "hedge"
+    assert started == [0, 1]
+    assert cancelled == [0]
+
+
+def test_primary_wins_over_hedge(hedging):
+    call, started, cancelled = attempts((0.1, "primary"), (5, "hedge"))
+
+    async def run():
+        result = await call_with_deadline("test", call)
+        await asyncio.sleep(0)
+        return result
+
+    assert asyncio.run(run()) == "primary"
+    assert started == [0, 1]
+    assert cancelled == [1]
+
+
+def test_no_hedge_when_disabled_for_the_call(hedging):
+    call, started, _ = attempts((0.1, "primary"))
+    assert asyncio.run(call_with_deadline("test", call, hedge=False)) == "primary"
+    assert started == [0]
+
+
+def test_every_attempt_failing_raises_the_failure(hedging):
+    call, started, _ = attempts((0.1, ValueError("primary")), (0, ValueError("hedge")))
+    with pytest.raises(ValueError):
+        asyncio.run(call_with_deadline("test", call))
+    assert started == [0, 1]
+
+
+def test_deadline_running_out_cancels_the_call():
+    call, started, cancelled = attempts((5, "late"))
+
+    async def run():
+        set_deadline(0.05)
+        try:
+            await call_with_deadline("test", call)
+        finally:
+            await asyncio.sleep(0)
+
+    with pytest.raises(DeadlineExceeded) as raised:
+        asyncio.run(run())
+    assert raised.value.status_code == 504
+    assert cancelled == [0]
+
+
+def test_expired_deadline_skips_the_call():
+    call, started, _ = attempts((0, "never"))
+
+    async def run():
+        set_deadline(-1)
+        await call_with_deadline("test", call)
+
+    with pytest.raises(DeadlineExceeded):
+        asyncio.run(run())
+    assert started == []
+
+
+def test_hedge_budget_caps_hedges():
+    budget = HedgeBudget(ratio=0.5, burst=1.0)
+    assert not budget.spend()
+    budget.earn()
+    assert not budget.spend()
+    budget.earn()
+    budget.earn()  # capped at the burst
+    assert budget.spend()
+    assert not budget.spend()
+
+
+def http_scope(headers=()):
+    return {"type": "http", "method": "POST", "path": "/", "headers": list(headers)}
+
+
+def test_middleware_cancels_handler_on_disconnect():
+    handler_cancelled = asyncio.Event()
+
+    async def app(scope, receive, send):
+        await receive()
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            handler_cancelled.set()
+            raise
+
+    async def run():
+        messages = [{"type": "http.request", "body": b"{}", "more_body": False}, {"type": "http.disconnect"}]
+
+        async def receive():
+            if len(messages) == 1:
+                await asyncio.sleep(0.05)
+            return messages.pop(0)
+
+        async def send(message):
+            pass
+
+        await asyncio.wait_for(DeadlineMiddleware(app)(http_scope(), receive, send), timeout=2)
+
+    asyncio.run(run())
+    assert handler_cancelled.is_set()
+
+
+def deadline_seen_by_handler(headers):
+    seen = []
+
+    async def app(scope, receive, send):
+        seen.append(remaining())
+
+    async def receive():
+        return {"type": "http.request", "body": b"", "more_body": False}
+
+    async def send(message):
+        pass
+
+    asyncio.run(DeadlineMiddleware(app)(http_scope(headers), receive, send))
+    return seen[0]
+
+
+def test_middleware_uses_client_deadline_header():
+    assert deadline_seen_by_handler([(b"x-request-timeout-ms", b"5000")]) == pytest.approx(5, abs=0.5)
+
+
+def test_middleware_ignores_malformed_deadline_header():
+    default = deadlines.REQUEST_DEADLINE_SECONDS
+    for value in (b"soon", b"nan", b"inf", b"-100", b"0"):
+        assert deadline_seen_by_handler([(b"x-request-timeout-ms", value)]) == pytest.approx(default, abs=0.5), value
+
+
+def test_middleware_caps_client_deadline():
+    cap = deadlines.REQUEST_MAX_DEADLINE_SECONDS
+    assert deadline_seen_by_handler([(b"x-request-timeout-ms", str(cap * 10_000).encode())]) == pytest.approx(cap, abs=0.5)
@@ -0,0 +1,111 @@
+"""
+Unit tests for enrolled signature templates in app/signature_store.py.
+
+Run from server/fastapi_service with:
+
+    python -m pytest tests
+"""
+
+import asyncio
+
+import cv2
+import numpy as np
+import pytest
+
+from app.signature_store import SignatureStore
+
+
+def signature(name: str, thickness: int = 3) -> bytes:
+    image = np.full((300, 900), 255, np.uint8)
+    cv2.putText(image, name, (40, 180), cv2.FONT_HERSHEY_SCRIPT_SIMPLEX, 2.5, 0, thickness, cv2.LINE_AA)
+    return cv2.imencode(".png", image)[1].tobytes()
+
+
+def blank() -> bytes:
+    return cv2.imencode(".png", np.full((300, 900), 255, np.uint8))[1].tobytes()
+
+
+class FakeVerifier:
+    """Stands in for SignatureVerifier; records the pairs that would go to Gemini."""
+
+    def __init__(self):
+        self.calls = []
+
+    async def verify_signatures(self, first, second, score=None, normalized=False):
+        self.calls.append((first, second, score, normalized))
+        return score, score >= 0.5, "fake"
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = SignatureStore(str(tmp_path / "templates.sqlite3"))
+    asyncio.run(store.start())
+    return store
+
+
+def test_enroll_and_list(store):
+    ids = asyncio.run(store.enroll("ramesh", [signature("Ramesh Kumar"), signature("Ramesh Kumar", 2)], label="branch"))
+    assert len(ids) == 2
+    templates = asyncio.run(store.templates("ramesh"))
+    assert [template["template_id"] for template in templates] == ids
+    assert all(template["label"] == "branch" for template in templates)
+    assert asyncio.run(store.templates("nobody")) == []
+
+
+def test_enroll_rejects_image_without_signature(store):
+    with pytest.raises(ValueError):
+        asyncio.run(store.enroll("ramesh", [signature("Ramesh Kumar"), blank()]))
+    # Nothing is stored when any specimen is unusable
+    assert asyncio.run(store.templates("ramesh")) == []
+
+
+def test_verify_uses_one_call_against_the_best_template(store):
+    asyncio.run(store.enroll("ramesh", [signature("Ramesh Kumar"), signature("R. K.")]))
+    verifier = FakeVerifier()
+    result = asyncio.run(store.verify("ramesh", signature("Ramesh Kumar", thickness=4), verifier))
+
+    assert len(verifier.calls) == 1
+    _, _, score, normalized = verifier.calls[0]
+    assert normalized
+    assert result["customer_id"] == "ramesh"
+    assert len(result["template_scores"]) == 2
+    scores = [item["score"] for item in result["template_scores"]]
+    assert scores == sorted(scores, reverse=True)
+    assert result["best_template_id"] == result["template_scores"][0]["template_id"]
+    assert result["template_scores"][0]["score"] == round(score, 4)
+    assert not result["identical_images"]
+
+
+def test_verify_flags_a_copy_of_the_specimen(store):
+    specimen = signature("Ramesh Kumar")
+    asyncio.run(store.enroll("ramesh", [specimen]))
+    result = asyncio.run(store.verify("ramesh", specimen, FakeVerifier()))
+    assert result["identical_images"]
+    assert not result["decided_locally"]
+
+
+def test_verify_unknown_customer(store):
+    with pytest.raises(KeyError):
+        asyncio.run(store.verify("nobody", signature("Ramesh Kumar"), FakeVerifier()))
+
+
+def test_search_ranks_the_signer_first(store):
+    for customer, name in [("ramesh", "Ramesh Kumar"), ("kavya", "Kavya Rao"), ("deepak", "Deepak")]:
+        asyncio.run(store.enroll(customer, [signature(name), signature(name, 2)]))
+    matches = asyncio.run(store.search(signature("Ramesh Kumar", thickness=4), top_k=2))
+    assert len(matches) == 2
+    assert matches[0]["customer_id"] == "ramesh"
+    # Best template per customer only
+    assert len({match["customer_id"] for match in matches}) == 2
+
+
+def test_search_sees_changes_from_another_worker(store):
+    other_worker = SignatureStore(store.path)
+    asyncio.run(other_worker.start())
+    assert asyncio.run(other_worker.search(signature("Kavya Rao"))) == []
+
+    asyncio.run(store.enroll("kavya", [signature("Kavya Rao")]))
+    assert [match["customer_id"] for match in asyncio.run(other_worker.search(signature("Kavya Rao")))] == ["kavya"]
+
+    assert asyncio.run(store.delete("kavya")) == 1
+    assert asyncio.run(other_worker.search(signature("Kavya Rao"))) == []
@@ -0,0 +1,121 @@
+"""
+Unit tests for request coalescing in app/singleflight.py.
+
+Run from server/fastapi_service with:
+
+    python -m pytest tests
+"""
+
+import asyncio
+
+import pytest
+
+from app.singleflight import SingleFlight, fingerprint, normalize_query
+
+
+def counting(result=None, error=None, delay=0.05):
+    calls = []
+
+    async def fn():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        if error is not None:
+            raise error
+        return result
+
+    return fn, calls
+
+
+def test_concurrent_callers_share_one_call():
+    flight = SingleFlight()
+    fn, calls = counting(result="answer")
+
+    async def run():
+        return await asyncio.gather(*(flight.do("key", fn) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["answer"] * 5
+    assert calls == [1]
+    assert len(flight) == 0
+
+
+def test_different_keys_run_separately():
+    flight = SingleFlight()
+    fn, calls = counting(result="answer")
+
+    async def run():
+        return await asyncio.gather(flight.do("a", fn), flight.do("b", fn))
+
+    asyncio.run(run())
+    assert calls == [1, 1]
+
+
+def test_result_is_not_cached_after_completion():
+    flight = SingleFlight()
+    fn, calls = counting(result="answer")
+
+    async def run():
+        await flight.do("key", fn)
+        await flight.do("key", fn)
+
+    asyncio.run(run())
+    assert calls == [1, 1]
+
+
+def test_every_caller_gets_the_exception():
+    flight = SingleFlight()
+    fn, calls = counting(error=ValueError("provider down"))
+
+    async def run():
+        return await asyncio.gather(*(flight.do("key", fn) for _ in range(3)), return_exceptions=True)
+
+    results = asyncio.run(run())
+    assert all(isinstance(result, ValueError) for result in results)
+    assert calls == [1]
+
+
+def test_one_caller_cancelling_keeps_the_call_for_the_others():
+    flight = SingleFlight()
+    fn, calls = counting(result="answer", delay=0.1)
+
+    async def run():
+        leaving = asyncio.ensure_future(flight.do("key", fn))
+        staying = asyncio.ensure_future(flight.do("key", fn))
+        await asyncio.sleep(0.01)
+        leaving.cancel()
+        return await staying
+
+    assert asyncio.run(run()) == "answer"
+    assert calls == [1]
+
+
+def test_last_caller_cancelling_cancels_the_call():
+    flight = SingleFlight()
+    cancelled = []
+
+    async def fn():
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+
+    async def run():
+        caller = asyncio.ensure_future(flight.do("key", fn))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await caller
+        await asyncio.sleep(0)
+
+    asyncio.run(run())
+    assert cancelled == [1]
+    assert len(flight) == 0
+
+
+def test_fingerprint_separates_parts():
+    assert fingerprint("ab", "c") != fingerprint("a", "bc")
+    assert fingerprint("query", b"bytes") == fingerprint("query", b"bytes")
+
+
+def test_normalize_query():
+    assert normalize_query("  What is  KYC?\n") == normalize_query("what is kyc?")
@@ -0,0 +1,116 @@
+"""
+Unit tests for the identity field checks in app/validators.py.
+
+Run from server/fastapi_service with:
+
+    python -m pytest tests
+"""
+
+from datetime import date, timedelta
+
+from app.schemas import AadhaarExtractedData, PANExtractedData
+from app.validators import (
+    field_failures,
+    field_validation,
+    is_masked_aadhaar_number,
+    is_valid_aadhaar_number,
+    is_valid_date_of_birth,
+    is_valid_pan_number,
+    parse_date,
+    verhoeff_valid,
+)
+
+
+def test_verhoeff_reference_vector():
+    # Worked example of the published algorithm: 236 has check digit 3
+    assert verhoeff_valid("2363")
+    assert not verhoeff_valid("2364")
+
+
+def test_verhoeff_catches_single_digit_and_transposition_errors():
+    number = "499118665246"
+    assert verhoeff_valid(number)
+    for position in range(len(number)):
+        for digit in "0123456789":
+            if digit != number[position]:
+                assert not verhoeff_valid(number[:position] + digit + number[position + 1:])
+    for position in range(len(number) - 1):
+        swapped = number[:position] + number[position + 1] + number[position] + number[position + 2:]
+        if swapped != number:
+            assert not verhoeff_valid(swapped)
+
+
+def test_aadhaar_number_accepts_printed_grouping():
+    assert is_valid_aadhaar_number("4991 1866 5246")
+    assert is_valid_aadhaar_number("4991-1866-5246")
+    assert is_valid_aadhaar_number("499118665246")
+
+
+def test_aadhaar_number_rejects_bad_structure_or_checksum():
+    assert not is_valid_aadhaar_number("4991 1866 5247")  # checksum
+    assert not is_valid_aadhaar_number("1234 1234 1236")  # never starts with 0 or 1
+    assert not is_valid_aadhaar_number("4991 1866 524")  # 11 digits
+    assert not is_valid_aadhaar_number(None)
+
+
+def test_masked_aadhaar_number():
+    assert is_masked_aadhaar_number("XXXX XXXX 5246")
+    assert is_masked_aadhaar_number("xxxx-xxxx-5246")
+    assert is_masked_aadhaar_number("**** **** 5246")
+    assert not is_masked_aadhaar_number("4991 1866 5246")
+    assert not is_masked_aadhaar_number("XXXX XXXX XXXX")
+    assert not is_masked_aadhaar_number("XXXX 1866 5246")
+
+
+def test_masked_aadhaar_is_reported_but_not_a_failure():
+    record = AadhaarExtractedData(aadhaar_number="XXXX XXXX 5246", date_of_birth="01/02/1990", pin_code="560001")
+    assert field_validation("aadhaar", record)["aadhaar_number"] == "masked"
+    assert field_failures("aadhaar", record) == []
+
+
+def test_missing_required_field_is_a_failure():
+    record = AadhaarExtractedData(date_of_birth="01/02/1990")
+    statuses = field_validation("aadhaar", record)
+    assert statuses["aadhaar_number"] == "missing"
+    assert statuses["pin_code"] == "missing"
+    # Only the Aadhaar number is required
+    assert field_failures("aadhaar", record) == ["aadhaar_number"]
+
+
+def test_pan_holder_type():
+    assert is_valid_pan_number("ABCPE1234F")  # individual
+    assert is_valid_pan_number("abcce1234f")  # company, read in lower case
+    assert is_valid_pan_number("ABCPE 1234F")
+    assert not is_valid_pan_number("ABCXE1234F")  # X is not a holder type
+    assert not is_valid_pan_number("ABCPE12345")
+    assert not is_valid_pan_number("ABCPE123F")
+
+
+def test_pan_field_validation():
+    record = PANExtractedData(pan_number="ABCXE1234F", date_of_birth="1990-02-01")
+    assert field_validation("pan", record) == {"pan_number": "invalid", "date_of_birth": "valid"}
+    assert field_failures("pan", record) == ["pan_number"]
+
+
+def test_parse_date_formats():
+    expected = date(1990, 2, 1)
+    for text in ("01/02/1990", "01-02-1990", "01.02.1990", "1990-02-01", "01 Feb 1990", "01 February 1990", " 01  Feb 1990 "):
+        assert parse_date(text) == expected, text
+
+
+def test_parse_date_year_of_birth_only():
+    assert parse_date("1985") == date(1985, 1, 1)
+    assert parse_date("1885") is None
+
+
+def test_parse_date_rejects_garbage():
+    assert parse_date("31/02/1990") is None
+    assert parse_date("1990/02/01") is None
+    assert parse_date("") is None
+    assert parse_date(None) is None
+
+
+def test_date_of_birth_range():
+    assert is_valid_date_of_birth("01/01/1900")
+    assert not is_valid_date_of_birth("31/12/1899")
+    assert not is_valid_date_of_birth((date.today() + timedelta(days=1)).strftime("%d/%m/%Y"))
@@ -0,0 +1,55 @@
+"""
+Unit tests for the binary pgvector transport in app/vector_codec.py.
+
+Run from server/fastapi_service with:
+
+    python -m pytest tests
+"""
+
+import base64
+import struct
+
+import numpy as np
+import pytest
+
+from app.vector_codec import decode_pgvector_batch, encode_pgvector, split_rows
+
+
+def test_float32_round_trip():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(3, 1536)).astype(np.float32)
+    decoded = decode_pgvector_batch([encode_pgvector(vector, "float32") for vector in vectors], "float32")
+    assert decoded.dtype == np.float32
+    assert decoded.shape == (3, 1536)
+    np.testing.assert_array_equal(decoded, vectors)
+
+
+def test_float16_round_trip_within_half_precision():
+    rng = np.random.default_rng(1)
+    vectors = rng.normal(size=(2, 256)).astype(np.float32)
+    decoded = decode_pgvector_batch([encode_pgvector(vector, "float16") for vector in vectors], "float16")
+    assert decoded.dtype == np.float32
+    np.testing.assert_allclose(decoded, vectors, rtol=1e-3, atol=1e-3)
+
+
+def test_matches_vector_send_layout():
+    # vector_send: uint16 dimension, uint16 unused, then big-endian float4 values
+    blob = base64.b64encode(struct.pack(">HH3f", 3, 0, 1.0, -2.5, 0.125)).decode("ascii")
+    assert encode_pgvector([1.0, -2.5, 0.125], "float32") == blob
+    np.testing.assert_array_equal(decode_pgvector_batch([blob], "float32"), [[1.0, -2.5, 0.125]])
+
+
+def test_empty_batch():
+    assert decode_pgvector_batch([], "float32").shape == (0, 0)
+
+
+def test_unknown_dtype():
+    with pytest.raises(KeyError):
+        decode_pgvector_batch([encode_pgvector([1.0])], "int8")
+
+
+def test_split_rows():
+    rows = [{"id": 1, "content": "a", "embedding_b64": "x"}, {"id": 2, "content": "b", "embedding_b64": "y"}]
+    records, blobs = split_rows(rows)
+    assert records == [{"id": 1, "content": "a"}, {"id": 2, "content": "b"}]
+    assert blobs == ["x", "y"]